@@ -0,0 +1,174 @@
+"""Response cache for Guerilla AI chat answers.
+
+Keys combine the normalized user message and the trimmed conversation
+window, so "Best power station?" and "best power station" share one entry.
+Keys are provider-agnostic: the router picks a provider per chat, and an
+answer from any of them serves the same question. Two backends are available: an in-process LRU with TTL
+(per worker) and a MongoDB collection with a TTL index (shared by workers).
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from memstore import is_memory
+
+logger = logging.getLogger(__name__)
+
+# Words that don't change what a camping question is asking for
+FILLER_WORDS = frozenset([
+    'a', 'an', 'the', 'please', 'hey', 'hi', 'yo', 'guerilla', 'so', 'just',
+    'um', 'uh', 'ok', 'okay', 'thanks', 'thank', 'you',
+])
+
+_NON_WORD = re.compile(r"[^\w\s$]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_message(message):
+    """Lowercase, strip punctuation and filler words, collapse whitespace"""
+    text = _NON_WORD.sub(' ', (message or '').lower())
+    words = [word for word in _SPACES.split(text) if word and word not in FILLER_WORDS]
+    return ' '.join(words)
+
+
+def make_key(message, conversation_history, window=5):
+    """Cache key for a message and the last ``window`` history turns
+
+    Pass ``window=None`` when the history has already been trimmed.
+    """
+    history = conversation_history or []
+    if window is not None:
+        history = history[-window:]
+    history = [[msg.get('role'), normalize_message(msg.get('content'))] for msg in history]
+    payload = json.dumps([normalize_message(message), history], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MongoCacheBackend:
+    """Cache stored in a MongoDB collection, expired by a TTL index on ``created_at``"""
+
+    def __init__(self, collection, ttl=3600):
+        self.collection = collection
+        self.ttl = ttl
+
+    def ensure_indexes(self):
+        self.collection.create_index('created_at', expireAfterSeconds=self.ttl)
+
+    def get(self, key):
+        # The TTL monitor only runs once a minute, so check the age here too
+        doc = self.collection.find_one({
+            '_id': key,
+            'created_at': {'$gt': datetime.utcnow() - timedelta(seconds=self.ttl)}
+        })
+        return doc['value'] if doc else None
+
+    def set(self, key, value):
+        self.collection.replace_one(
+            {'_id': key},
+            {'_id': key, 'value': value, 'created_at': datetime.utcnow()},
+            upsert=True
+        )
+
+
+class ResponseCache:
+    """Counts hits and misses in front of a cache backend"""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.saved_cost = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached ``{'response', 'estimated_cost'}`` entry, or None"""
+        if self.backend is None:
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.warning("AI cache lookup failed: %s", e, exc_info=True)
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.saved_cost += value.get('estimated_cost', 0)
+        return value
+
+    def peek(self, key):
+        """Like ``get`` but without counting a hit or miss"""
+        if self.backend is None:
+            return None
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            logger.warning("AI cache lookup failed: %s", e, exc_info=True)
+            return None
+
+    def set(self, key, response, estimated_cost):
+        if self.backend is None:
+            return
+        try:
+            self.backend.set(key, {'response': response, 'estimated_cost': estimated_cost})
+        except Exception as e:
+            logger.warning("AI cache write failed: %s", e, exc_info=True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': type(self.backend).__name__ if self.backend else None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'estimated_cost_saved': self.saved_cost
+            }
+
+
+def create_response_cache(backend_name, db, max_entries=1000, ttl=3600):
+    """Build the response cache selected by ``AI_CACHE_BACKEND``"""
+    if backend_name == 'mongo' and not is_memory(db):
+        return ResponseCache(MongoCacheBackend(db.ai_response_cache, ttl=ttl))
+    if backend_name in ('memory', 'mongo'):
+        # Mongo falls back to the in-process cache when running without MongoDB
+        return ResponseCache(MemoryCacheBackend(max_entries=max_entries, ttl=ttl))
+    return ResponseCache(None)
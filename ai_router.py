@@ -0,0 +1,252 @@
+"""Chooses which AI provider answers a chat, with failover and hedged requests.
+
+Every call is recorded in a rolling window per provider: the last
+``window`` calls, ignoring any older than ``max_age`` seconds. A provider is
+skipped while ``is_available(name)`` says no (not configured, or its circuit
+breaker is open). It is demoted behind the others when more than
+``max_error_rate`` of its recent calls failed. ``ranked()`` orders the rest
+by expected latency: the median inflated by the error rate. A provider
+without ``min_samples`` recent calls keeps its configured place, so the
+primary (AI_PROVIDER) is used until the data says another one is better.
+``explore_rate`` of requests go to the runner-up to keep its numbers fresh.
+
+``call()`` tries the ranked providers in turn until one answers. With
+``hedge=True`` it also starts the next provider when the first has not
+answered within its p95 latency, clamped to ``hedge_min_delay`` ..
+``hedge_max_delay``, and returns whichever answer arrives first. The slower
+call finishes in the background and its result goes to ``on_discard``, so
+its cost can still be recorded.
+"""
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class NoProviderAvailable(Exception):
+    """No provider is configured and healthy"""
+
+
+class ProviderWindow:
+    """Latency and outcome of a provider's recent calls"""
+
+    def __init__(self, size=50, max_age=300.0):
+        self.max_age = max_age
+        self._calls = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok=True):
+        with self._lock:
+            self._calls.append((time.monotonic(), seconds, ok))
+
+    def summary(self):
+        """samples, error_rate, p50 and p95 (seconds, successful calls only) of the recent calls"""
+        cutoff = time.monotonic() - self.max_age
+        with self._lock:
+            while self._calls and self._calls[0][0] < cutoff:
+                self._calls.popleft()
+            calls = list(self._calls)
+        latencies = sorted(seconds for _, seconds, ok in calls if ok)
+
+        def percentile(q):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        failures = sum(1 for _, _, ok in calls if not ok)
+        return {
+            'samples': len(calls),
+            'error_rate': failures / len(calls) if calls else 0.0,
+            'p50': percentile(0.50),
+            'p95': percentile(0.95),
+        }
+
+
+class ProviderRouter:
+    """Ranks providers by recent latency and errors; runs calls with failover and optional hedging"""
+
+    def __init__(self, providers, is_available=None, window=50, max_age=300.0, min_samples=5, max_error_rate=0.5,
+                 error_penalty=4.0, explore_rate=0.0, hedge_min_delay=0.5, hedge_max_delay=5.0):
+        self.providers = list(providers)
+        self.is_available = is_available or (lambda provider: True)
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.error_penalty = error_penalty
+        self.explore_rate = explore_rate
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self._windows = {provider: ProviderWindow(window, max_age) for provider in self.providers}
+        self._lock = threading.Lock()
+        self._counters = {'failovers': 0, 'hedges': 0, 'hedge_wins': 0, 'explored': 0}
+        self._served = dict.fromkeys(self.providers, 0)
+
+    # --- RANKING ---
+    def record(self, provider, seconds, ok=True):
+        window = self._windows.get(provider)
+        if window is not None:
+            window.record(seconds, ok)
+
+    def ranked(self):
+        """Available providers to try for a call, best first; the unhealthy ones go last, as a last resort
+
+        Now and then the runner-up is tried first, to keep its numbers current.
+        """
+        ranked, healthy = self._ranking()
+        if healthy > 1 and self.explore_rate and random.random() < self.explore_rate:
+            ranked[0], ranked[1] = ranked[1], ranked[0]
+            self._count('explored')
+        return ranked
+
+    def _ranking(self):
+        """``(providers best first, how many of them are healthy)``, without exploring"""
+        healthy, unhealthy = [], []
+        for position, provider in enumerate(self.providers):
+            if not self.is_available(provider):
+                continue
+            summary = self._windows[provider].summary()
+            if summary['samples'] >= self.min_samples and summary['error_rate'] > self.max_error_rate:
+                unhealthy.append(provider)
+            else:
+                healthy.append((self._score(summary, position), position, provider))
+        return [provider for _, _, provider in sorted(healthy)] + unhealthy, len(healthy)
+
+    def _score(self, summary, position):
+        if summary['samples'] < self.min_samples or summary['p50'] is None:
+            # Not enough data: the primary stays first, the others wait behind any measured provider
+            return 0.0 if position == 0 else float('inf')
+        return summary['p50'] * (1 + self.error_penalty * summary['error_rate'])
+
+    def hedge_delay(self, provider):
+        """Seconds to wait for ``provider`` before starting a hedged call"""
+        summary = self._windows[provider].summary()
+        if summary['samples'] < self.min_samples or summary['p95'] is None:
+            return self.hedge_max_delay
+        return min(max(summary['p95'], self.hedge_min_delay), self.hedge_max_delay)
+
+    # --- CALLING ---
+    def call(self, fn, hedge=False, on_discard=None):
+        """Run ``fn(provider)`` on the best provider, failing over down the ranking.
+
+        Returns ``(provider, result)``. Raises the last provider's error when
+        they all failed, or ``NoProviderAvailable`` when none could be tried.
+        """
+        ranked = self.ranked()
+        if not ranked:
+            raise NoProviderAvailable('no AI provider available')
+        if hedge and len(ranked) > 1:
+            return self._call_hedged(ranked, fn, on_discard)
+        last_error = None
+        for index, provider in enumerate(ranked):
+            if index:
+                self._count('failovers')
+            try:
+                result = self._attempt(provider, fn)
+            except Exception as e:
+                logger.warning("AI provider %s failed: %s", provider, e)
+                last_error = e
+                continue
+            self._served_by(provider)
+            return provider, result
+        raise last_error
+
+    def _attempt(self, provider, fn):
+        started = time.perf_counter()
+        try:
+            result = fn(provider)
+        except Exception:
+            self.record(provider, time.perf_counter() - started, ok=False)
+            raise
+        self.record(provider, time.perf_counter() - started)
+        return result
+
+    def _call_hedged(self, ranked, fn, on_discard):
+        results = queue.Queue()
+        started = []
+
+        def start(provider):
+            started.append(provider)
+
+            def run():
+                try:
+                    results.put((provider, self._attempt(provider, fn), None))
+                except Exception as e:
+                    results.put((provider, None, e))
+
+            threading.Thread(target=run, name=f'ai-{provider}', daemon=True).start()
+
+        start(ranked[0])
+        pending = 1
+        hedged = False
+        try:
+            item = results.get(timeout=self.hedge_delay(ranked[0]))
+        except queue.Empty:
+            # Slow primary: race the next provider against it
+            self._count('hedges')
+            start(ranked[1])
+            pending += 1
+            hedged = True
+            item = results.get()
+
+        last_error = None
+        while True:
+            pending -= 1
+            provider, result, error = item
+            if error is None:
+                if hedged and provider == ranked[1]:
+                    self._count('hedge_wins')
+                self._served_by(provider)
+                if pending:
+                    self._discard_later(results, pending, on_discard)
+                return provider, result
+            logger.warning("AI provider %s failed: %s", provider, error)
+            last_error = error
+            if len(started) < len(ranked):
+                self._count('failovers')
+                start(ranked[len(started)])
+                pending += 1
+            elif not pending:
+                raise last_error
+            item = results.get()
+
+    def _discard_later(self, results, pending, on_discard):
+        def drain():
+            for _ in range(pending):
+                provider, result, error = results.get()
+                if error is None and on_discard is not None:
+                    try:
+                        on_discard(provider, result)
+                    except Exception as e:
+                        logger.warning("Recording the discarded %s answer failed: %s", provider, e)
+
+        threading.Thread(target=drain, name='ai-hedge-drain', daemon=True).start()
+
+    # --- STATS ---
+    def _served_by(self, provider):
+        with self._lock:
+            self._served[provider] += 1
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._counters)
+            served = dict(self._served)
+        result['ranking'] = self._ranking()[0]
+        result['providers'] = {}
+        for provider in self.providers:
+            summary = self._windows[provider].summary()
+            result['providers'][provider] = {
+                'available': self.is_available(provider),
+                'served': served[provider],
+                'samples': summary['samples'],
+                'error_rate': round(summary['error_rate'], 4),
+                'p50_ms': round(summary['p50'] * 1000, 1) if summary['p50'] is not None else None,
+                'p95_ms': round(summary['p95'] * 1000, 1) if summary['p95'] is not None else None,
+            }
+        return result
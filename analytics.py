@@ -0,0 +1,161 @@
+"""Pre-aggregated analytics rollups.
+
+Every tracked event adds ``$inc`` counters to one rollup document per
+(dimension, key, day), e.g. ``product:jackery-explorer-240:2025-07-01``.
+The dashboard summary then reads a handful of small documents instead of
+scanning ``ai_usage`` and ``affiliate_clicks``. ``rebuild()`` (run through
+``backfill_rollups.py``) recomputes them from the raw collections.
+
+``compact()`` folds a day of raw events into one weighted event per product
+or provider (``export_events.py --compact``). Those events add exactly the
+counters the raw ones did, so rollups rebuilt after compaction don't change.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COLLECTION = 'analytics_rollups'
+COUNTERS = (
+    'affiliate_clicks', 'subscribers', 'ai_interactions', 'estimated_ai_cost',
+    'prompt_tokens', 'completion_tokens', 'ai_cache_hits', 'estimated_ai_cost_saved', 'ai_coalesced',
+)
+# group_by parameter -> rollup dimension
+GROUP_BY = {
+    'day': 'total',
+    'product': 'product',
+    'provider': 'provider',
+    'source': 'source',
+}
+
+
+def event_day(timestamp):
+    """YYYY-MM-DD for a datetime or an ISO string (in-memory documents)"""
+    if isinstance(timestamp, datetime):
+        return timestamp.strftime('%Y-%m-%d')
+    if isinstance(timestamp, str) and len(timestamp) >= 10:
+        return timestamp[:10]
+    return datetime.utcnow().strftime('%Y-%m-%d')
+
+
+def interaction_weight(document):
+    """How many chats an ``ai_usage`` event stands for: 0 for the losing answer of a hedge"""
+    return 0 if document.get('hedged') else document.get('weight', 1)
+
+
+def increments_for(collection, document):
+    """[(dimension, key, {counter: amount})] contributed by one raw event"""
+    if collection == 'affiliate_clicks':
+        # Sampled and spike-aggregated clicks stand for ``weight`` clicks
+        counters = {'affiliate_clicks': document.get('weight', 1)}
+        return [('total', None, counters), ('product', document.get('product_id') or 'unknown', counters)]
+    if collection == 'subscribers':
+        counters = {'subscribers': 1}
+        return [('total', None, counters), ('source', document.get('source') or 'general', counters)]
+    if collection == 'ai_usage':
+        # Compacted events stand for ``weight`` interactions and carry counts in cache_hit/coalesced.
+        # A hedge loser is billed, but its chat was already counted with the winning answer.
+        counters = {
+            'ai_interactions': interaction_weight(document),
+            'estimated_ai_cost': document.get('estimated_cost', 0),
+            'prompt_tokens': document.get('prompt_tokens', 0),
+            'completion_tokens': document.get('completion_tokens', 0),
+        }
+        if document.get('cache_hit'):
+            counters['ai_cache_hits'] = int(document['cache_hit'])
+            counters['estimated_ai_cost_saved'] = document.get('saved_cost', 0)
+        if document.get('coalesced'):
+            counters['ai_coalesced'] = int(document['coalesced'])
+        return [('total', None, counters), ('provider', document.get('provider') or 'unknown', counters)]
+    return []
+
+
+def compact(collection, documents, day):
+    """One weighted event per product (clicks) or provider (AI usage) for a day of ``collection`` events"""
+    timestamp = datetime.strptime(day, '%Y-%m-%d')
+    groups = {}
+    for document in documents:
+        if collection == 'affiliate_clicks':
+            key = document.get('product_id')
+            group = groups.setdefault(key, {'product_id': key, 'weight': 0})
+            group['weight'] += document.get('weight', 1)
+        elif collection == 'ai_usage':
+            key = document.get('provider')
+            group = groups.setdefault(key, dict.fromkeys(
+                ('weight', 'estimated_cost', 'prompt_tokens', 'completion_tokens', 'cache_hit', 'saved_cost',
+                 'coalesced'), 0))
+            group['provider'] = key
+            group['weight'] += interaction_weight(document)
+            for field in ('estimated_cost', 'prompt_tokens', 'completion_tokens'):
+                group[field] += document.get(field) or 0
+            if document.get('cache_hit'):
+                group['cache_hit'] += int(document['cache_hit'])
+                group['saved_cost'] += document.get('saved_cost') or 0
+            group['coalesced'] += int(document.get('coalesced') or 0)
+        else:
+            raise ValueError(f"Cannot compact '{collection}'")
+    return [dict(group, timestamp=timestamp, aggregated=True) for group in groups.values()]
+
+
+class Rollups:
+    """Reads and writes rollup documents through a ``storage`` repository"""
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    # --- WRITES ---
+    def record(self, collection, documents):
+        """Fold a batch of raw events into the rollups with one write per rollup document"""
+        merged = defaultdict(lambda: defaultdict(int))
+        for document in documents:
+            day = event_day(document.get('timestamp'))
+            for dimension, key, counters in increments_for(collection, document):
+                for counter, amount in counters.items():
+                    merged[(dimension, key, day)][counter] += amount
+        if merged:
+            self.repository.increment_rollups(merged)
+
+    # --- READS ---
+    def summary(self, start=None, end=None, group_by=None):
+        """Totals for the date range, plus per-group rows when ``group_by`` is given"""
+        result = self._totals(self._find('total', start, end))
+        if group_by:
+            groups = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+            for doc in self._find(GROUP_BY[group_by], start, end):
+                row = groups[doc['key']]
+                for counter in COUNTERS:
+                    row[counter] += doc.get(counter, 0)
+            result['groups'] = [dict(key=key, **row) for key, row in sorted(groups.items())]
+        return result
+
+    def _find(self, dimension, start, end):
+        return self.repository.find_rollups(dimension, start, end)
+
+    @staticmethod
+    def _totals(docs):
+        totals = dict.fromkeys(COUNTERS, 0)
+        for doc in docs:
+            for counter in COUNTERS:
+                totals[counter] += doc.get(counter, 0)
+        return totals
+
+    # --- BACKFILL ---
+    def rebuild(self, batch_size=1000):
+        """Drop the rollups and recompute them from the raw collections"""
+        self.repository.clear_rollups()
+        fields = {
+            'affiliate_clicks': ('timestamp', 'product_id', 'weight'),
+            'subscribers': ('timestamp', 'source'),
+            'ai_usage': ('timestamp', 'provider', 'estimated_cost', 'prompt_tokens', 'completion_tokens',
+                         'cache_hit', 'saved_cost', 'coalesced', 'weight', 'hedged'),
+        }
+        for collection, wanted in fields.items():
+            batch = []
+            for document in self.repository.iter_events(collection, wanted, batch_size=batch_size):
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    self.record(collection, batch)
+                    batch = []
+            self.record(collection, batch)
+            logger.info("Rebuilt rollups from %s", collection)
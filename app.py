@@ -4,48 +4,256 @@ import json
 import random
 import time
 from datetime import datetime
-from flask import Flask, render_template, jsonify, request, redirect, url_for, session
+from flask import Flask, render_template, jsonify, request, url_for, Response, stream_with_context, g
 from flask_cors import CORS
-import requests
-from opencensus.ext.azure.log_exporter import AzureLogHandler
+from werkzeug.middleware.proxy_fix import ProxyFix
+import http_client
+import ai_router
 import logging
+import atexit
+import threading
+from events import EventPipeline
+import ai_cache
+import mailerlite_sync
+import analytics
+import blog_cache
+import redirects
+import snapshots
+import pagination
+import conversations
+import prompts
+import singleflight
+import ratelimit
+import memstore
+import storage
+import telemetry
+from lazy import Lazy
+import catalog
+from catalog import ProductCatalog
+from db_indexes import ensure_indexes
 
 
 # --- FLASK SETUP ---
-app = Flask(__name__)
+app = Flask(__name__, template_folder='.')  # Pages live at the repo root, shared with the static site
 app.secret_key = os.environ.get('SECRET_KEY', 'gorilla-secret-2025')
-CORS(app, supports_credentials=True)  # Enable CORS for API access from static frontend
+# Proxies in front of the app (the Azure/Heroku router); their X-Forwarded-For/-Proto give the client's
+# address, which the per-IP rate limit needs. Set by the deploy config only: without a proxy the client
+# would write those headers itself, so the default (0) ignores them.
+PROXY_FIX_HOPS = int(os.environ.get('PROXY_FIX_HOPS', 0))
+if PROXY_FIX_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_FIX_HOPS, x_proto=PROXY_FIX_HOPS)
 
 logger = logging.getLogger(__name__)
-logger.addHandler(AzureLogHandler(connection_string=os.environ[InstrumentationKey=bc1d26ba-0d5d-4b48-8a95-8890aff793b5;IngestionEndpoint=https://eastus-8.in.applicationinsights.azure.com/;LiveEndpoint=https://eastus.livediagnostics.monitor.azure.com/;ApplicationId=5b75eaaf-63d2-4e57-a3ea-b1522e0b69f3]))
-
+appinsights_connection_string = os.environ.get('APPLICATIONINSIGHTS_CONNECTION_STRING')
 
+# --- TELEMETRY (latency histograms; a sample of the records exported in the background) ---
+TELEMETRY_EXPORTER = os.environ.get('TELEMETRY_EXPORTER', 'azure' if appinsights_connection_string else 'none')  # none, console, file, azure
+TELEMETRY_FILE = os.environ.get('TELEMETRY_FILE', 'telemetry.ndjson')
+TELEMETRY_SAMPLE_RATE = float(os.environ.get('TELEMETRY_SAMPLE_RATE', 0.1))  # Share of records exported; errors always are
+TELEMETRY_BATCH_SIZE = int(os.environ.get('TELEMETRY_BATCH_SIZE', 200))
+TELEMETRY_FLUSH_INTERVAL = float(os.environ.get('TELEMETRY_FLUSH_INTERVAL', 5.0))
+metrics = telemetry.Telemetry(
+    telemetry.create_exporter(TELEMETRY_EXPORTER, TELEMETRY_FILE, appinsights_connection_string),
+    sample_rate=TELEMETRY_SAMPLE_RATE,
+    batch_size=TELEMETRY_BATCH_SIZE,
+    flush_interval=TELEMETRY_FLUSH_INTERVAL,
+    max_queue=int(os.environ.get('TELEMETRY_QUEUE_SIZE', 10000))
+)
+atexit.register(metrics.stop)
 
 # --- MONGODB SETUP (if available) ---
 mongodb_uri = os.environ.get('MONGODB_URI')
 if mongodb_uri:
     from pymongo import MongoClient
-    client = MongoClient(mongodb_uri)
+    # connect=False: no connection until the first query; indexes are created in create_app()
+    client = MongoClient(mongodb_uri, connect=False, event_listeners=[telemetry.MongoCommandTimer(metrics)])
     db = client.get_default_database()
 else:
-    # Fallback to in-memory storage for development
-    db = {
-        'posts': [],
-        'subscribers': [],
-        'affiliate_clicks': [],
-        'ai_usage': []
-    }
+    # Fallback to the in-memory store for development and preview instances
+    memory_snapshot_path = os.environ.get('MEMORY_SNAPSHOT_PATH')  # Persist across restarts when set
+    if memory_snapshot_path and int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+        # Every worker has its own store and would overwrite the others' snapshot
+        logger.warning("MEMORY_SNAPSHOT_PATH needs a single worker (WEB_CONCURRENCY=1); snapshots are off")
+        memory_snapshot_path = None
+    db = memstore.MemoryDatabase(
+        max_events=int(os.environ.get('MEMORY_MAX_EVENTS', 10000)),  # Per event stream; oldest dropped first
+        snapshot_path=memory_snapshot_path,
+        snapshot_interval=float(os.environ.get('MEMORY_SNAPSHOT_INTERVAL', 300))
+    )
+    ensure_indexes(db)
+
+# --- STORAGE (subscribers, posts, tracking events, rollups) ---
+# mongo, sqlite (one local WAL-mode file, single-node deployments) or memory
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo' if mongodb_uri else 'memory')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'gorillacamping.db')
+repository = storage.create_repository(STORAGE_BACKEND, db, sqlite_path=SQLITE_PATH)
+atexit.register(repository.close)
 
 # --- ENVIRONMENT VARIABLES ---
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
+OPENAI_API_BASE = os.environ.get('OPENAI_API_BASE')  # e.g. a proxy, or the load-test stubs
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://localhost:11434')
 AI_PROVIDER = os.environ.get('AI_PROVIDER', 'gemini')  # 'openai', 'gemini', 'ollama', 'huggingface'
+# Providers the router may use, in order of preference; a provider is skipped until it is configured
+AI_PROVIDERS = [name.strip() for name in os.environ.get('AI_PROVIDERS', '').split(',') if name.strip()] or \
+    [AI_PROVIDER] + [name for name in ('gemini', 'openai', 'ollama') if name != AI_PROVIDER]
+OLLAMA_ENABLED = 'OLLAMA_URL' in os.environ or 'ollama' in os.environ.get('AI_PROVIDERS', '')
+AI_ROUTER_WINDOW = int(os.environ.get('AI_ROUTER_WINDOW', 50))  # recent calls per provider used for ranking
+AI_ROUTER_MAX_ERROR_RATE = float(os.environ.get('AI_ROUTER_MAX_ERROR_RATE', 0.5))
+AI_ROUTER_EXPLORE_RATE = float(os.environ.get('AI_ROUTER_EXPLORE_RATE', 0.02))
+AI_HEDGE = os.environ.get('AI_HEDGE', 'false').lower() == 'true'  # second provider for slow non-streamed chats
+AI_HEDGE_MIN_DELAY = float(os.environ.get('AI_HEDGE_MIN_DELAY', 0.5))
+AI_HEDGE_MAX_DELAY = float(os.environ.get('AI_HEDGE_MAX_DELAY', 5))
 STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY')
 STATIC_SITE_URL = os.environ.get('STATIC_SITE_URL', 'https://gorillacamping.site')
+EVENT_BATCH_SIZE = int(os.environ.get('EVENT_BATCH_SIZE', 100))
+EVENT_FLUSH_INTERVAL = float(os.environ.get('EVENT_FLUSH_INTERVAL', 1.0))
+EVENT_QUEUE_SIZE = int(os.environ.get('EVENT_QUEUE_SIZE', 10000))
+AI_CACHE_BACKEND = os.environ.get('AI_CACHE_BACKEND', 'memory')  # 'memory', 'mongo', 'none'
+AI_CACHE_TTL = int(os.environ.get('AI_CACHE_TTL', 3600))
+AI_CACHE_SIZE = int(os.environ.get('AI_CACHE_SIZE', 1000))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+AI_COALESCE = os.environ.get('AI_COALESCE', 'memory')  # 'memory' (per worker) or 'mongo' (across workers)
+AI_COALESCE_WAIT = float(os.environ.get('AI_COALESCE_WAIT', 30))
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # 'memory' (per worker) or 'mongo' (shared)
+# Provider calls allowed as "burst/seconds to refill the burst"
+RATE_LIMIT_VISITOR = os.environ.get('RATE_LIMIT_VISITOR', '10/600')
+RATE_LIMIT_IP = os.environ.get('RATE_LIMIT_IP', '30/600')
+RATE_LIMIT_GLOBAL = os.environ.get('RATE_LIMIT_GLOBAL', '600/600')
+AI_DAILY_BUDGET = float(os.environ.get('AI_DAILY_BUDGET', 5.0))  # Dollars per rolling 24h, 0 to disable
+AI_VISITOR_DAILY_BUDGET = float(os.environ.get('AI_VISITOR_DAILY_BUDGET', 0.05))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 2))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get('CIRCUIT_RESET_TIMEOUT', 30))
+BLOG_CACHE_CHECK_INTERVAL = float(os.environ.get('BLOG_CACHE_CHECK_INTERVAL', 30))
+BLOG_CACHE_MAX_AGE = int(os.environ.get('BLOG_CACHE_MAX_AGE', 60))
+GEAR_CACHE_MAX_AGE = int(os.environ.get('GEAR_CACHE_MAX_AGE', 300))
+CONVERSATION_STORE = os.environ.get('CONVERSATION_STORE', 'memory')  # 'memory' or 'mongo'
+CONVERSATION_MAX_MESSAGES = int(os.environ.get('CONVERSATION_MAX_MESSAGES', 20))
+CONVERSATION_TTL = int(os.environ.get('CONVERSATION_TTL', 7 * 24 * 3600))
+HISTORY_TOKEN_BUDGET = int(os.environ.get('HISTORY_TOKEN_BUDGET', 600))
+OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama2')
+OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '30m')
+OLLAMA_CONTEXT_CACHE_SIZE = int(os.environ.get('OLLAMA_CONTEXT_CACHE_SIZE', 1000))
+PRODUCT_CATALOG_SOURCE = os.environ.get('PRODUCT_CATALOG_SOURCE', 'file')  # 'file' or 'mongo'
+MAX_RECOMMENDATIONS = int(os.environ.get('MAX_RECOMMENDATIONS', 3))
+MAILERLITE_API_KEY = os.environ.get('MAILERLITE_API_KEY')
+MAILERLITE_GROUP_ID = os.environ.get('MAILERLITE_GROUP_ID')  # Looked up from the 'Welcome' group if unset
+MAILERLITE_SYNC_INTERVAL = float(os.environ.get('MAILERLITE_SYNC_INTERVAL', 30))
+LINK_RELOAD_INTERVAL = float(os.environ.get('LINK_RELOAD_INTERVAL', 30))  # 0 = reload only via /api/admin/reload-links
+CLICK_SAMPLE_RATE = float(os.environ.get('CLICK_SAMPLE_RATE', 1.0))
+CLICK_SPIKE_THRESHOLD = int(os.environ.get('CLICK_SPIKE_THRESHOLD', 200))  # clicks/s per worker logged one by one; 0 = no limit
+CLICK_AGGREGATE_INTERVAL = float(os.environ.get('CLICK_AGGREGATE_INTERVAL', 5))
 
-# Import CORS package
-from flask_cors import CORS
+# --- PRODUCT CATALOG AND REDIRECT TABLES (shared by /api/gear, /affiliate and chat recommendations) ---
+def catalog_from_mongo():
+    return PRODUCT_CATALOG_SOURCE == 'mongo' and not memstore.is_memory(db)
+
+def load_link_tables():
+    """Reload the product catalog and build the redirect tables from it and the social links file"""
+    global product_catalog
+    product_catalog = ProductCatalog.from_mongo(db.products) if catalog_from_mongo() else ProductCatalog.from_file()
+    return {'affiliate': product_catalog.links(), 'social': redirects.load_social_links()}
+
+def link_tables_version():
+    return redirects.file_version(catalog.DEFAULT_CATALOG_PATH, redirects.DEFAULT_SOCIAL_LINKS_PATH)
+
+# Loads the catalog now; edits to the files (or, for a Mongo catalog, every interval) are picked up live
+product_catalog = None
+link_tables = redirects.LinkTables(
+    load_link_tables,
+    version=None if catalog_from_mongo() else link_tables_version,
+    check_interval=LINK_RELOAD_INTERVAL
+)
+
+# --- ANALYTICS ROLLUPS (per-day counters maintained as events are written) ---
+rollups = analytics.Rollups(repository)
+
+# --- EVENT PIPELINE (batched tracking writes off the request path) ---
+event_pipeline = EventPipeline(
+    repository,
+    batch_size=EVENT_BATCH_SIZE,
+    flush_interval=EVENT_FLUSH_INTERVAL,
+    max_queue=EVENT_QUEUE_SIZE,
+    on_write=rollups.record,
+    enrich={'affiliate_clicks': redirects.enrich_click}
+)
+click_recorder = redirects.ClickRecorder(
+    event_pipeline.emit,
+    sample_rate=CLICK_SAMPLE_RATE,
+    spike_threshold=CLICK_SPIKE_THRESHOLD,
+    aggregate_interval=CLICK_AGGREGATE_INTERVAL
+)
+
+def stop_event_pipeline():
+    click_recorder.flush()
+    event_pipeline.stop()
+
+atexit.register(stop_event_pipeline)  # gunicorn.conf.py also stops it in worker_exit
+
+# --- OUTBOUND HTTP (pooled, with timeouts, retries and circuit breakers) ---
+def record_upstream_attempt(upstream, seconds, error):
+    metrics.record('upstream', upstream, seconds * 1000, error=error)
+
+outbound = http_client.HTTPClient(
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+    max_retries=HTTP_MAX_RETRIES,
+    pool_size=HTTP_POOL_SIZE,
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=CIRCUIT_RESET_TIMEOUT,
+    on_attempt=record_upstream_attempt
+)
+
+# --- AI PROVIDER ROUTER (rolling latency/error window per provider, failover and hedging) ---
+def ai_provider_available(provider):
+    """Configured, and its circuit breaker is not open"""
+    configured = {
+        'openai': bool(OPENAI_API_KEY),
+        'gemini': bool(GEMINI_API_KEY),
+        'ollama': AI_PROVIDER == 'ollama' or OLLAMA_ENABLED,
+    }.get(provider, False)
+    return configured and outbound.is_healthy(provider)
+
+provider_router = ai_router.ProviderRouter(
+    AI_PROVIDERS,
+    is_available=ai_provider_available,
+    window=AI_ROUTER_WINDOW,
+    max_error_rate=AI_ROUTER_MAX_ERROR_RATE,
+    explore_rate=AI_ROUTER_EXPLORE_RATE,
+    hedge_min_delay=AI_HEDGE_MIN_DELAY,
+    hedge_max_delay=AI_HEDGE_MAX_DELAY
+)
+
+# --- MAILERLITE OUTBOX (subscribers synced off the request path) ---
+mailerlite_outbox = None
+if MAILERLITE_API_KEY:
+    mailerlite_outbox = mailerlite_sync.MailerLiteSync(
+        repository, outbound, MAILERLITE_API_KEY,
+        group_id=MAILERLITE_GROUP_ID,
+        interval=MAILERLITE_SYNC_INTERVAL
+    )
+
+# --- AI RESPONSE CACHE ---
+response_cache = ai_cache.create_response_cache(AI_CACHE_BACKEND, db, max_entries=AI_CACHE_SIZE, ttl=AI_CACHE_TTL)
+ai_gate = ratelimit.create_ai_gate(
+    RATE_LIMIT_BACKEND, db,
+    rates={
+        'visitor': ratelimit.parse_rate(RATE_LIMIT_VISITOR),
+        'ip': ratelimit.parse_rate(RATE_LIMIT_IP),
+        'global': ratelimit.parse_rate(RATE_LIMIT_GLOBAL),
+    },
+    visitor_budget=AI_VISITOR_DAILY_BUDGET,
+    global_budget=AI_DAILY_BUDGET
+)
+inflight = singleflight.create_single_flight(AI_COALESCE, db, response_cache, wait_timeout=AI_COALESCE_WAIT)
+
+# --- CONVERSATION STORE (chat history kept server-side, keyed by visitor_id) ---
+conversation_store = conversations.create_conversation_store(
+    CONVERSATION_STORE, db, max_messages=CONVERSATION_MAX_MESSAGES, ttl=CONVERSATION_TTL)
 
 def configure_cors(app):
     """Configure CORS for the Flask application"""
@@ -59,50 +267,153 @@ def configure_cors(app):
         "http://127.0.0.1:5000"             # Local Flask development
     ]
     
-    # Apply CORS settings
+    # Apply CORS settings (only the API is fetched cross-origin; pages and redirects skip the checks)
     CORS(app, 
+         resources=r"/api/*",
          origins=allowed_origins, 
          supports_credentials=True,
          allow_headers=["Content-Type", "Authorization"],
          methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-         expose_headers=["Content-Range", "X-Total-Count"]
+         expose_headers=["Content-Range", "X-Total-Count", "X-Next-Cursor"]
     )
     
     return app
+
+configure_cors(app)  # Enable CORS for API access from static frontend
+
+# --- APP FACTORY (one-time setup, deferred until the worker needs it) ---
+def configure_log_exporter():
+    """Attach the Application Insights log exporter, if configured"""
+    if not appinsights_connection_string:
+        return None
+    # Heavy import (the Azure SDK), only paid when telemetry is actually on
+    from opencensus.ext.azure.log_exporter import AzureLogHandler
+    handler = AzureLogHandler(connection_string=appinsights_connection_string,
+                              export_interval=TELEMETRY_FLUSH_INTERVAL, max_batch_size=TELEMETRY_BATCH_SIZE)
+    logger.addHandler(handler)
+    return handler
+
+def setup_indexes():
+    """Create the Mongo indexes (app collections plus the backends' own TTL indexes)"""
+    owners = [backend for backend in (response_cache.backend, ai_gate.buckets, ai_gate.spend, inflight.lock,
+                                      conversation_store)
+              if hasattr(backend, 'ensure_indexes')]
+    return ensure_indexes(db, owners=owners)
+
+def setup_app():
+    log_exporter.get()
+    if not memstore.is_memory(db):
+        # Index builds are round trips to MongoDB; keep them off the first request
+        threading.Thread(target=setup_indexes, name='mongo-indexes', daemon=True).start()
+    if mailerlite_outbox:
+        mailerlite_outbox.ensure_started()
+    return app
+
+log_exporter = Lazy(configure_log_exporter, name='log_exporter')
+app_setup = Lazy(setup_app, name='app_setup')
+
+def load_openai():
+    import openai
+    openai.api_key = OPENAI_API_KEY
+    if OPENAI_API_BASE:
+        openai.api_base = OPENAI_API_BASE
+    return openai
+
+openai_sdk = Lazy(load_openai, name='openai')
+
+def create_app():
+    """Application factory: ``gunicorn 'app:create_app()'``
+
+    Importing this module only builds cheap in-process objects. The first
+    call here (or the first request, when served as ``app:app``) does the
+    per-worker setup: telemetry exporter, Mongo indexes and the MailerLite
+    worker. Later calls return the same app.
+    """
+    return app_setup.get()
+
+@app.before_request
+def ensure_app_setup():
+    app_setup.get()
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_timing(response):
+    """Per-route latency (for streams: until the response starts)"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.record('http', request_metric_name(), (time.perf_counter() - started) * 1000,
+                       error=response.status_code >= 500, status=response.status_code)
+    return response
+
+@app.teardown_request
+def record_failed_request(exc):
+    # after_request doesn't run when a handler raises
+    started = g.pop('request_started', None)
+    if exc is not None and started is not None:
+        metrics.record('http', request_metric_name(), (time.perf_counter() - started) * 1000, error=True, status=500)
+
+def request_metric_name():
+    return f"{request.method} {request.url_rule.rule if request.url_rule else '<unmatched>'}"
+
 # --- HELPER FUNCTIONS ---
 def generate_visitor_id():
     return str(uuid.uuid4())
 
-def track_ai_usage(prompt_tokens, completion_tokens, user_id=None, visitor_id=None):
-    """Track AI usage for cost monitoring"""
-    if isinstance(db, dict):
-        # In-memory storage
-        db['ai_usage'].append({
-            'prompt_tokens': prompt_tokens,
-            'completion_tokens': completion_tokens,
-            'user_id': user_id,
-            'visitor_id': visitor_id,
-            'timestamp': datetime.utcnow().isoformat(),
-            'estimated_cost': (prompt_tokens * 0.00001) + (completion_tokens * 0.00003)
-        })
-    else:
-        # MongoDB storage
-        db.ai_usage.insert_one({
-            'prompt_tokens': prompt_tokens,
-            'completion_tokens': completion_tokens,
-            'user_id': user_id,
-            'visitor_id': visitor_id,
-            'timestamp': datetime.utcnow(),
-            'estimated_cost': (prompt_tokens * 0.00001) + (completion_tokens * 0.00003)
-        })
+def normalize_email(email):
+    """Emails are stored trimmed and lowercased so the unique index catches case variants"""
+    return (email or '').strip().lower()
+
+def estimate_ai_cost(prompt_tokens, completion_tokens):
+    return (prompt_tokens * 0.00001) + (completion_tokens * 0.00003)
+
+def track_ai_usage(prompt_tokens, completion_tokens, user_id=None, visitor_id=None, cache_hit=False, saved_cost=0.0,
+                   provider=None, coalesced=False, hedged=False):
+    """Track AI usage for cost monitoring
+    
+    ``provider`` is the backend that actually produced the answer.
+    Cache hits are recorded with zero tokens and the cost of the original
+    call as ``saved_cost``. Requests that shared another request's in-flight
+    call are recorded the same way, with ``coalesced`` set. ``hedged`` marks
+    the answer of a hedged call that lost the race: paid for, never shown.
+    Provider spend also counts towards the daily budgets enforced by ``ai_gate``.
+    """
+    estimated_cost = estimate_ai_cost(prompt_tokens, completion_tokens)
+    if not cache_hit and (provider or AI_PROVIDER) != 'fallback':
+        ai_gate.record_spend(visitor_id, estimated_cost)
+    event_pipeline.emit('ai_usage', {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'user_id': user_id,
+        'visitor_id': visitor_id,
+        'timestamp': datetime.utcnow(),
+        'estimated_cost': estimated_cost,
+        'cache_hit': cache_hit,
+        'saved_cost': saved_cost,
+        'provider': provider or AI_PROVIDER,
+        'coalesced': coalesced,
+        'hedged': hedged
+    })
 
-def guerilla_ai_response(message, conversation_history=None):
-    """Generate AI response with Guerilla personality using selected AI provider"""
-    if not conversation_history:
-        conversation_history = []
-        
-    # Guerilla personality prompt to prepend to all AI interactions
-    personality_prompt = """
+def fallback_ai_response(visitor_id=None):
+    """Pick a pre-written response (no provider configured, or provider unhealthy)"""
+    track_ai_usage(10, 50, visitor_id=visitor_id, provider='fallback')  # Minimal tracking for fallback
+    return random.choice(FALLBACK_RESPONSES)
+
+def cached_ai_response(cache_key, visitor_id=None):
+    """Return a cached AI answer (and record the saved cost), or None"""
+    cached = response_cache.get(cache_key)
+    if cached is None:
+        return None
+    track_ai_usage(0, 0, visitor_id=visitor_id, cache_hit=True, saved_cost=cached['estimated_cost'])
+    return cached['response']
+
+def shared_ai_response(shared, visitor_id=None):
+    """Return the answer another request's provider call produced; only the leader paid for it"""
+    track_ai_usage(0, 0, visitor_id=visitor_id, cache_hit=True, saved_cost=shared['estimated_cost'], coalesced=True)
+    return shared['response']
+
+# Guerilla personality prompt to prepend to all AI interactions
+GUERILLA_PERSONALITY_PROMPT = """
     You are Guerilla the Gorilla, an off-grid camping expert with a rugged, no-nonsense personality.
     Your advice is blunt, practical, and focused on cost-effectiveness.
     You have a unique style:
@@ -115,97 +426,329 @@ def guerilla_ai_response(message, conversation_history=None):
     - You've personally lived off-grid and tested all gear you recommend
     - Your motto is "Sometimes life is hard, but you just camp through it"
     """
+
+# Pre-written responses used when no AI provider is configured
+FALLBACK_RESPONSES = [
+    "Yo! That's a solid question. From my experience living off-grid, best solution is keep it simple. Need power? Get Jackery 240. Not fancy, but works every time.",
+    "Listen up. Been there, done that. Most folks overthink this. For water filtration, LifeStraw saved my ass more times than I can count. $15, lasts forever, no batteries.",
+    "Straight talk? Food storage matters most. 4Patriots 72-hour kit fits under bed, tastes decent, lasts 25 years. Start there, build up slowly.",
+    "Look, camping's not complicated. Need three things: shelter, water, food. Everything else is luxury. Start with good tarp, water filter, fire starter.",
+    "Here's real deal - most expensive gear often breaks first. Buy mid-range, test hard, replace what fails. Jackery's solid for power though, worth every penny."
+]
+
+AI_ERROR_RESPONSE = "Having trouble with my AI brain right now. Try asking something about camping gear or survival tips instead."
+
+GEMINI_BASE_URL = os.environ.get('GEMINI_BASE_URL', "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro")
+GEMINI_GENERATION_CONFIG = {"temperature": 0.7, "topK": 40, "topP": 0.95, "maxOutputTokens": 250}
+
+prompt_builder = prompts.PromptBuilder(GUERILLA_PERSONALITY_PROMPT, token_budget=HISTORY_TOKEN_BUDGET)
+ollama_contexts = prompts.ContextCache(max_entries=OLLAMA_CONTEXT_CACHE_SIZE)
+
+def ollama_prompt(message, conversation_history, visitor_id):
+    """Ollama prompt, reusing the visitor's cached ``context`` while the whole history still fits"""
+    context = None
+    if len(prompt_builder.window(conversation_history)[0]) == len(conversation_history):
+        context = ollama_contexts.get(visitor_id, conversation_history)
+    return prompt_builder.ollama(message, conversation_history, context=context), context
+
+def ollama_payload(prompt, context, stream):
+    payload = {
+        "model": OLLAMA_MODEL,
+        "prompt": prompt.text,
+        "stream": stream,
+        "keep_alive": OLLAMA_KEEP_ALIVE,  # Keep the model (and its prompt cache) loaded between chats
+        "options": {"num_predict": 250}
+    }
+    if context:
+        payload["context"] = context
+    else:
+        payload["system"] = prompt.system
+    return payload
+
+def record_usage(provider, prompt, reported_prompt_tokens, completion_tokens, ai_response, visitor_id, started=None,
+                 hedged=False):
+    """Track usage, preferring the provider's counts; returns ``(prompt_tokens, completion_tokens)``
+
+    ``started`` (a ``perf_counter`` value) records the whole generation time for the provider.
+    """
+    if reported_prompt_tokens:
+        prompt_builder.estimator.observe(prompt.prompt_tokens, reported_prompt_tokens)
+    prompt_tokens = reported_prompt_tokens or prompt.prompt_tokens
+    if not completion_tokens:
+        completion_tokens = prompt_builder.estimator.count(ai_response)
+    if started is not None:
+        metrics.record('ai', provider, (time.perf_counter() - started) * 1000)
+    metrics.record('ai_tokens', f'{provider} prompt', prompt_tokens)
+    metrics.record('ai_tokens', f'{provider} completion', completion_tokens)
+    track_ai_usage(prompt_tokens, completion_tokens, visitor_id=visitor_id, provider=provider, hedged=hedged)
+    return prompt_tokens, completion_tokens
+
+def guerilla_ai_response(message, conversation_history=None, visitor_id=None):
+    """Generate AI response with Guerilla personality using selected AI provider
+    
+    ``conversation_history`` holds the earlier turns, not the current message.
+    ``visitor_id`` is the caller's, possibly generated for this request, so
+    first-time visitors are rate limited and charged like everyone else.
+    """
+    conversation_history = conversation_history or []
+    
+    # The cache key covers the history the prompt will actually contain
+    history, _ = prompt_builder.window(conversation_history)
+    cache_key = ai_cache.make_key(message, history, window=None)
+    ai_response = cached_ai_response(cache_key, visitor_id=visitor_id)
+    if ai_response is not None:
+        return ai_response
+    
+    # Identical prompts already in flight share one provider call
+    call, leader = inflight.begin(cache_key)
+    if not leader:
+        shared = call.wait(AI_COALESCE_WAIT)
+        if shared is not None:
+            return shared_ai_response(shared, visitor_id=visitor_id)
+        return provider_ai_response(message, conversation_history, visitor_id, cache_key)[0]
+    
+    shared = None
+    try:
+        ai_response, shared = provider_ai_response(message, conversation_history, visitor_id, cache_key)
+    finally:
+        inflight.finish(cache_key, shared)
+    return ai_response
+
+# Each provider's completion: ``(ai_response, prompt, (prompt_tokens, completion_tokens))``;
+# token counts the provider did not report are None
+def complete_openai(message, conversation_history, visitor_id):
+    prompt = prompt_builder.chat(message, conversation_history)
+    response = outbound.call('openai', openai_sdk.get().ChatCompletion.create,
+        model="gpt-3.5-turbo",
+        messages=prompt.messages,
+        max_tokens=250,
+        request_timeout=outbound.timeout
+    )
+    ai_response = response.choices[0].message.content.strip()
+    return ai_response, prompt, (response.usage.prompt_tokens, response.usage.completion_tokens)
+
+def complete_gemini(message, conversation_history, visitor_id):
+    prompt = prompt_builder.text(message, conversation_history)
+    url = f"{GEMINI_BASE_URL}:generateContent"
+    headers = {
+        "Content-Type": "application/json",
+        "x-goog-api-key": GEMINI_API_KEY
+    }
+    data = {
+        "contents": [{"parts":[{"text": prompt.text}]}],
+        "generationConfig": GEMINI_GENERATION_CONFIG
+    }
+    response = outbound.post('gemini', url, headers=headers, json=data)
+    result = response.json()
+    ai_response = result['candidates'][0]['content']['parts'][0]['text'].strip()
+    metadata = result.get('usageMetadata', {})
+    return ai_response, prompt, (metadata.get('promptTokenCount'), metadata.get('candidatesTokenCount'))
+
+def complete_ollama(message, conversation_history, visitor_id):
+    prompt, context = ollama_prompt(message, conversation_history, visitor_id)
+    response = outbound.post('ollama', f"{OLLAMA_URL}/api/generate",
+        json=ollama_payload(prompt, context, stream=False))
+    result = response.json()
+    ai_response = result.get('response', '').strip()
+    ollama_contexts.set(visitor_id, message, ai_response, result.get('context'))
+    # prompt_eval_count only covers tokens Ollama had to evaluate, so it is our real input cost
+    return ai_response, prompt, (result.get('prompt_eval_count'), result.get('eval_count'))
+
+AI_COMPLETIONS = {'openai': complete_openai, 'gemini': complete_gemini, 'ollama': complete_ollama}
+
+def provider_ai_response(message, conversation_history, visitor_id, cache_key):
+    """Call the best available provider; returns ``(ai_response, shareable cache entry or None)``
+    
+    ``provider_router`` picks the provider and fails over to the next one on
+    errors. With ``AI_HEDGE`` a second provider races a slow first one.
+    """
+    if ai_gate.check(visitor_id, request.remote_addr):
+        # Rate limited or over budget: canned answer, no upstream call
+        return fallback_ai_response(visitor_id=visitor_id), None
     
-    # Combine history with current message
-    full_prompt = personality_prompt + "\n\n"
-    for msg in conversation_history[-5:]:  # Only use last 5 messages to save costs
-        if msg['role'] == 'user':
-            full_prompt += f"User: {msg['content']}\n"
+    def complete(provider):
+        started = time.perf_counter()
+        return AI_COMPLETIONS[provider](message, conversation_history, visitor_id) + (started,)
+    
+    def record_discarded(provider, result):
+        # The hedge loser's answer is dropped, but its tokens were still billed
+        ai_response, prompt, usage, started = result
+        record_usage(provider, prompt, *usage, ai_response, visitor_id, hedged=True)
+    
+    try:
+        provider, (ai_response, prompt, usage, started) = provider_router.call(
+            complete, hedge=AI_HEDGE, on_discard=record_discarded)
+    except (http_client.UpstreamError, ai_router.NoProviderAvailable) as e:
+        # No provider configured, or all of them down, timing out or circuit open: answer from the canned responses
+        logger.warning("AI upstream error: %s", e)
+        return fallback_ai_response(visitor_id=visitor_id), None
+    except Exception as e:
+        logger.exception("AI error: %s", e)
+        return AI_ERROR_RESPONSE, None
+    
+    prompt_tokens, completion_tokens = record_usage(provider, prompt, *usage, ai_response, visitor_id, started=started)
+    estimated_cost = estimate_ai_cost(prompt_tokens, completion_tokens)
+    response_cache.set(cache_key, ai_response, estimated_cost)
+    return ai_response, {'response': ai_response, 'estimated_cost': estimated_cost}
+
+def guerilla_ai_stream(message, conversation_history=None, visitor_id=None):
+    """Yield the AI response in chunks as the selected provider produces them.
+    
+    Usage is tracked once the provider has finished, or once the client
+    has disconnected, for the text sent so far. If the provider fails
+    before sending anything, the generic error response is yielded instead.
+    Requests that join an identical in-flight prompt get the whole answer
+    as one chunk when the leading request finishes.
+    """
+    conversation_history = conversation_history or []
+    
+    history, _ = prompt_builder.window(conversation_history)
+    cache_key = ai_cache.make_key(message, history, window=None)
+    ai_response = cached_ai_response(cache_key, visitor_id=visitor_id)
+    if ai_response is not None:
+        yield ai_response
+        return
+    
+    call, leader = inflight.begin(cache_key)
+    if not leader:
+        shared = call.wait(AI_COALESCE_WAIT)
+        if shared is not None:
+            yield shared_ai_response(shared, visitor_id=visitor_id)
         else:
-            full_prompt += f"Guerilla: {msg['content']}\n"
-    full_prompt += f"User: {message}\nGuerilla:"
+            yield from provider_ai_stream(message, conversation_history, visitor_id, cache_key)
+        return
+    
+    shared = None
+    try:
+        shared = yield from provider_ai_stream(message, conversation_history, visitor_id, cache_key)
+    finally:
+        # Also runs when the client disconnects mid-stream; followers then make their own call
+        inflight.finish(cache_key, shared)
+
+# Each provider's stream yields text chunks and fills ``usage`` with the prompt and any token counts reported
+def stream_openai(message, conversation_history, visitor_id, usage):
+    prompt = usage['prompt'] = prompt_builder.chat(message, conversation_history)
+    response = outbound.call('openai', openai_sdk.get().ChatCompletion.create,
+        model="gpt-3.5-turbo",
+        messages=prompt.messages,
+        max_tokens=250,
+        stream=True,
+        request_timeout=outbound.timeout
+    )
+    for chunk in response:
+        text = chunk.choices[0].delta.get('content')
+        if text:
+            yield text
+
+def stream_gemini(message, conversation_history, visitor_id, usage):
+    prompt = usage['prompt'] = prompt_builder.text(message, conversation_history)
+    url = f"{GEMINI_BASE_URL}:streamGenerateContent?alt=sse"
+    headers = {
+        "Content-Type": "application/json",
+        "x-goog-api-key": GEMINI_API_KEY
+    }
+    data = {
+        "contents": [{"parts":[{"text": prompt.text}]}],
+        "generationConfig": GEMINI_GENERATION_CONFIG
+    }
+    with outbound.post('gemini', url, headers=headers, json=data, stream=True) as response:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            result = json.loads(line[len('data:'):])
+            for candidate in result.get('candidates', [])[:1]:
+                for part in candidate.get('content', {}).get('parts', []):
+                    text = part.get('text')
+                    if text:
+                        yield text
+            metadata = result.get('usageMetadata')
+            if metadata:
+                usage['prompt_tokens'] = metadata.get('promptTokenCount', usage['prompt_tokens'])
+                usage['completion_tokens'] = metadata.get('candidatesTokenCount', usage['completion_tokens'])
+
+def stream_ollama(message, conversation_history, visitor_id, usage):
+    prompt, context = ollama_prompt(message, conversation_history, visitor_id)
+    usage['prompt'] = prompt
+    with outbound.post('ollama', f"{OLLAMA_URL}/api/generate",
+        json=ollama_payload(prompt, context, stream=True),
+        stream=True
+    ) as response:
+        chunks = []
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            result = json.loads(line)
+            text = result.get('response')
+            if text:
+                chunks.append(text)
+                yield text
+            if result.get('done'):
+                usage['prompt_tokens'] = result.get('prompt_eval_count')
+                usage['completion_tokens'] = result.get('eval_count')
+                ollama_contexts.set(visitor_id, message, ''.join(chunks), result.get('context'))
+                break
+
+AI_STREAMS = {'openai': stream_openai, 'gemini': stream_gemini, 'ollama': stream_ollama}
+
+def provider_ai_stream(message, conversation_history, visitor_id, cache_key):
+    """Stream from the best available provider; the generator returns a shareable cache entry or None
+    
+    Providers are tried in ``provider_router`` order until one produces its
+    first chunk. Once text has been sent there is no failing over, and no hedging.
+    """
+    if ai_gate.check(visitor_id, request.remote_addr):
+        yield fallback_ai_response(visitor_id=visitor_id)
+        return None
+    
+    chunks = []
+    completed = True
+    last_error = None
     
     try:
-        if AI_PROVIDER == 'openai' and OPENAI_API_KEY:
-            import openai
-            openai.api_key = OPENAI_API_KEY
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": personality_prompt},
-                    *[{"role": "user" if msg['role'] == 'user' else "assistant", "content": msg['content']} 
-                      for msg in conversation_history[-5:]],
-                    {"role": "user", "content": message}
-                ],
-                max_tokens=250
-            )
-            ai_response = response.choices[0].message.content.strip()
-            track_ai_usage(
-                prompt_tokens=response.usage.prompt_tokens,
-                completion_tokens=response.usage.completion_tokens,
-                visitor_id=request.cookies.get('visitor_id')
-            )
-            return ai_response
-        
-        elif AI_PROVIDER == 'gemini' and GEMINI_API_KEY:
-            url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent"
-            headers = {
-                "Content-Type": "application/json",
-                "x-goog-api-key": GEMINI_API_KEY
-            }
-            data = {
-                "contents": [{"parts":[{"text": full_prompt}]}],
-                "generationConfig": {"temperature": 0.7, "topK": 40, "topP": 0.95, "maxOutputTokens": 250}
-            }
-            response = requests.post(url, headers=headers, json=data)
-            result = response.json()
-            ai_response = result['candidates'][0]['content']['parts'][0]['text'].strip()
-            # Approximate token counting for Gemini
-            prompt_tokens = len(full_prompt) // 4
-            completion_tokens = len(ai_response) // 4
-            track_ai_usage(prompt_tokens, completion_tokens, visitor_id=request.cookies.get('visitor_id'))
-            return ai_response
-        
-        elif AI_PROVIDER == 'ollama':
-            response = requests.post(f"{OLLAMA_URL}/api/generate", 
-                json={
-                    "model": "llama2",
-                    "prompt": full_prompt,
-                    "max_tokens": 250
-                }
-            )
-            ai_response = response.json().get('response', '').strip()
-            # Approximate token counting
-            prompt_tokens = len(full_prompt) // 4
-            completion_tokens = len(ai_response) // 4
-            track_ai_usage(prompt_tokens, completion_tokens, visitor_id=request.cookies.get('visitor_id'))
-            return ai_response
-        
+        for provider in provider_router.ranked():
+            usage = {'prompt': None, 'prompt_tokens': None, 'completion_tokens': None}
+            started = time.perf_counter()
+            try:
+                for text in AI_STREAMS[provider](message, conversation_history, visitor_id, usage):
+                    chunks.append(text)
+                    yield text
+            except Exception as e:
+                provider_router.record(provider, time.perf_counter() - started, ok=False)
+                if chunks:
+                    logger.warning("AI stream from %s broke off: %s", provider, e)
+                    completed = False  # Partial answer: charge for it, but don't cache it
+                    break
+                logger.warning("AI provider %s failed: %s", provider, e)
+                last_error = e
+                continue
+            provider_router.record(provider, time.perf_counter() - started)
+            break
+    finally:
+        # Also runs when the client disconnects mid-stream (GeneratorExit): the text sent so far is billed
+        if chunks:
+            prompt_tokens, completion_tokens = record_usage(provider, usage['prompt'], usage['prompt_tokens'],
+                                                            usage['completion_tokens'], ''.join(chunks),
+                                                            visitor_id, started=started)
+    
+    if not chunks:
+        if last_error is None or isinstance(last_error, http_client.UpstreamError):
+            # No provider configured, or all of them down: canned answer as a single chunk
+            yield fallback_ai_response(visitor_id=visitor_id)
         else:
-            # Fallback to pre-written responses
-            fallback_responses = [
-                "Yo! That's a solid question. From my experience living off-grid, best solution is keep it simple. Need power? Get Jackery 240. Not fancy, but works every time.",
-                "Listen up. Been there, done that. Most folks overthink this. For water filtration, LifeStraw saved my ass more times than I can count. $15, lasts forever, no batteries.",
-                "Straight talk? Food storage matters most. 4Patriots 72-hour kit fits under bed, tastes decent, lasts 25 years. Start there, build up slowly.",
-                "Look, camping's not complicated. Need three things: shelter, water, food. Everything else is luxury. Start with good tarp, water filter, fire starter.",
-                "Here's real deal - most expensive gear often breaks first. Buy mid-range, test hard, replace what fails. Jackery's solid for power though, worth every penny."
-            ]
-            ai_response = random.choice(fallback_responses)
-            track_ai_usage(10, 50, visitor_id=request.cookies.get('visitor_id'))  # Minimal tracking for fallback
-            return ai_response
-            
-    except Exception as e:
-        print(f"AI ERROR: {str(e)}")
-        return "Having trouble with my AI brain right now. Try asking something about camping gear or survival tips instead."
+            yield AI_ERROR_RESPONSE
+        return None
+    
+    ai_response = ''.join(chunks)
+    if completed:
+        estimated_cost = estimate_ai_cost(prompt_tokens, completion_tokens)
+        response_cache.set(cache_key, ai_response.strip(), estimated_cost)
+        return {'response': ai_response.strip(), 'estimated_cost': estimated_cost}
 
 # --- FLASK ROUTES (FOR TEMPLATING) ---
->>>>>>> 931768164efb22c377709d294afd1e9aa292be37
 @app.route('/')
 def home():
     return render_template('index.html')
 
-<<<<<<< HEAD
-=======
 @app.route('/blog')
 def blog():
     return render_template('blog.html')
@@ -214,7 +757,6 @@ def blog():
 def blog_post(slug):
     return render_template('post.html')
 
->>>>>>> 931768164efb22c377709d294afd1e9aa292be37
 @app.route('/gear')
 def gear():
     return render_template('gear.html')
@@ -227,94 +769,17 @@ def about():
 def contact():
     return render_template('contact.html')
 
-<<<<<<< HEAD
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    data = request.get_json()
-    message = data.get('message', '')
-    
-    responses = [
-        "Yo! That's a solid question. Here's what I know from living it.",
-        "Listen up, because this is real talk from someone who's been there.",
-        "Alright, let me give you the straight dope on this.",
-        "This is exactly what I've been telling people. Here's the deal.",
-        "Perfect question. This is what separates the survivors from the tourists."
-    ]
-    
-    import random
-    response = random.choice(responses)
-    
-    return jsonify({
-        'response': response,
-        'success': True
-    })
-
-@app.route('/affiliate/<product>')
-def affiliate(product):
-    links = {
-        'jackery': 'https://amzn.to/3QZqX8Y',
-        'lifestraw': 'https://amzn.to/3QZqX8Y',
-        'food': 'https://4patriots.com/products/4week-food?drolid=0001'
-    }
-    return redirect(links.get(product, '/'))
-
-@app.route('/social/<platform>')
-def social_redirect(platform):
-    social_links = {
-        'reddit': 'https://www.reddit.com/r/gorillacamping',
-        'facebook': 'https://www.facebook.com/gorillacamping',
-        'tiktok': 'https://www.tiktok.com/@gorillacamping'
-    }
-    return redirect(social_links.get(platform, '/'))
-
-if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False) 
-=======
 # --- API ENDPOINTS (FOR FRONTEND) ---
-@app.route('/api/blog-posts', methods=['GET'])
-def api_blog_posts():
-    """Return all blog posts as JSON"""
-    if isinstance(db, dict):
-        # Fallback to sample data for development
-        posts = [
-            {
-                "title": "Essential Camping Gear for Beginners",
-                "slug": "essential-camping-gear",
-                "created_at": "2025-07-01",
-                "excerpt": "The bare minimum you need to survive and thrive in the wilderness."
-            },
-            {
-                "title": "Guerilla Camping 101: Off-Grid Freedom",
-                "slug": "guerilla-camping-101",
-                "created_at": "2025-07-05",
-                "excerpt": "How to disappear into nature while staying connected enough to make money."
-            },
-            {
-                "title": "Power Solutions for Digital Nomads",
-                "slug": "power-solutions-digital-nomads",
-                "created_at": "2025-07-10",
-                "excerpt": "Keep your devices charged and your income flowing while off the grid."
-            }
-        ]
-    else:
-        # Get from MongoDB
-        posts = list(db.posts.find({"status": "published"}))
-        for post in posts:
-            post['_id'] = str(post['_id'])
-            post['created_at'] = post['created_at'].strftime('%Y-%m-%d')
-    
-    return jsonify(posts)
-
-@app.route('/api/blog-post/<slug>', methods=['GET'])
-def api_blog_post(slug):
-    """Return a single post by slug"""
-    if isinstance(db, dict):
-        # Fallback to sample data for development
-        post = {
-            "title": "Essential Camping Gear for Beginners",
-            "slug": slug,
-            "content": """
+# Sample content for the in-memory store (development and preview instances)
+SAMPLE_POSTS = [
+    {
+        "title": "Essential Camping Gear for Beginners",
+        "slug": "essential-camping-gear",
+        "status": "published",
+        "created_at": datetime(2025, 7, 1),
+        "excerpt": "The bare minimum you need to survive and thrive in the wilderness.",
+        "author": "Guerilla",
+        "content": """
             <h2>The Bare Essentials</h2>
             <p>When you're starting out camping, you don't need everything REI tries to sell you. Focus on these essentials:</p>
             <ul>
@@ -329,138 +794,196 @@ def api_blog_post(slug):
                 <p>Reliable power that's saved my ass countless times.</p>
                 <a href="/affiliate/jackery" class="cta-button">Check Current Price</a>
             </div>
-            """,
-            "created_at": "2025-07-01",
-            "author": "Guerilla"
-        }
-    else:
-        # Get from MongoDB
-        post = db.posts.find_one({'slug': slug, 'status': 'published'})
-        if post:
-            post['_id'] = str(post['_id'])
+            """
+    },
+    {
+        "title": "Guerilla Camping 101: Off-Grid Freedom",
+        "slug": "guerilla-camping-101",
+        "status": "published",
+        "created_at": datetime(2025, 7, 5),
+        "excerpt": "How to disappear into nature while staying connected enough to make money.",
+        "author": "Guerilla",
+        "content": "<p>How to disappear into nature while staying connected enough to make money.</p>"
+    },
+    {
+        "title": "Power Solutions for Digital Nomads",
+        "slug": "power-solutions-digital-nomads",
+        "status": "published",
+        "created_at": datetime(2025, 7, 10),
+        "excerpt": "Keep your devices charged and your income flowing while off the grid.",
+        "author": "Guerilla",
+        "content": "<p>Keep your devices charged and your income flowing while off the grid.</p>"
+    }
+]
+
+if repository.backend == 'memory' and not repository.count('posts'):
+    repository.add_posts(SAMPLE_POSTS)
+
+# Fields the post list can be projected to with ?fields=
+BLOG_LIST_FIELDS = ('_id', 'title', 'slug', 'created_at', 'updated_at', 'excerpt', 'tags', 'category', 'author', 'image')
+
+@app.route('/api/blog-posts', methods=['GET'])
+def api_blog_posts():
+    """Return published blog posts as JSON, newest first
+    
+    Query parameters: ``limit`` (default 20, max 100), ``cursor`` (from the
+    ``X-Next-Cursor`` header of the previous page), ``fields`` (comma-separated
+    subset of BLOG_LIST_FIELDS), ``tag`` and ``category``. The number of
+    matching posts is sent in ``X-Total-Count``.
+    """
+    limit = pagination.parse_limit(request.args.get('limit'))
+    cursor = request.args.get('cursor') or None
+    fields = tuple(field for field in request.args.get('fields', '').split(',') if field in BLOG_LIST_FIELDS)
+    tag = request.args.get('tag') or None
+    category = request.args.get('category') or None
+    
+    cache_key = json.dumps(['posts', limit, cursor, fields, tag, category])
+    try:
+        # The repository checks the cursor as it loads the page, so a bad one is never cached
+        cached = post_cache.get(cache_key, lambda: load_blog_posts(limit, cursor, fields or None, tag, category))
+    except pagination.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    return cached_json_response(cached)
+
+@app.route('/api/blog-post/<slug>', methods=['GET'])
+def api_blog_post(slug):
+    """Return a single post by slug"""
+    return cached_json_response(post_cache.get(f'post:{slug}', lambda: load_blog_post(slug)))
+
+def cached_json_response(cached, max_age=BLOG_CACHE_MAX_AGE):
+    """Serve a snapshot's stored bytes, compressed as the client accepts; answers conditional GETs with 304"""
+    if cached.status != 200:
+        return Response(cached.body, status=cached.status, mimetype='application/json')
+    encoding = cached.encoding_for(request.headers.get('Accept-Encoding'))
+    body = cached.representation(encoding)[0]
+    headers = cached.response_headers(
+        encoding, f'public, max-age={max_age}, stale-while-revalidate={max_age * 5}')
+    response = Response(body, headers=headers)
+    if 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers:
+        return response.make_conditional(request)
+    return response
+
+def load_blog_watermark():
+    return repository.posts_watermark()
+
+def load_blog_posts(limit=pagination.DEFAULT_LIMIT, cursor=None, fields=None, tag=None, category=None):
+    """One page of published posts for the list endpoint (without their bodies)"""
+    posts, next_cursor, total = repository.list_posts(limit, cursor, fields, tag, category)
+    for post in posts:
+        if 'created_at' in post:
             post['created_at'] = post['created_at'].strftime('%Y-%m-%d')
-        else:
-            return jsonify({'error': 'Post not found'}), 404
     
-    return jsonify(post)
+    headers = {'X-Total-Count': str(total)}
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+    return posts, headers
+
+def load_blog_post(slug):
+    """A single published post, or None"""
+    post = repository.get_post(slug)
+    if post:
+        post['created_at'] = post['created_at'].strftime('%Y-%m-%d')
+    return post
+
+# Serialized blog responses, rebuilt when the published-posts watermark moves
+post_cache = blog_cache.BlogCache(load_blog_watermark, check_interval=BLOG_CACHE_CHECK_INTERVAL)
+
+# Serialized responses for data that only changes with the product catalog
+response_snapshots = snapshots.SnapshotCache()
 
 @app.route('/api/gear', methods=['GET'])
 def api_gear():
-    """Return gear items as JSON"""
-    gear_items = [
-        {
-            'name': 'Jackery Explorer 240',
-            'image': 'https://m.media-amazon.com/images/I/41XePYWYlAL._AC_US300_.jpg',
-            'description': 'Perfect for keeping devices charged off-grid. I\'ve used mine daily for 2 years with zero issues. Charges via solar, car, or wall outlet.',
-            'affiliate_id': 'jackery-explorer-240',
-            'price': '$199.99',
-            'old_price': '$299.99',
-            'savings': 'Save $100',
-            'rating': 5,
-            'commission': '8%',
-            'badges': ['HOT DEAL', 'BEST VALUE', 'GUERILLA APPROVED'],
-            'specs': ['240Wh', '250W output', 'Multiple ports', '3.5 lb weight'],
-        },
-        {
-            'name': 'LifeStraw Personal Water Filter',
-            'image': 'https://m.media-amazon.com/images/I/71SYsNwj7hL._AC_UL320_.jpg',
-            'description': 'Essential survival gear. Filters 99.999999% of bacteria, parasites, microplastics. I keep one in every backpack, vehicle, and emergency kit.',
-            'affiliate_id': 'lifestraw-filter',
-            'price': '$14.96',
-            'old_price': '$19.95',
-            'savings': 'Save 25%',
-            'rating': 5,
-            'commission': '12%',
-            'badges': ['BESTSELLER', 'EMERGENCY ESSENTIAL'],
-            'specs': ['1000L capacity', 'No chemicals', 'Compact'],
-        },
-        {
-            'name': '4Patriots 72-Hour Survival Food Kit',
-            'image': 'https://static.gorillacamping.site/img/products/4patriots.jpg',
-            'description': 'Actual food that doesn\'t taste like cardboard. 25-year shelf life, compact storage, no cooking required for some items.',
-            'affiliate_id': '4patriots-food',
-            'price': '$27.00',
-            'old_price': '$47.00',
-            'savings': 'Save 42%',
-            'rating': 4,
-            'commission': '25%',
-            'badges': ['HIGH COMMISSION', 'BEGINNER ESSENTIAL'],
-            'specs': ['72 hours', '25-year shelf life', '1,800 calories/day'],
-        }
-    ]
-    return jsonify(gear_items)
+    """Return gear items as JSON (serialized and compressed once per catalog)"""
+    snapshot = response_snapshots.get('gear', product_catalog, product_catalog.gear_items)
+    return cached_json_response(snapshot, max_age=GEAR_CACHE_MAX_AGE)
 
 @app.route('/api/guerilla-chat', methods=['POST'])
 def guerilla_chat():
-    """AI chatbot endpoint with conversation memory"""
+    """AI chatbot endpoint with conversation memory
+    
+    History is kept in the conversation store under the ``visitor_id``
+    cookie. With ``?stream=1`` the reply is sent as server-sent events while
+    the provider is still generating it (see ``guerilla_chat_stream``).
+    """
     data = request.get_json()
     user_message = data.get('message', '')
-    visitor_id = request.cookies.get('visitor_id', generate_visitor_id())
+    visitor_id = request.cookies.get('visitor_id') or generate_visitor_id()
     
-    # Get conversation history from session
-    conversation_history = session.get('conversation', [])
+    # Get earlier turns from the store; the prompt adds the current message itself
+    conversation_history = conversation_store.history(visitor_id)
+    user_turn = conversations.make_message('user', user_message)
     
-    # Add user message to history
-    conversation_history.append({'role': 'user', 'content': user_message})
+    if request.args.get('stream') in ('1', 'true'):
+        return guerilla_chat_stream(user_turn, conversation_history, visitor_id)
     
     # Get AI response
-    ai_response = guerilla_ai_response(user_message, conversation_history)
+    ai_response = guerilla_ai_response(user_message, conversation_history, visitor_id=visitor_id)
     
-    # Add AI response to history
-    conversation_history.append({'role': 'assistant', 'content': ai_response})
-    
-    # Save conversation to session (limit to last 10 messages to keep session size manageable)
-    session['conversation'] = conversation_history[-10:]
+    # Save both turns to the store
+    conversation_store.append(visitor_id, user_turn, conversations.make_message('assistant', ai_response))
     
     # Detect product mentions and recommend products
-    product_recommendations = []
-    keywords = {
-        'power': 'jackery-explorer-240',
-        'battery': 'jackery-explorer-240',
-        'electricity': 'jackery-explorer-240',
-        'charging': 'jackery-explorer-240',
-        'water': 'lifestraw-filter',
-        'drink': 'lifestraw-filter',
-        'filter': 'lifestraw-filter',
-        'food': '4patriots-food',
-        'meal': '4patriots-food',
-        'emergency': '4patriots-food'
-    }
+    product_recommendations = recommend_products(user_message)
     
-    user_message_lower = user_message.lower()
-    for keyword, product_id in keywords.items():
-        if keyword in user_message_lower:
-            if product_id == 'jackery-explorer-240':
-                product_recommendations.append({
-                    'id': product_id,
-                    'name': 'Jackery Explorer 240',
-                    'price': '$199.99',
-                    'image': 'https://m.media-amazon.com/images/I/41XePYWYlAL._AC_US300_.jpg'
-                })
-                break
-            elif product_id == 'lifestraw-filter':
-                product_recommendations.append({
-                    'id': product_id,
-                    'name': 'LifeStraw Water Filter',
-                    'price': '$14.96',
-                    'image': 'https://m.media-amazon.com/images/I/71SYsNwj7hL._AC_UL320_.jpg'
-                })
-                break
-            elif product_id == '4patriots-food':
-                product_recommendations.append({
-                    'id': product_id,
-                    'name': '4Patriots 72-Hour Kit',
-                    'price': '$27.00',
-                    'image': 'https://static.gorillacamping.site/img/products/4patriots.jpg'
-                })
-                break
-    
-    return jsonify({
+    response = jsonify({
         'response': ai_response,
         'recommendations': product_recommendations,
         'success': True,
         'visitor_id': visitor_id
     })
+    return set_visitor_cookie(response, visitor_id)
+
+def guerilla_chat_stream(user_turn, conversation_history, visitor_id):
+    """Stream the chat reply as server-sent events
+    
+    Events: ``token`` for each chunk of text, then ``done`` carrying the
+    recommendations. Both turns are saved to the conversation store once
+    the stream has finished, or with the partial answer when the client
+    disconnects mid-stream.
+    """
+    user_message = user_turn['content']
+    product_recommendations = recommend_products(user_message)
+    
+    def generate():
+        chunks = []
+        stream = guerilla_ai_stream(user_message, conversation_history, visitor_id=visitor_id)
+        try:
+            for text in stream:
+                chunks.append(text)
+                yield sse_event('token', {'text': text})
+        finally:
+            # Also runs on GeneratorExit: the provider call was made (and billed), so keep its context
+            stream.close()
+            turns = [user_turn]
+            ai_response = ''.join(chunks).strip()
+            if ai_response:
+                turns.append(conversations.make_message('assistant', ai_response))
+            conversation_store.append(visitor_id, *turns)
+        yield sse_event('done', {
+            'recommendations': product_recommendations,
+            'success': True,
+            'visitor_id': visitor_id
+        })
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let proxies buffer the stream
+    return set_visitor_cookie(response, visitor_id)
+
+def set_visitor_cookie(response, visitor_id):
+    """Give new visitors a visitor_id cookie; it is the key for their chat history"""
+    if request.cookies.get('visitor_id') != visitor_id:
+        response.set_cookie('visitor_id', visitor_id, max_age=60 * 60 * 24 * 365,
+                            secure=request.is_secure, httponly=True, samesite='Lax')
+    return response
+
+def sse_event(event, data):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def recommend_products(user_message):
+    """Detect product mentions in the user's message and recommend products"""
+    return product_catalog.recommend(user_message, limit=MAX_RECOMMENDATIONS)
 
 @app.route('/api/affiliate-click', methods=['POST'])
 def affiliate_click():
@@ -468,20 +991,11 @@ def affiliate_click():
     data = request.get_json()
     product_id = data.get('product_id')
     
-    if isinstance(db, dict):
-        # In-memory tracking for development
-        db['affiliate_clicks'].append({
-            'product_id': product_id,
-            'timestamp': datetime.utcnow().isoformat(),
-            'visitor_id': request.cookies.get('visitor_id', generate_visitor_id())
-        })
-    else:
-        # MongoDB tracking
-        db.affiliate_clicks.insert_one({
-            'product_id': product_id,
-            'timestamp': datetime.utcnow(),
-            'visitor_id': request.cookies.get('visitor_id', generate_visitor_id())
-        })
+    event_pipeline.emit('affiliate_clicks', {
+        'product_id': product_id,
+        'timestamp': datetime.utcnow(),
+        'visitor_id': request.cookies.get('visitor_id', generate_visitor_id())
+    })
     
     return jsonify({'success': True})
 
@@ -489,99 +1003,57 @@ def affiliate_click():
 def subscribe():
     """Add email to subscribers"""
     data = request.get_json()
-    email = data.get('email')
+    email = normalize_email(data.get('email'))
     source = data.get('source', 'general')
     
     if not email or '@' not in email:
         return jsonify({'success': False, 'error': 'Invalid email'}), 400
     
-    if isinstance(db, dict):
-        # In-memory tracking for development
-        existing = False
-        for sub in db['subscribers']:
-            if sub.get('email') == email:
-                existing = True
-                break
-        
-        if existing:
-            return jsonify({'success': False, 'error': 'Already subscribed'})
-        
-        db['subscribers'].append({
-            'email': email,
-            'source': source,
-            'timestamp': datetime.utcnow().isoformat(),
-            'visitor_id': request.cookies.get('visitor_id', generate_visitor_id()),
-            'active': True
-        })
-    else:
-        # MongoDB
-        existing = db.subscribers.find_one({'email': email})
-        if existing:
-            return jsonify({'success': False, 'error': 'Already subscribed'})
-        
-        db.subscribers.insert_one({
-            'email': email,
-            'source': source,
-            'timestamp': datetime.utcnow(),
-            'visitor_id': request.cookies.get('visitor_id', generate_visitor_id()),
-            'active': True
-        })
+    subscriber = {
+        'email': email,
+        'source': source,
+        'timestamp': datetime.utcnow(),
+        'visitor_id': request.cookies.get('visitor_id', generate_visitor_id()),
+        'active': True,
+        **mailerlite_sync.pending_sync_fields()
+    }
+    if not repository.add_subscriber(subscriber):
+        return jsonify({'success': False, 'error': 'Already subscribed'})
     
-    # Optional: Integration with MailerLite or other email service
-    mailerlite_api_key = os.environ.get('MAILERLITE_API_KEY')
-    if mailerlite_api_key:
-        try:
-            requests.post(
-                'https://api.mailerlite.com/api/v2/subscribers',
-                json={'email': email, 'groups': ['Welcome']},
-                headers={'X-MailerLite-ApiKey': mailerlite_api_key}
-            )
-        except Exception as e:
-            print(f"MailerLite error: {str(e)}")
+    try:
+        rollups.record('subscribers', [subscriber])
+    except Exception as e:
+        logger.warning("Rollup error: %s", e)
+    
+    # MailerLite sync happens in the background outbox worker
+    if mailerlite_outbox:
+        mailerlite_outbox.notify()
     
     return jsonify({'success': True})
 
 @app.route('/affiliate/<product>')
 def affiliate(product):
-    """Track and redirect affiliate clicks"""
-    links = {
-        'jackery-explorer-240': 'https://amzn.to/3QZqX8Y',
-        'lifestraw-filter': 'https://amzn.to/3QZqX8Y',
-        '4patriots-food': 'https://4patriots.com/products/4week-food?drolid=0001',
-        'alps-lynx': 'https://amzn.to/3QZqX8Y'
-    }
-    
-    # Track the click before redirect
-    if isinstance(db, dict):
-        # In-memory tracking for development
-        db['affiliate_clicks'].append({
-            'product_id': product,
-            'timestamp': datetime.utcnow().isoformat(),
-            'visitor_id': request.cookies.get('visitor_id', generate_visitor_id()),
-            'referrer': request.referrer,
-            'user_agent': request.user_agent.string
-        })
-    else:
-        # MongoDB tracking
-        db.affiliate_clicks.insert_one({
-            'product_id': product,
-            'timestamp': datetime.utcnow(),
-            'visitor_id': request.cookies.get('visitor_id', generate_visitor_id()),
-            'referrer': request.referrer,
-            'user_agent': request.user_agent.string
-        })
-    
-    return redirect(links.get(product, '/gear'))
+    """Redirect to the affiliate link; the click is queued raw and enriched by the event pipeline"""
+    click_recorder.record(product, request.cookies.get('visitor_id'),
+                          request.headers.get('Referer'), request.headers.get('User-Agent'))
+    return redirect_response(link_tables.get('affiliate', product) or '/gear')
 
 @app.route('/social/<platform>')
 def social_redirect(platform):
-    """Track and redirect social media clicks"""
-    social_links = {
-        'reddit': 'https://www.reddit.com/r/gorillacamping',
-        'facebook': 'https://www.facebook.com/profile.php?id=61577334442896',
-        'tiktok': 'https://www.tiktok.com/@gorillacamping'
-    }
-    return redirect(social_links.get(platform, '/'))
+    """Redirect to our page on a social platform"""
+    return redirect_response(link_tables.get('social', platform) or '/')
+
+def redirect_response(location):
+    """Bare 302 (flask.redirect also renders an HTML body nobody reads)"""
+    return Response(status=302, headers={'Location': location})
+
+@app.route('/api/admin/reload-links', methods=['POST'])
+def api_reload_links():
+    """Reload the catalog and redirect tables in this worker (the others pick up file changes on their own)"""
+    api_key = request.args.get('api_key')
+    if not api_key or api_key != os.environ.get('ADMIN_API_KEY'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify({'success': link_tables.reload(), 'links': link_tables.stats()})
 
 @app.route('/api/analytics/summary')
 def api_analytics_summary():
@@ -591,23 +1063,36 @@ def api_analytics_summary():
     if api_key != os.environ.get('ADMIN_API_KEY'):
         return jsonify({'error': 'Unauthorized'}), 401
     
-    if isinstance(db, dict):
-        # Development data
-        return jsonify({
-            'affiliate_clicks': len(db['affiliate_clicks']),
-            'subscribers': len(db['subscribers']),
-            'ai_interactions': len(db['ai_usage']),
-            'estimated_ai_cost': sum(item.get('estimated_cost', 0) for item in db['ai_usage'])
-        })
-    else:
-        # MongoDB stats
-        return jsonify({
-            'affiliate_clicks': db.affiliate_clicks.count_documents({}),
-            'subscribers': db.subscribers.count_documents({}),
-            'ai_interactions': db.ai_usage.count_documents({}),
-            'estimated_ai_cost': sum(item.get('estimated_cost', 0) 
-                                    for item in db.ai_usage.find({}, {'estimated_cost': 1}))
-        })
+    # Optional filters: ?start=YYYY-MM-DD&end=YYYY-MM-DD&group_by=day|product|provider|source
+    start = request.args.get('start')
+    end = request.args.get('end')
+    group_by = request.args.get('group_by')
+    for value in (start, end):
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    if group_by and group_by not in analytics.GROUP_BY:
+        return jsonify({'error': f"group_by must be one of {', '.join(analytics.GROUP_BY)}"}), 400
+    
+    summary = rollups.summary(start=start, end=end, group_by=group_by)
+    summary.update({
+        'ai_cache': response_cache.stats(),
+        'ai_coalescing': inflight.stats(),
+        'ai_rate_limits': ai_gate.stats(),
+        'blog_cache': post_cache.stats(),
+        'snapshots': response_snapshots.stats(),
+        'links': link_tables.stats(),
+        'clicks': click_recorder.stats(),
+        'event_pipeline': event_pipeline.stats(),
+        'latency': metrics.snapshot(),
+        'telemetry': metrics.stats(),
+        'storage': repository.backend,
+        'upstreams': outbound.stats(),
+        'ai_router': provider_router.stats()
+    })
+    return jsonify(summary)
 
 @app.errorhandler(404)
 def not_found(e):
@@ -615,5 +1100,4 @@ def not_found(e):
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=os.environ.get('FLASK_DEBUG', 'False') == 'True')
->>>>>>> 931768164efb22c377709d294afd1e9aa292be37
+    create_app().run(host='0.0.0.0', port=port, debug=os.environ.get('FLASK_DEBUG', 'False') == 'True')
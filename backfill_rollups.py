@@ -0,0 +1,15 @@
+"""Rebuild the analytics rollups from the raw collections.
+
+    python backfill_rollups.py
+
+Run once after deploying rollups, or whenever they drift from the raw data.
+"""
+from analytics import Rollups
+from storage import open_repository
+
+# Make sure MONGODB_URI (or STORAGE_BACKEND=sqlite and SQLITE_PATH) is set in your environment before running this
+rollups = Rollups(open_repository())
+rollups.rebuild()
+print("Rollups rebuilt:")
+for counter, value in rollups.summary().items():
+    print(f"  {counter}: {value}")
@@ -0,0 +1,133 @@
+"""Load benchmark: sync vs async (gevent) gunicorn workers with a slow AI provider.
+
+    python benchmarks/bench_concurrency.py [--workers 2] [--clients 32] [--duration 10] [--delay 0.5]
+
+Starts the stub Ollama from ``stubs.py``, taking ``--delay`` seconds per
+answer, then runs gunicorn in each SERVING_MODE against it. Half of the clients post to
+/api/guerilla-chat and half fetch the home page, so the report shows both
+how many chats get through and whether page routes starve behind them.
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stubs import StubServer  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_app(mode, workers, provider_env):
+    port = free_port()
+    env = dict(
+        os.environ,
+        **provider_env,
+        SERVING_MODE=mode,
+        WEB_CONCURRENCY=str(workers),
+        AI_CACHE_BACKEND='none',
+        MONGODB_URI='',
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', 'app:create_app()'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            requests.get(base_url + '/', timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'gunicorn ({mode}) did not start')
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_load(base_url, clients, duration):
+    latencies = {'chat': [], 'page': []}
+    errors = {'chat': 0, 'page': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        kind = 'chat' if index % 2 == 0 else 'page'
+        session = requests.Session()
+        sent = 0
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                if kind == 'chat':
+                    response = session.post(base_url + '/api/guerilla-chat', timeout=60,
+                                            json={'message': f'client {index} question {sent}'})
+                else:
+                    response = session.get(base_url + '/', timeout=60)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.monotonic() - started
+            sent += 1
+            with lock:
+                if ok:
+                    latencies[kind].append(elapsed)
+                else:
+                    errors[kind] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.monotonic() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--delay', type=float, default=0.5, help='seconds the stub provider takes per answer')
+    parser.add_argument('--modes', default='sync,async')
+    args = parser.parse_args(argv)
+
+    provider = StubServer(latency=args.delay).start()
+    provider_env = provider.env('ollama', mailerlite=False)
+
+    print(f"{args.workers} workers, {args.clients} clients, {args.duration:g}s, provider delay {args.delay:g}s")
+    print(f"{'mode':<6} {'route':<5} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for mode in args.modes.split(','):
+        process, base_url = start_app(mode, args.workers, provider_env)
+        try:
+            latencies, errors, elapsed = run_load(base_url, args.clients, args.duration)
+        finally:
+            process.terminate()
+            process.wait()
+        for kind in ('chat', 'page'):
+            values = latencies[kind]
+            print(f"{mode:<6} {kind:<5} {len(values) / elapsed:8.1f} "
+                  f"{percentile(values, 50) * 1000:8.0f} {percentile(values, 99) * 1000:8.0f} {errors[kind]:7d}")
+    provider.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
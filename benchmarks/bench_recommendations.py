@@ -0,0 +1,89 @@
+"""Micro-benchmark: chat product recommendations.
+
+    python benchmarks/bench_recommendations.py [--iterations 2000]
+
+Compares the compiled catalog matcher with the substring scan that
+guerilla_chat() used before (copied below), over a corpus of realistic
+chat messages.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import ProductCatalog  # noqa: E402
+
+CORPUS = [
+    "What's the best power station for a week in the van?",
+    "How do I filter water from a creek without getting sick?",
+    "Need emergency food that lasts a long time",
+    "Is a waterproof tarp better than a tent?",
+    "My stove is powerful but eats fuel, any tips?",
+    "How many batteries should I bring for a 3 day trip?",
+    "Can I charge my laptop off solar panels?",
+    "What's the cheapest way to drink safely from a river?",
+    "Best meals for backpacking that don't need cooking",
+    "I'm new to camping, where do I start?",
+    "How do I stay warm at night in the desert?",
+    "Do I need a generator or is a Jackery enough for a CPAP?",
+    "What should be in a bug out bag for 72 hours?",
+    "Any tips for finding free camping spots on BLM land?",
+    "What's the shelf life on survival food kits?",
+    "How do you keep food away from bears?",
+    "Is LifeStraw really good enough for hiking?",
+    "Charging phones and a drone every day, what power setup do you use?",
+    "How do I deal with condensation in my tent?",
+    "Thanks Guerilla, that was helpful!",
+]
+
+OLD_KEYWORDS = {
+    'power': 'jackery-explorer-240',
+    'battery': 'jackery-explorer-240',
+    'electricity': 'jackery-explorer-240',
+    'charging': 'jackery-explorer-240',
+    'water': 'lifestraw-filter',
+    'drink': 'lifestraw-filter',
+    'filter': 'lifestraw-filter',
+    'food': '4patriots-food',
+    'meal': '4patriots-food',
+    'emergency': '4patriots-food'
+}
+
+
+def old_recommend(message):
+    message_lower = message.lower()
+    for keyword, product_id in OLD_KEYWORDS.items():
+        if keyword in message_lower:
+            return [product_id]
+    return []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    catalog = ProductCatalog.from_file()
+    new_recommend = catalog.recommend
+
+    def run(fn):
+        for message in CORPUS:
+            fn(message)
+
+    calls = args.iterations * len(CORPUS)
+    for label, fn in (('substring scan (old)', old_recommend), ('compiled matcher', new_recommend)):
+        seconds = min(timeit.repeat(lambda: run(fn), number=args.iterations, repeat=3))
+        print(f"{label:<22} {seconds / calls * 1e6:7.2f} us/message")
+
+    print()
+    print(f"{'message':<70} {'old':<22} new")
+    for message in CORPUS:
+        new = ','.join(rec['id'] for rec in new_recommend(message))
+        print(f"{message[:68]:<70} {','.join(old_recommend(message)):<22} {new}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
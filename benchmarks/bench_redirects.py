@@ -0,0 +1,152 @@
+"""Benchmark: /affiliate/<product> redirect throughput.
+
+    python benchmarks/bench_redirects.py [--requests 20000] [--threads 1,8] [--rounds 3]
+                                         [--write-latency 0] [--sample-rate 1.0] [--spike-threshold 200]
+
+Calls the WSGI app directly (no sockets, no test client) for three versions
+of the redirect, registered side by side:
+
+- ``original``: the link dict built per call, a new UUID for visitors without
+  a cookie and the click written to storage before redirecting
+- ``queued``: module-level links and the full click document handed to the
+  event pipeline
+- ``fast path``: the current route, with hot-reloadable link tables, raw
+  clicks enriched by the batch writer, and sampling/spike aggregation
+
+Half of the simulated visitors have a visitor_id cookie. Storage is the
+in-memory store; ``--write-latency`` adds that many milliseconds to each
+synchronous write, as a MongoDB round trip would. Variants run interleaved
+for ``--rounds`` rounds and the best rate of each is reported.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['MONGODB_URI'] = ''
+os.environ.setdefault('TELEMETRY_EXPORTER', 'none')
+
+from flask import redirect, request  # noqa: E402
+from werkzeug.test import EnvironBuilder  # noqa: E402
+
+import app as app_module  # noqa: E402
+
+PRODUCTS = ['jackery-explorer-240', 'lifestraw-filter', '4patriots-food', 'alps-lynx', 'unknown-product']
+USER_AGENT = ('Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 '
+              '(KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1')
+REFERRER = 'https://www.reddit.com/r/vandwellers/comments/abc123/power_setup/?utm_source=share'
+WRITE_LATENCY = 0.0  # seconds per synchronous write (--write-latency)
+
+
+def record_click(click):
+    if WRITE_LATENCY:
+        time.sleep(WRITE_LATENCY)
+    app_module.repository.record_click(click)
+
+
+def original_affiliate(product):
+    links = {
+        'jackery-explorer-240': 'https://amzn.to/3QZqX8Y',
+        'lifestraw-filter': 'https://amzn.to/3QZqX8Y',
+        '4patriots-food': 'https://4patriots.com/products/4week-food?drolid=0001',
+        'alps-lynx': 'https://amzn.to/3QZqX8Y'
+    }
+    record_click({
+        'product_id': product,
+        'timestamp': datetime.utcnow(),
+        'visitor_id': request.cookies.get('visitor_id', str(uuid.uuid4())),
+        'referrer': request.referrer,
+        'user_agent': request.user_agent.string
+    })
+    return redirect(links.get(product, '/gear'))
+
+
+QUEUED_LINKS = app_module.link_tables.table('affiliate')
+
+
+def queued_affiliate(product):
+    app_module.event_pipeline.emit('affiliate_clicks', {
+        'product_id': product,
+        'timestamp': datetime.utcnow(),
+        'visitor_id': request.cookies.get('visitor_id', str(uuid.uuid4())),
+        'referrer': request.referrer,
+        'user_agent': request.user_agent.string
+    })
+    return redirect(QUEUED_LINKS.get(product, '/gear'))
+
+
+app_module.app.add_url_rule('/bench/original/<product>', 'bench_original', original_affiliate)
+app_module.app.add_url_rule('/bench/queued/<product>', 'bench_queued', queued_affiliate)
+VARIANTS = {'original': '/bench/original/', 'queued': '/bench/queued/', 'fast path': '/affiliate/'}
+
+
+def environs(prefix):
+    result = []
+    for i, product in enumerate(PRODUCTS * 2):
+        headers = {'User-Agent': USER_AGENT, 'Referer': REFERRER}
+        if i % 2:
+            headers['Cookie'] = f'visitor_id=visitor-{i}'
+        result.append(EnvironBuilder(path=prefix + product, headers=headers).get_environ())
+    return result
+
+
+def run(prefix, requests, threads):
+    wsgi = app_module.app.wsgi_app
+    templates = environs(prefix)
+    per_thread = requests // threads
+
+    def start_response(status, headers, exc_info=None):
+        assert status.startswith('302'), status
+
+    def worker():
+        for i in range(per_thread):
+            for chunk in wsgi(dict(templates[i % len(templates)]), start_response):
+                pass
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    app_module.click_recorder.flush()
+    app_module.event_pipeline.flush()
+    return per_thread * threads / elapsed
+
+
+def main(argv=None):
+    global WRITE_LATENCY
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--threads', default='1,8')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--write-latency', type=float, default=0.0, help='ms per synchronous storage write')
+    parser.add_argument('--sample-rate', type=float, default=1.0, help='CLICK_SAMPLE_RATE for the fast path')
+    parser.add_argument('--spike-threshold', type=int, default=app_module.CLICK_SPIKE_THRESHOLD,
+                        help='CLICK_SPIKE_THRESHOLD for the fast path')
+    args = parser.parse_args(argv)
+
+    WRITE_LATENCY = args.write_latency / 1000
+    app_module.app_setup.get()
+    app_module.click_recorder.sample_rate = args.sample_rate
+    app_module.click_recorder.spike_threshold = args.spike_threshold
+    for prefix in VARIANTS.values():
+        run(prefix, 500, 1)  # warm up
+    for threads in [int(value) for value in args.threads.split(',')]:
+        print(f"{args.requests} redirects, {threads} thread(s), best of {args.rounds}")
+        best = dict.fromkeys(VARIANTS, 0.0)
+        for _ in range(args.rounds):
+            for name, prefix in VARIANTS.items():
+                best[name] = max(best[name], run(prefix, args.requests, threads))
+        for name, rate in best.items():
+            print(f"  {name:<10} {rate:>10,.0f} req/s  ({rate / best['original']:.2f}x)")
+    print(f"Click recorder: {app_module.click_recorder.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Benchmark: cold start of a worker.
+
+    python benchmarks/bench_startup.py [--runs 10] [--path /api/gear]
+
+Starts a fresh interpreter per run (as a new gunicorn worker or a
+scale-to-zero container would) and times ``import app``, ``create_app()``
+and the first and second request to ``--path`` through the test client.
+Prints the median and worst of each. Run it with the same environment as
+the deployment (MONGODB_URI, APPLICATIONINSIGHTS_CONNECTION_STRING...) to
+see what those integrations add.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+application = app_module.create_app()
+created = time.perf_counter()
+client = application.test_client()
+timings = {'import': imported - started, 'create_app': created - imported}
+for label in ('first_request', 'second_request'):
+    before = time.perf_counter()
+    status = client.get(sys.argv[1]).status_code
+    timings[label] = time.perf_counter() - before
+timings['total'] = time.perf_counter() - started
+timings['status'] = status
+print(json.dumps(timings))
+"""
+
+PHASES = ('import', 'create_app', 'first_request', 'second_request', 'total')
+
+
+def run_once(path):
+    output = subprocess.run([sys.executable, '-c', CHILD, path], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/api/gear')
+    args = parser.parse_args(argv)
+
+    results = [run_once(args.path) for _ in range(args.runs)]
+    print(f"{args.runs} cold starts, GET {args.path} -> {results[0]['status']}")
+    for phase in PHASES:
+        values = [result[phase] * 1000 for result in results]
+        print(f"  {phase:<15} median {statistics.median(values):8.1f} ms   max {max(values):8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Benchmark: storage backends behind the repository layer.
+
+    python benchmarks/bench_storage.py [--events 20000] [--batch 100] [--mongodb-uri URI]
+
+Runs the same workload against each backend: batched event writes (what the
+event pipeline does), subscriber signups (including duplicates), rollup
+increments, post list pages and single-post reads. MongoDB is included when
+``--mongodb-uri`` (or TEST_MONGODB_URI) points at a scratch database.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import Rollups  # noqa: E402
+from mailerlite_sync import pending_sync_fields  # noqa: E402
+from storage import MemoryRepository, MongoRepository, SQLiteRepository  # noqa: E402
+
+PRODUCTS = ['jackery-explorer-240', 'lifestraw-filter', '4patriots-food', 'solar-panel-100w', 'tarp-10x10']
+
+
+def timed(label, operations, fn):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<28} {operations / elapsed:>12,.0f} ops/s  ({elapsed * 1000:,.0f} ms)")
+
+
+def run(repository, events, batch):
+    start = datetime(2025, 7, 1)
+    clicks = [{
+        'product_id': PRODUCTS[i % len(PRODUCTS)],
+        'timestamp': start + timedelta(seconds=i),
+        'visitor_id': f'visitor-{i % 500}',
+        'referrer': 'https://www.reddit.com/r/gorillacamping',
+        'user_agent': 'Mozilla/5.0',
+    } for i in range(events)]
+    rollups = Rollups(repository)
+
+    def write_events():
+        for i in range(0, events, batch):
+            repository.record_events('affiliate_clicks', clicks[i:i + batch])
+
+    def write_rollups():
+        for i in range(0, events, batch):
+            rollups.record('affiliate_clicks', clicks[i:i + batch])
+
+    signups = events // 10
+
+    def subscribe():
+        for i in range(signups):
+            # One in five is a repeat signup
+            repository.add_subscriber(dict(email=f'camper{i - i % 5 // 4}@example.com', source='blog',
+                                           timestamp=start, **pending_sync_fields()))
+
+    repository.add_posts([{
+        'slug': f'post-{i}', 'title': f'Post {i}', 'status': 'published', 'content': '<p>...</p>' * 50,
+        'created_at': start + timedelta(hours=i), 'category': 'power', 'tags': ['solar', 'van'][:i % 3],
+    } for i in range(500)])
+    pages = max(events // 20, 1)
+
+    def list_posts():
+        cursor = None
+        for _ in range(pages):
+            _, cursor, _ = repository.list_posts(20, cursor, tag='solar')
+
+    def get_posts():
+        for i in range(pages):
+            repository.get_post(f'post-{i % 500}')
+
+    timed(f'record_events (batch {batch})', events, write_events)
+    timed(f'rollups.record (batch {batch})', events, write_rollups)
+    timed('add_subscriber', signups, subscribe)
+    timed('list_posts (tag, keyset)', pages, list_posts)
+    timed('get_post', pages, get_posts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--mongodb-uri', default=os.environ.get('TEST_MONGODB_URI'))
+    args = parser.parse_args(argv)
+
+    backends = [('memory', MemoryRepository)]
+    with tempfile.TemporaryDirectory() as tmp:
+        backends.append(('sqlite', lambda: SQLiteRepository(os.path.join(tmp, 'bench.db'))))
+        if args.mongodb_uri:
+            from pymongo import MongoClient
+            from db_indexes import ensure_indexes
+
+            def mongo():
+                db = MongoClient(args.mongodb_uri).get_default_database()
+                for name in ('subscribers', 'posts', 'affiliate_clicks', 'analytics_rollups'):
+                    db[name].drop()
+                ensure_indexes(db)
+                return MongoRepository(db)
+            backends.append(('mongo', mongo))
+
+        for name, factory in backends:
+            print(f"{name}:")
+            repository = factory()
+            try:
+                run(repository, args.events, args.batch)
+            finally:
+                repository.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""Offline load test of the main routes against stubbed upstreams.
+
+    python benchmarks/loadtest.py [--settings sync:2:1,sync:2:4,async:2:1] [--clients 16] [--duration 10]
+                                  [--provider gemini] [--latency 0.2] [--error-rate 0.01]
+                                  [--storage memory] [--output loadtest.json]
+                                  [--baseline benchmarks/loadtest_baseline.json] [--save-baseline]
+
+Gemini, OpenAI, Ollama and MailerLite are replaced by ``stubs.StubServer``
+(``--latency`` seconds per call, ``--error-rate`` of them failing). Storage
+is the in-memory store by default; ``--storage sqlite`` uses a scratch file
+and ``--storage mongo --mongodb-uri URI`` a real (scratch) MongoDB.
+
+Each setting is ``mode:workers:threads`` (SERVING_MODE, WEB_CONCURRENCY and
+gunicorn ``--threads``). Clients hit a weighted mix of /affiliate/<product>,
+/api/guerilla-chat, /api/subscribe, /api/analytics/summary and
+/api/blog-posts. Throughput and p50/p95/p99 per route go to ``--output`` as
+JSON. With ``--baseline``, each route is compared with the stored run and the
+exit status is 1 when throughput fell or p95 rose by more than
+``--tolerance``; ``--save-baseline`` stores this run as the new baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stubs import StubServer  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_KEY = 'loadtest'
+PRODUCTS = ['jackery-explorer-240', 'lifestraw-filter', '4patriots-food', 'solar-panel-100w', 'unknown-product']
+QUESTIONS = [
+    "What's the best power station for a week in the van?",
+    "How do I filter water from a creek?",
+    "Need emergency food that lasts a long time",
+    "Is a tarp better than a tent?",
+    "How do I stay warm at night in the desert?",
+]
+# Below this many milliseconds a p95 change is noise, not a regression
+MIN_LATENCY_DELTA_MS = 5.0
+
+
+# --- SCENARIOS (route name, weight, request) ---
+def hit_affiliate(session, base_url, rng, client, n):
+    response = session.get(f"{base_url}/affiliate/{rng.choice(PRODUCTS)}", allow_redirects=False, timeout=30)
+    return response.status_code == 302
+
+
+def hit_chat(session, base_url, rng, client, n):
+    # Half repeat a common question (cache and coalescing), half are unique
+    message = rng.choice(QUESTIONS) if rng.random() < 0.5 else f"{rng.choice(QUESTIONS)} ({client}-{n})"
+    response = session.post(f"{base_url}/api/guerilla-chat", json={'message': message}, timeout=60)
+    return response.status_code == 200
+
+
+def hit_subscribe(session, base_url, rng, client, n):
+    email = f"load-{client}-{n}-{rng.getrandbits(32):x}@example.com"
+    response = session.post(f"{base_url}/api/subscribe", json={'email': email, 'source': 'loadtest'}, timeout=30)
+    return response.status_code == 200 and response.json().get('success')
+
+
+def hit_summary(session, base_url, rng, client, n):
+    response = session.get(f"{base_url}/api/analytics/summary?api_key={ADMIN_KEY}&group_by=product", timeout=30)
+    return response.status_code == 200
+
+
+def hit_blog(session, base_url, rng, client, n):
+    response = session.get(f"{base_url}/api/blog-posts?limit=10", timeout=30)
+    return response.status_code == 200
+
+
+SCENARIOS = [
+    ('affiliate', 5, hit_affiliate),
+    ('chat', 2, hit_chat),
+    ('subscribe', 1, hit_subscribe),
+    ('summary', 1, hit_summary),
+    ('blog', 1, hit_blog),
+]
+
+
+# --- RUNNING ---
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_app(setting, env):
+    mode, workers, threads = parse_setting(setting)
+    port = free_port()
+    env = dict(env, SERVING_MODE=mode, WEB_CONCURRENCY=str(workers))
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}']
+    if mode == 'sync' and threads > 1:
+        command += ['--threads', str(threads)]
+    process = subprocess.Popen(command + ['app:create_app()'], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(150):
+        try:
+            requests.get(base_url + '/api/gear', timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'gunicorn ({setting}) did not start')
+
+
+def parse_setting(setting):
+    mode, workers, threads = (setting.split(':') + ['1', '1'])[:3]
+    return mode, int(workers), int(threads)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000, 2)
+
+
+def run_load(base_url, clients, duration, seed=0):
+    latencies = {name: [] for name, _, _ in SCENARIOS}
+    errors = dict.fromkeys(latencies, 0)
+    lock = threading.Lock()
+    weights = [weight for _, weight, _ in SCENARIOS]
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        n = 0
+        while time.monotonic() < deadline:
+            name, _, hit = rng.choices(SCENARIOS, weights)[0]
+            started = time.monotonic()
+            try:
+                ok = hit(session, base_url, rng, index, n)
+            except requests.RequestException:
+                ok = False
+            elapsed = time.monotonic() - started
+            n += 1
+            with lock:
+                if ok:
+                    latencies[name].append(elapsed)
+                else:
+                    errors[name] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    routes = {}
+    for name, values in latencies.items():
+        routes[name] = {
+            'requests': len(values),
+            'errors': errors[name],
+            'rps': round(len(values) / elapsed, 2),
+            'p50_ms': percentile(values, 50),
+            'p95_ms': percentile(values, 95),
+            'p99_ms': percentile(values, 99),
+        }
+    return {
+        'elapsed_s': round(elapsed, 2),
+        'total_rps': round(sum(len(values) for values in latencies.values()) / elapsed, 2),
+        'routes': routes,
+    }
+
+
+# --- BASELINE ---
+def compare(report, baseline, tolerance):
+    """Regressions of ``report`` against ``baseline``: a list of human-readable lines"""
+    regressions = []
+    for setting, result in report['results'].items():
+        base = baseline.get('results', {}).get(setting)
+        if not base:
+            continue
+        for route, stats in result['routes'].items():
+            before = base['routes'].get(route)
+            if not before:
+                continue
+            if before['rps'] and stats['rps'] < before['rps'] * (1 - tolerance):
+                regressions.append(f"{setting} {route}: {stats['rps']} req/s vs {before['rps']} in the baseline")
+            if (before['p95_ms'] is not None and stats['p95_ms'] is not None
+                    and stats['p95_ms'] > before['p95_ms'] * (1 + tolerance)
+                    and stats['p95_ms'] - before['p95_ms'] > MIN_LATENCY_DELTA_MS):
+                regressions.append(f"{setting} {route}: p95 {stats['p95_ms']} ms vs {before['p95_ms']} ms in the baseline")
+    return regressions
+
+
+def print_result(setting, result):
+    print(f"{setting}  ({result['total_rps']} req/s overall)")
+    print(f"  {'route':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for route, stats in result['routes'].items():
+        print(f"  {route:<10} {stats['rps']:8.1f} {stats['p50_ms'] or 0:8.1f} {stats['p95_ms'] or 0:8.1f} "
+              f"{stats['p99_ms'] or 0:8.1f} {stats['errors']:7d}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--settings', default='sync:2:1,sync:2:4,async:2:1')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--provider', default='gemini', choices=['gemini', 'openai', 'ollama'])
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per stubbed upstream call')
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--storage', default='memory', choices=['memory', 'sqlite', 'mongo'])
+    parser.add_argument('--mongodb-uri', default=os.environ.get('TEST_MONGODB_URI'))
+    parser.add_argument('--output', default='loadtest.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative change before failing')
+    args = parser.parse_args(argv)
+
+    if args.provider == 'openai':
+        try:
+            import openai  # noqa: F401
+        except ImportError:
+            parser.error('--provider openai needs the openai package installed')
+    if args.storage == 'mongo' and not args.mongodb_uri:
+        parser.error('--storage mongo needs --mongodb-uri (or TEST_MONGODB_URI)')
+
+    stub = StubServer(latency=args.latency, jitter=args.latency / 2, error_rate=args.error_rate).start()
+    scratch = tempfile.TemporaryDirectory()
+    env = dict(
+        os.environ,
+        **stub.env(args.provider),
+        ADMIN_API_KEY=ADMIN_KEY,
+        MONGODB_URI=args.mongodb_uri if args.storage == 'mongo' else '',
+        STORAGE_BACKEND=args.storage,
+        SQLITE_PATH=os.path.join(scratch.name, 'loadtest.db'),
+        # Measure the app, not the abuse limits
+        RATE_LIMIT_VISITOR='1000000/1', RATE_LIMIT_IP='1000000/1', RATE_LIMIT_GLOBAL='1000000/1',
+        AI_DAILY_BUDGET='0', AI_VISITOR_DAILY_BUDGET='0',
+        TELEMETRY_EXPORTER='none',
+    )
+
+    report = {
+        'generated_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'config': {
+            'clients': args.clients, 'duration_s': args.duration, 'provider': args.provider,
+            'latency_s': args.latency, 'error_rate': args.error_rate, 'storage': args.storage,
+            'python': platform.python_version(), 'cpus': os.cpu_count(),
+        },
+        'results': {},
+    }
+    try:
+        for index, setting in enumerate(args.settings.split(',')):
+            process, base_url = start_app(setting, env)
+            try:
+                result = run_load(base_url, args.clients, args.duration, seed=index)
+            finally:
+                process.terminate()
+                process.wait()
+            report['results'][setting] = result
+            print_result(setting, result)
+    finally:
+        stub.stop()
+        scratch.cleanup()
+    report['upstream_calls'] = stub.calls
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    status = 0
+    if args.baseline and os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        print(f"{len(regressions)} regressions against {args.baseline}")
+        status = 1 if regressions else 0
+    if args.save_baseline and args.baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
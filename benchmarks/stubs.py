@@ -0,0 +1,166 @@
+"""Local stand-ins for Gemini, OpenAI, Ollama and MailerLite.
+
+One threaded HTTP server answers all four APIs on their usual paths, after
+``latency`` seconds (plus up to ``jitter``), and fails ``error_rate`` of the
+calls with a 503. Point the app at it with ``StubServer.env()``::
+
+    server = StubServer(latency=0.2, error_rate=0.01).start()
+    env = dict(os.environ, **server.env('gemini'))
+
+Used by ``loadtest.py`` and ``bench_concurrency.py``; ``python
+benchmarks/stubs.py --port 8900`` runs it on its own.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = "Get the Jackery 240 and a LifeStraw. Works every time, no cap."
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        stub = self.server.stub
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        payload = json.loads(body) if body else {}
+        stub.count(self.path)
+        time.sleep(stub.latency + random.uniform(0, stub.jitter))
+        if random.random() < stub.error_rate:
+            return self._json(503, {'error': 'stub failure'})
+
+        path = self.path.split('?')[0]
+        if path.endswith(':generateContent'):
+            return self._json(200, {
+                'candidates': [{'content': {'parts': [{'text': ANSWER}]}}],
+                'usageMetadata': {'promptTokenCount': 120, 'candidatesTokenCount': 14},
+            })
+        if path.endswith(':streamGenerateContent'):
+            events = [{'candidates': [{'content': {'parts': [{'text': word + ' '}]}}]} for word in ANSWER.split()]
+            events[-1]['usageMetadata'] = {'promptTokenCount': 120, 'candidatesTokenCount': 14}
+            return self._stream('text/event-stream', [f"data: {json.dumps(event)}\n\n" for event in events])
+        if path.endswith('/chat/completions'):
+            if payload.get('stream'):
+                events = [{'choices': [{'index': 0, 'delta': {'content': word + ' '}}]} for word in ANSWER.split()]
+                lines = [f"data: {json.dumps(event)}\n\n" for event in events] + ["data: [DONE]\n\n"]
+                return self._stream('text/event-stream', lines)
+            return self._json(200, {
+                'id': 'chatcmpl-stub', 'object': 'chat.completion', 'model': payload.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ANSWER}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 120, 'completion_tokens': 14, 'total_tokens': 134},
+            })
+        if path == '/api/generate':
+            done = {'done': True, 'prompt_eval_count': 120, 'eval_count': 14, 'context': [1, 2, 3]}
+            if payload.get('stream', True):
+                lines = [json.dumps({'response': word + ' ', 'done': False}) + '\n' for word in ANSWER.split()]
+                return self._stream('application/x-ndjson', lines + [json.dumps(done) + '\n'])
+            return self._json(200, dict(done, response=ANSWER))
+        if path.endswith('/groups') and self.command == 'GET':
+            return self._json(200, [{'id': 42, 'name': 'Welcome'}])
+        if re.search(r'/groups/[^/]+/subscribers/import$', path):
+            stub.count('mailerlite_subscribers', len(payload.get('subscribers', [])))
+            return self._json(200, {'imported': payload.get('subscribers', []), 'errors': []})
+        return self._json(404, {'error': f'no stub for {path}'})
+
+    def _json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, content_type, pieces):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for piece in pieces:
+            data = piece.encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+class _QuietServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-response (e.g. a worker shutting down) are expected under load
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubServer:
+    """The stub APIs on a background thread, with call counts per path"""
+
+    def __init__(self, latency=0.2, jitter=0.0, error_rate=0.0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = {}
+        self._lock = threading.Lock()
+        self.httpd = _QuietServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, key, amount=1):
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + amount
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name='stub-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def env(self, provider='gemini', mailerlite=True):
+        """Environment variables that point the app's upstreams at this server"""
+        env = {
+            'AI_PROVIDER': provider,
+            'GEMINI_API_KEY': 'stub',
+            'GEMINI_BASE_URL': f'{self.url}/v1beta/models/gemini-pro',
+            'OPENAI_API_KEY': 'stub',
+            'OPENAI_API_BASE': f'{self.url}/v1',
+            'OLLAMA_URL': self.url,
+        }
+        if mailerlite:
+            env.update(MAILERLITE_API_KEY='stub', MAILERLITE_API_URL=f'{self.url}/api/v2', MAILERLITE_GROUP_ID='42')
+        return env
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args(argv)
+    server = StubServer(args.latency, args.jitter, args.error_rate, port=args.port)
+    print(f"Stub APIs on {server.url}")
+    for name, value in server.env().items():
+        print(f"  {name}={value}")
+    server.httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Read-through cache for blog post API responses.
+
+Posts rarely change, so the serialized JSON for the post list and for each
+slug is kept per worker as a ``snapshots.Snapshot`` (strong ETag plus
+gzip/brotli variants). Entries are tagged with the content watermark
+(number of published posts plus the newest ``updated_at``/``created_at``)
+they were built from; the watermark is
+re-read at most every ``check_interval`` seconds, and any change makes
+every entry stale. ``invalidate()`` forces a re-read straight away.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from snapshots import Snapshot, dump_json
+
+
+class BlogCache:
+    """Caches serialized responses until the content watermark moves"""
+
+    def __init__(self, load_watermark, check_interval=30.0, max_entries=500):
+        self.load_watermark = load_watermark
+        self.check_interval = check_interval
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._watermark = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def watermark(self):
+        """(version, last_modified) of the published content, re-read when due"""
+        now = time.monotonic()
+        if self._watermark is None or now - self._checked_at >= self.check_interval:
+            watermark = self.load_watermark()
+            with self._lock:
+                if watermark != self._watermark:
+                    self._entries.clear()
+                self._watermark = watermark
+                self._checked_at = now
+        return self._watermark
+
+    def get(self, key, loader, status=200):
+        """Return the cached body for ``key``, building it with ``loader()`` on a miss.
+
+        ``loader`` returns a JSON-serializable value, None for "not found",
+        or a ``(value, headers)`` tuple when the response needs extra headers
+        (e.g. pagination).
+        """
+        version, last_modified = self.watermark()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        data = loader()
+        headers = None
+        if isinstance(data, tuple):
+            data, headers = data
+        if data is None:
+            cached = Snapshot(json.dumps({'error': 'Post not found'}).encode('utf-8'), status=404)
+        else:
+            cached = Snapshot(dump_json(data), last_modified, status, headers)
+
+        with self._lock:
+            self._entries[key] = (version, cached)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return cached
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._watermark = None
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def mongo_watermark(db):
+    """Watermark for published posts in MongoDB (one small aggregate)"""
+    rows = list(db.posts.aggregate([
+        {'$match': {'status': 'published'}},
+        {'$group': {
+            '_id': None,
+            'count': {'$sum': 1},
+            'latest': {'$max': {'$ifNull': ['$updated_at', '$created_at']}},
+        }},
+    ]))
+    if not rows:
+        return (0, None), None
+    latest = rows[0]['latest']
+    return (rows[0]['count'], latest), latest
@@ -0,0 +1,120 @@
+"""Product catalog shared by /api/gear, /affiliate/<product> and chat recommendations.
+
+Products are loaded once, from ``data/products.json`` or from the
+``products`` collection in MongoDB. Chat keywords for all products are
+compiled into a single word-boundary regex, so one pass over a message
+finds every mention ("water" matches, "waterproof" doesn't) and the
+products are ranked by how often they were mentioned. The alternation is
+built from a prefix trie of the keywords, which keeps the regex engine
+from retrying every keyword at every position.
+"""
+import json
+import os
+import re
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'products.json')
+
+# Fields /api/gear returns, in order
+GEAR_FIELDS = (
+    'name', 'image', 'description', 'affiliate_id', 'price', 'old_price', 'savings',
+    'rating', 'commission', 'badges', 'specs',
+)
+
+
+def trie_pattern(words):
+    """Regex alternation for ``words`` factored on common prefixes
+
+    ``['power', 'powered', 'prepper']`` becomes ``p(?:ower(?:ed)?|repper)``.
+    Optional tails are greedy, so the longest keyword wins.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def emit(node):
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        optional = '' in node
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')' + ('?' if optional else '')
+
+    return emit(trie)
+
+
+def compile_keywords(products):
+    """Compile every product keyword into one regex; returns (pattern, keyword -> product ids)"""
+    owners = {}
+    for product in products:
+        for keyword in product.get('keywords', []):
+            owners.setdefault(keyword.lower(), []).append(product['id'])
+    if not owners:
+        return None, owners
+    # Keywords are matched against the lowercased message; optional plural s/es
+    return re.compile(rf"\b({trie_pattern(owners)})(?:e?s)?\b"), owners
+
+
+class ProductCatalog:
+    """Immutable view of the products; build a new one to reload"""
+
+    def __init__(self, products):
+        self.products = [dict(product) for product in products]
+        self.by_id = {product['id']: product for product in self.products}
+        self._pattern, self._owners = compile_keywords(self.products)
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_CATALOG_PATH):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def from_mongo(cls, collection, fallback_path=DEFAULT_CATALOG_PATH):
+        """Load active products from MongoDB, falling back to the bundled file when empty"""
+        products = list(collection.find({'active': {'$ne': False}}, {'_id': 0}))
+        if not products:
+            return cls.from_file(fallback_path)
+        return cls(products)
+
+    def get(self, product_id):
+        return self.by_id.get(product_id)
+
+    def links(self):
+        """product id -> affiliate URL"""
+        return {product['id']: product['link'] for product in self.products if product.get('link')}
+
+    def gear_items(self):
+        """Products listed on the gear page, in the /api/gear format"""
+        items = []
+        for product in self.products:
+            if not product.get('listed', True):
+                continue
+            item = dict(product, affiliate_id=product['id'])
+            items.append({field: item[field] for field in GEAR_FIELDS if field in item})
+        return items
+
+    def recommend(self, message, limit=3):
+        """Products mentioned in ``message``, most-mentioned first, as chat recommendations"""
+        if not message or self._pattern is None:
+            return []
+        scores = {}
+        first_seen = {}
+        for position, keyword in enumerate(self._pattern.findall(message.lower())):
+            for product_id in self._owners[keyword]:
+                scores[product_id] = scores.get(product_id, 0) + 1
+                first_seen.setdefault(product_id, position)
+
+        ranked = sorted(scores, key=lambda product_id: (-scores[product_id], first_seen[product_id]))
+        recommendations = []
+        for product_id in ranked[:limit]:
+            product = self.by_id[product_id]
+            recommendations.append({
+                'id': product_id,
+                'name': product.get('short_name', product['name']),
+                'price': product.get('price'),
+                'image': product.get('image')
+            })
+        return recommendations
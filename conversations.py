@@ -0,0 +1,88 @@
+"""Server-side chat history keyed by ``visitor_id``.
+
+Only the visitor id travels in a cookie; the messages live here. Each
+stored message carries its token count, so ``prompts.PromptBuilder`` can
+fill the prompt from the newest message backwards up to a token budget
+without recounting.
+
+Backends: an in-process LRU (per worker) and a MongoDB collection with a
+TTL index on ``updated_at`` (shared by workers).
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from memstore import is_memory
+from prompts import estimate_tokens
+
+
+def make_message(role, content):
+    return {'role': role, 'content': content, 'tokens': estimate_tokens(content)}
+
+
+class MemoryConversationStore:
+    """LRU of conversations in this worker, expired after ``ttl`` seconds idle"""
+
+    def __init__(self, max_conversations=5000, max_messages=20, ttl=7 * 24 * 3600):
+        self.max_conversations = max_conversations
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def history(self, visitor_id):
+        with self._lock:
+            conversation = self._conversations.get(visitor_id)
+            if conversation is None:
+                return []
+            if conversation['expires_at'] < time.monotonic():
+                del self._conversations[visitor_id]
+                return []
+            self._conversations.move_to_end(visitor_id)
+            return list(conversation['messages'])
+
+    def append(self, visitor_id, *messages):
+        with self._lock:
+            conversation = self._conversations.get(visitor_id)
+            if conversation is None or conversation['expires_at'] < time.monotonic():
+                conversation = {'messages': []}
+                self._conversations[visitor_id] = conversation
+            conversation['messages'] = (conversation['messages'] + list(messages))[-self.max_messages:]
+            conversation['expires_at'] = time.monotonic() + self.ttl
+            self._conversations.move_to_end(visitor_id)
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+
+
+class MongoConversationStore:
+    """Conversations in MongoDB, removed by a TTL index after ``ttl`` seconds idle"""
+
+    def __init__(self, collection, max_messages=20, ttl=7 * 24 * 3600):
+        self.collection = collection
+        self.max_messages = max_messages
+        self.ttl = ttl
+
+    def ensure_indexes(self):
+        self.collection.create_index('updated_at', expireAfterSeconds=self.ttl)
+
+    def history(self, visitor_id):
+        doc = self.collection.find_one({'_id': visitor_id}, {'messages': 1})
+        return doc['messages'] if doc else []
+
+    def append(self, visitor_id, *messages):
+        self.collection.update_one(
+            {'_id': visitor_id},
+            {
+                '$push': {'messages': {'$each': list(messages), '$slice': -self.max_messages}},
+                '$set': {'updated_at': datetime.utcnow()},
+            },
+            upsert=True
+        )
+
+
+def create_conversation_store(backend_name, db, max_messages=20, ttl=7 * 24 * 3600):
+    """Build the store selected by ``CONVERSATION_STORE``"""
+    if backend_name == 'mongo' and not is_memory(db):
+        return MongoConversationStore(db.conversations, max_messages=max_messages, ttl=ttl)
+    return MemoryConversationStore(max_messages=max_messages, ttl=ttl)
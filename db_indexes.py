@@ -0,0 +1,58 @@
+"""Indexes the app relies on, created once per worker at startup.
+
+``create_index`` is a no-op when the index already exists, so running this
+from every worker is cheap. Backends that own a collection (the Mongo
+response cache, rate limits, conversations...) declare theirs in an
+``ensure_indexes()`` method, passed in as ``owners``.
+"""
+import logging
+
+from pymongo import ASCENDING, DESCENDING
+
+logger = logging.getLogger(__name__)
+
+# collection -> [(keys, options)]
+INDEXES = {
+    'subscribers': [
+        ([('email', ASCENDING)], {'unique': True, 'name': 'email_unique'}),
+        ([('mailerlite_status', ASCENDING), ('mailerlite_next_attempt_at', ASCENDING)], {'name': 'mailerlite_outbox'}),
+    ],
+    'posts': [
+        ([('slug', ASCENDING), ('status', ASCENDING)], {'name': 'slug_status'}),
+        # Keyset pagination of the post list, optionally filtered by tag or category
+        ([('status', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)], {'name': 'status_created'}),
+        ([('status', ASCENDING), ('tags', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+         {'name': 'status_tags_created'}),
+        ([('status', ASCENDING), ('category', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)],
+         {'name': 'status_category_created'}),
+    ],
+    'affiliate_clicks': [
+        ([('timestamp', DESCENDING)], {'name': 'timestamp'}),
+        ([('product_id', ASCENDING), ('timestamp', DESCENDING)], {'name': 'product_timestamp'}),
+    ],
+    # Time-range reads and deletes by the export/compaction tool
+    'ai_usage': [
+        ([('timestamp', DESCENDING)], {'name': 'timestamp'}),
+    ],
+    'analytics_rollups': [
+        ([('dimension', ASCENDING), ('date', ASCENDING)], {'name': 'dimension_date'}),
+    ],
+}
+
+
+def ensure_indexes(db, owners=()):
+    """Create every declared index; failures are logged, not raised"""
+    created = []
+    for owner in owners:
+        try:
+            owner.ensure_indexes()
+        except Exception as e:
+            logger.warning("Could not create indexes for %s: %s", type(owner).__name__, e)
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                created.append(f"{collection}.{db[collection].create_index(keys, **options)}")
+            except Exception as e:
+                # e.g. duplicate emails from before the unique index existed
+                logger.warning("Could not create index %s on %s: %s", options.get('name'), collection, e)
+    return created
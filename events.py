@@ -0,0 +1,196 @@
+"""Background ingest pipeline for tracking events (affiliate clicks, AI usage).
+
+Request handlers hand documents to ``EventPipeline.emit()`` and return
+immediately; a flusher thread writes them in batches through the ``storage``
+repository once ``batch_size`` events are waiting or ``flush_interval``
+seconds have passed. ``enrich`` maps a collection to a function the flusher
+applies to each of its documents before the write, so derived fields (e.g.
+parsed user agents) stay off the request path. ``on_write`` is called with
+each successfully written batch (used for analytics rollups).
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class _FlushRequest:
+    """Marker put on the queue to ask the flusher thread to write everything it holds"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class EventPipeline:
+    """Bounded in-process queue plus a flusher thread that batches writes"""
+
+    def __init__(self, repository, batch_size=100, flush_interval=1.0, max_queue=10000, enqueue_timeout=0.0,
+                 on_write=None, enrich=None):
+        self.repository = repository
+        self.on_write = on_write
+        self.enrich = enrich or {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._counters = {
+            'enqueued': 0,
+            'flushed': 0,
+            'dropped': 0,
+            'failed': 0,
+            'batches': 0,
+        }
+
+    # --- PRODUCER SIDE ---
+    def emit(self, collection, document):
+        """Queue a document for ``collection``. Returns False if it was dropped."""
+        self._ensure_started()
+        try:
+            if self.enqueue_timeout > 0:
+                # Backpressure: wait a little for the flusher to catch up before giving up
+                self._queue.put((collection, document), timeout=self.enqueue_timeout)
+            else:
+                self._queue.put_nowait((collection, document))
+        except queue.Full:
+            self._count('dropped')
+            return False
+        self._count('enqueued')
+        return True
+
+    def flush(self, timeout=5.0):
+        """Block until every event queued so far has been written"""
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            # No flusher in this process; drain synchronously
+            items, markers = self._drain()
+            self._write(items)
+            for pending in markers:
+                pending.done.set()
+            return True
+        marker = _FlushRequest()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(timeout)
+
+    def stop(self, timeout=5.0):
+        """Flush outstanding events and stop the flusher thread (worker shutdown)"""
+        self.flush(timeout)
+        self._stopping = True
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            try:
+                self._queue.put_nowait(_FlushRequest())  # wake the flusher so it sees _stopping
+            except queue.Full:
+                pass
+            thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        """Return a snapshot of the pipeline counters"""
+        with self._lock:
+            counters = dict(self._counters)
+        counters['queued'] = self._queue.qsize()
+        return counters
+
+    # --- FLUSHER SIDE ---
+    def _ensure_started(self):
+        # The thread is started lazily so it is created in each gunicorn
+        # worker after the fork rather than in the master process.
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stopping = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='event-pipeline', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while not self._stopping:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, _FlushRequest):
+                items, markers = self._drain()
+                self._write(batch + items)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                for pending in [item] + markers:
+                    pending.done.set()
+                continue
+
+            if item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or (batch and time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+        self._write(batch)
+
+    def _drain(self):
+        items, markers = [], []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return items, markers
+            if isinstance(item, _FlushRequest):
+                markers.append(item)
+            else:
+                items.append(item)
+
+    def _write(self, batch):
+        if not batch:
+            return
+        by_collection = defaultdict(list)
+        for collection, document in batch:
+            by_collection[collection].append(document)
+
+        for collection, documents in by_collection.items():
+            enrich = self.enrich.get(collection)
+            if enrich is not None:
+                documents = self._enriched(collection, enrich, documents)
+            try:
+                self.repository.record_events(collection, documents)
+            except Exception as e:
+                self._count('failed', len(documents))
+                logger.warning("Event pipeline write to %s failed: %s", collection, e)
+            else:
+                self._count('flushed', len(documents))
+                self._count('batches')
+                if self.on_write is not None:
+                    try:
+                        self.on_write(collection, documents)
+                    except Exception as e:
+                        logger.warning("Event pipeline on_write for %s failed: %s", collection, e)
+
+    def _enriched(self, collection, enrich, documents):
+        enriched = []
+        for document in documents:
+            try:
+                enriched.append(enrich(document))
+            except Exception as e:
+                # Keep the raw event rather than lose it
+                logger.warning("Event pipeline enrich for %s failed: %s", collection, e)
+                enriched.append(document)
+        return enriched
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
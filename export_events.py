@@ -0,0 +1,57 @@
+"""Export the event collections to daily NDJSON partitions, optionally removing old raw events.
+
+    python export_events.py --output exports                      # export every complete day
+    python export_events.py --output exports --start 2025-07-01 --end 2025-08-01 --stream ai_usage
+    python export_events.py --output exports --compact --retain-days 30
+    python export_events.py --output exports --delete --retain-days 90
+
+Partitions are written to <output>/<stream>/<YYYY-MM-DD>.ndjson.gz (gzipped,
+one JSON document per line). --compact replaces exported days older than
+--retain-days with one weighted event per product or provider, so the
+rollups (and backfill_rollups.py) keep the same totals. --delete drops them
+instead, which also drops them from future rollup rebuilds. Progress is
+saved to <output>/checkpoint.json; run the same command again to resume.
+"""
+import argparse
+import logging
+import sys
+from datetime import datetime
+
+from exports import STREAMS, EventExporter
+from storage import open_repository
+
+
+def parse_day(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', required=True, help='directory for the partitions')
+    parser.add_argument('--stream', action='append', choices=STREAMS, help='default: all event streams')
+    parser.add_argument('--start', type=parse_day, help='first day (default: the oldest event)')
+    parser.add_argument('--end', type=parse_day, help='day to stop before (default: today, UTC)')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--checkpoint', help='default: <output>/checkpoint.json')
+    removal = parser.add_mutually_exclusive_group()
+    removal.add_argument('--compact', action='store_const', const='compact', dest='mode')
+    removal.add_argument('--delete', action='store_const', const='delete', dest='mode')
+    parser.add_argument('--retain-days', type=int, default=30, help='raw days kept by --compact/--delete')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    # Make sure MONGODB_URI (or STORAGE_BACKEND=sqlite and SQLITE_PATH) is set in your environment before running this
+    repository = open_repository()
+    exporter = EventExporter(repository, args.output, checkpoint=args.checkpoint, batch_size=args.batch_size,
+                             mode=args.mode, retain_days=args.retain_days)
+    try:
+        report = exporter.run(streams=args.stream or STREAMS, start=args.start, end=args.end)
+    finally:
+        repository.close()
+    for stream, totals in report.items():
+        print(f"{stream}: {totals['exported']} exported, {totals['removed']} removed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
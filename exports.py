@@ -0,0 +1,168 @@
+"""Offline export and compaction of the event collections.
+
+``EventExporter`` walks ``ai_usage`` and ``affiliate_clicks`` one UTC day at
+a time. Each day is read as a time-range query in batches (a server-side
+cursor on MongoDB) and written to ``<output>/<stream>/<day>.ndjson.gz``, via
+a temporary file, so a partition is either complete or absent. Days older
+than ``retain_days`` can then be removed from storage:
+
+- ``delete``: the raw events are deleted
+- ``compact``: the raw events are replaced by the day's weighted events
+  from ``analytics.compact()``, so rollup rebuilds stay exact
+
+Compaction is computed from the partition file, not from storage, so it only
+removes what has been exported. Existing partitions are never overwritten.
+Progress is saved in a JSON checkpoint after every step. A run that was
+interrupted picks up where it stopped, and repeating a step is harmless:
+compaction deletes the day, aggregates included, before inserting the
+aggregates.
+"""
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+import analytics
+
+logger = logging.getLogger(__name__)
+
+STREAMS = ('ai_usage', 'affiliate_clicks')
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)  # ObjectId and the like
+
+
+def json_line(document):
+    """One NDJSON line for a document, without its storage ``_id``"""
+    return json.dumps({key: value for key, value in document.items() if key != '_id'},
+                      separators=(',', ':'), default=_json_default) + '\n'
+
+
+def write_ndjson(path, documents):
+    """Write documents to a gzipped NDJSON file, replacing it atomically; returns the row count"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    rows = 0
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        for document in documents:
+            f.write(json_line(document))
+            rows += 1
+    os.replace(tmp_path, path)
+    return rows
+
+
+def read_ndjson(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def day_range(start, end):
+    """YYYY-MM-DD strings for the days from ``start`` up to, not including, ``end``"""
+    day = start
+    while day < end:
+        yield day.strftime('%Y-%m-%d')
+        day += timedelta(days=1)
+
+
+class Checkpoint:
+    """Per stream, the last day exported and the last day deleted or compacted, saved as JSON"""
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def get(self, stream, step):
+        return self.state.get(stream, {}).get(step)
+
+    def done(self, stream, step, day):
+        self.state.setdefault(stream, {})[step] = day
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class EventExporter:
+    """Exports event streams to daily partitions and optionally deletes or compacts what was exported"""
+
+    def __init__(self, repository, output, checkpoint=None, batch_size=1000, mode=None, retain_days=30):
+        if mode not in (None, 'delete', 'compact'):
+            raise ValueError(f"Unknown mode '{mode}'")
+        self.repository = repository
+        self.output = output
+        self.checkpoint = Checkpoint(checkpoint or os.path.join(output, 'checkpoint.json'))
+        self.batch_size = batch_size
+        self.mode = mode
+        self.retain_days = retain_days
+
+    def partition_path(self, stream, day):
+        return os.path.join(self.output, stream, f'{day}.ndjson.gz')
+
+    def run(self, streams=STREAMS, start=None, end=None, today=None):
+        """Process the complete days in ``[start, end)``; returns ``{stream: {'exported': n, 'removed': n}}``
+
+        ``start`` defaults to the oldest event's day, ``end`` to today (UTC).
+        """
+        today = today or datetime.utcnow().date()
+        end = min(end or today, today)  # today is still being written
+        cutoff = (today - timedelta(days=self.retain_days)).strftime('%Y-%m-%d')
+        report = {}
+        for stream in streams:
+            first = start
+            if first is None:
+                oldest = self.repository.oldest_event_time(stream)
+                if oldest is None:
+                    report[stream] = {'exported': 0, 'removed': 0}
+                    continue
+                first = oldest.date()
+            report[stream] = self.run_stream(stream, first, end, cutoff)
+        return report
+
+    def run_stream(self, stream, start, end, cutoff):
+        totals = {'exported': 0, 'removed': 0}
+        exported_through = self.checkpoint.get(stream, 'exported') or ''
+        removed_through = (self.checkpoint.get(stream, self.mode) or '') if self.mode else ''
+        for day in day_range(start, end):
+            if day > exported_through:
+                if os.path.exists(self.partition_path(stream, day)):
+                    # Written by an earlier run (files only appear once complete); never overwrite it
+                    logger.info("%s for %s is already exported", stream, day)
+                else:
+                    totals['exported'] += self.export_day(stream, day)
+                self.checkpoint.done(stream, 'exported', day)
+            if self.mode and day < cutoff and day > removed_through:
+                totals['removed'] += self.remove_day(stream, day)
+                self.checkpoint.done(stream, self.mode, day)
+        return totals
+
+    def export_day(self, stream, day):
+        start = datetime.strptime(day, '%Y-%m-%d')
+        documents = self.repository.iter_events(stream, batch_size=self.batch_size,
+                                                start=start, end=start + timedelta(days=1))
+        rows = write_ndjson(self.partition_path(stream, day), documents)
+        logger.info("Exported %s rows of %s for %s", rows, stream, day)
+        return rows
+
+    def remove_day(self, stream, day):
+        """Delete or compact a day of raw events; returns how many events were removed"""
+        path = self.partition_path(stream, day)
+        if not os.path.exists(path):
+            # Exported elsewhere or moved away: export again so nothing leaves storage unexported
+            self.export_day(stream, day)
+        start = datetime.strptime(day, '%Y-%m-%d')
+        end = start + timedelta(days=1)
+        aggregates = analytics.compact(stream, read_ndjson(path), day) if self.mode == 'compact' else []
+        removed = self.repository.delete_events(stream, start, end)
+        if aggregates:
+            self.repository.record_events(stream, aggregates)
+        logger.info("%s %s events of %s for %s", 'Compacted' if aggregates else 'Deleted', removed, stream, day)
+        return removed
@@ -0,0 +1,139 @@
+"""Export the site as static files for Cloudflare Pages.
+
+    python freeze.py [--output build]
+
+Renders every page route (and every published blog slug), writes JSON
+snapshots of the cacheable API responses under ``api/``, copies the static
+assets and generates ``_redirects``: affiliate and social links become
+plain 302s, and the snapshot URLs are rewritten to their ``.json`` files.
+The static ``/api/blog-posts`` holds every published post in one list:
+rewrites cannot match query strings, so ``cursor``, ``limit``, ``fields``,
+``tag`` and ``category`` are ignored there. Only the dynamic endpoints (chat, subscribe, click tracking, analytics)
+still need the Flask app.
+
+Note that affiliate clicks served by the generated 302s are not recorded
+server-side; pages that need click tracking should keep posting to
+``/api/affiliate-click``.
+"""
+import argparse
+import os
+import shutil
+import sys
+
+from pagination import MAX_LIMIT
+from snapshots import dump_json
+
+# API endpoints whose responses only change when content does
+SNAPSHOT_ENDPOINTS = ('api_gear', 'api_blog_posts', 'api_blog_post')
+# Endpoints that have to stay on the Flask side (or are exported as redirects)
+DYNAMIC_ENDPOINTS = (
+    'static', 'guerilla_chat', 'subscribe', 'affiliate_click', 'affiliate',
+    'social_redirect', 'api_analytics_summary',
+)
+STATIC_ASSETS = (
+    'css', 'js', 'img', 'static', 'conversions.js', 'exit-intent.js',
+    'favicon.ico', 'favicon-16x16.png', 'favicon-32x32.png', 'apple-touch-icon.png',
+    'android-chrome-512x512.png', 'webmanifest.json', 'thank_you.html',
+)
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def blog_posts(client):
+    """Every published post from the list endpoint, following its cursor"""
+    posts = []
+    url = f'/api/blog-posts?limit={MAX_LIMIT}'
+    while url:
+        response = client.get(url)
+        posts.extend(response.get_json())
+        cursor = response.headers.get('X-Next-Cursor')
+        url = f'/api/blog-posts?limit={MAX_LIMIT}&cursor={cursor}' if cursor else None
+    return posts
+
+
+def expand_rule(rule, slugs):
+    """Concrete URLs for a URL rule; rules with a <slug> are expanded per post"""
+    if not rule.arguments:
+        return [rule.rule]
+    if rule.arguments == {'slug'}:
+        return [rule.rule.replace('<slug>', slug) for slug in slugs]
+    return []
+
+
+def page_path(url):
+    """Output file for a page URL (``/`` -> ``index.html``, ``/blog/x`` -> ``blog/x.html``)"""
+    return 'index.html' if url == '/' else url.strip('/') + '.html'
+
+
+def write(output, path, data):
+    target = os.path.join(output, path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(data)
+
+
+def build_redirects(affiliate_links, social_links, snapshot_urls):
+    lines = ['# Generated by freeze.py', '', '# Affiliate links']
+    lines += [f'/affiliate/{product} {url} 302' for product, url in affiliate_links.items()]
+    lines += ['', '# Social links']
+    lines += [f'/social/{platform} {url} 302' for platform, url in social_links.items()]
+    lines += ['', '# API snapshots']
+    lines += [f'{url} {url}.json 200' for url in snapshot_urls]
+
+    existing = os.path.join(ROOT, '_redirects')
+    if os.path.exists(existing):
+        with open(existing) as f:
+            lines += ['', '# From the repository _redirects', f.read().strip()]
+    return '\n'.join(lines) + '\n'
+
+
+def freeze(output):
+    from app import app, link_tables
+
+    client = app.test_client()
+    posts = blog_posts(client)
+    slugs = [post['slug'] for post in posts]
+    pages, snapshots = [], []
+
+    for rule in app.url_map.iter_rules():
+        if 'GET' not in rule.methods or rule.endpoint in DYNAMIC_ENDPOINTS:
+            continue
+        for url in expand_rule(rule, slugs):
+            response = client.get(url)
+            if response.status_code != 200:
+                print(f"skipped {url} ({response.status_code})", file=sys.stderr)
+                continue
+            if rule.endpoint == 'api_blog_posts':
+                # One static file for every page the endpoint would serve
+                write(output, url.strip('/') + '.json', dump_json(posts))
+                snapshots.append(url)
+            elif rule.endpoint in SNAPSHOT_ENDPOINTS:
+                write(output, url.strip('/') + '.json', response.data)
+                snapshots.append(url)
+            else:
+                write(output, page_path(url), response.data)
+                pages.append(url)
+
+    for asset in STATIC_ASSETS:
+        source = os.path.join(ROOT, asset)
+        target = os.path.join(output, asset)
+        if os.path.isdir(source):
+            shutil.copytree(source, target, dirs_exist_ok=True)
+        elif os.path.exists(source):
+            shutil.copy2(source, target)
+
+    write(output, '_redirects', build_redirects(link_tables.table('affiliate'), link_tables.table('social'), snapshots).encode('utf-8'))
+    return pages, snapshots
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the site as static files')
+    parser.add_argument('--output', default=os.path.join(ROOT, 'build'))
+    args = parser.parse_args(argv)
+
+    pages, snapshots = freeze(args.output)
+    print(f"Wrote {len(pages)} pages and {len(snapshots)} API snapshots to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
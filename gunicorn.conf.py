@@ -0,0 +1,27 @@
+# Gunicorn picks this file up automatically from the working directory.
+#
+# Worker count comes from WEB_CONCURRENCY (gunicorn reads it directly).
+#
+# SERVING_MODE=sync   one request per worker process (gunicorn default)
+# SERVING_MODE=async  gevent workers: each request runs in a greenlet and
+#                     blocking I/O (requests, pymongo, sockets) yields to the
+#                     others, so chats waiting on Gemini/Ollama/MailerLite or
+#                     Mongo don't hold up page routes.
+import os
+
+SERVING_MODE = os.environ.get('SERVING_MODE', 'sync')
+
+if SERVING_MODE == 'async':
+    worker_class = 'gevent'
+    # Concurrent requests per worker
+    worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 500))
+    # Long SSE chat streams are normal here, so only kill truly stuck workers
+    timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+
+
+def worker_exit(server, worker):
+    """Flush queued tracking events and telemetry, and close the storage (snapshotting the in-memory store)"""
+    from app import metrics, repository, stop_event_pipeline
+    stop_event_pipeline()
+    repository.close()
+    metrics.stop()
@@ -0,0 +1,238 @@
+"""Shared outbound HTTP layer for AI providers and MailerLite.
+
+One pooled ``requests.Session`` keeps connections alive per host, every call
+gets connect and read timeouts, transient failures are retried a bounded
+number of times with jittered exponential backoff, and a circuit breaker per
+upstream stops calling a provider that keeps failing so callers can fall
+back straight away.
+"""
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class UpstreamError(Exception):
+    """An upstream call failed after retries"""
+
+    def __init__(self, upstream, message):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+
+
+class CircuitOpenError(UpstreamError):
+    """The upstream's circuit breaker is open; the call was not attempted"""
+
+    def __init__(self, upstream):
+        super().__init__(upstream, 'circuit open')
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures.
+
+    After ``reset_timeout`` seconds one trial call is let through
+    (half-open); success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class UpstreamMetrics:
+    """Call counts and a window of recent latencies for one upstream"""
+
+    def __init__(self, window=500):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency, error=False):
+        with self._lock:
+            self.calls += 1
+            if error:
+                self.errors += 1
+            self.latencies.append(latency)
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            calls, errors, retries, rejected = self.calls, self.errors, self.retries, self.rejected
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+
+        return {
+            'calls': calls,
+            'errors': errors,
+            'retries': retries,
+            'rejected': rejected,
+            'error_rate': round(errors / calls, 4) if calls else 0.0,
+            'latency_ms': {'p50': percentile(0.50), 'p95': percentile(0.95), 'p99': percentile(0.99)},
+        }
+
+
+class HTTPClient:
+    """Pooled, keep-alive client with timeouts, retries and per-upstream breakers"""
+
+    def __init__(self, connect_timeout=3.05, read_timeout=30.0, max_retries=2, backoff=0.25,
+                 pool_size=10, failure_threshold=5, reset_timeout=30.0, on_attempt=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        # on_attempt(upstream, seconds, error) is called after every attempt (telemetry)
+        self.on_attempt = on_attempt
+        self.session = requests.Session()
+        # urllib3 keeps a separate pool per host; pool_maxsize bounds each one
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._breakers = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, upstream):
+        with self._lock:
+            if upstream not in self._breakers:
+                self._breakers[upstream] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._metrics[upstream] = UpstreamMetrics()
+            return self._breakers[upstream]
+
+    def metrics(self, upstream):
+        self.breaker(upstream)
+        return self._metrics[upstream]
+
+    def is_healthy(self, upstream):
+        return self.breaker(upstream).state != 'open'
+
+    def post(self, upstream, url, **kwargs):
+        return self.request(upstream, 'POST', url, **kwargs)
+
+    def get(self, upstream, url, **kwargs):
+        return self.request(upstream, 'GET', url, **kwargs)
+
+    def request(self, upstream, method, url, **kwargs):
+        """Send a request, retrying transient failures.
+
+        Raises ``CircuitOpenError`` without sending anything when the
+        upstream is unhealthy and ``UpstreamError`` when every attempt failed.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        return self.call(upstream, self._send, method, url, **kwargs)
+
+    def call(self, upstream, fn, *args, **kwargs):
+        """Run ``fn`` under the upstream's breaker, retry policy and metrics.
+
+        Used directly for SDK clients (OpenAI) that don't go through the session.
+        """
+        breaker = self.breaker(upstream)
+        metrics = self._metrics[upstream]
+        if not breaker.allow():
+            metrics.count('rejected')
+            raise CircuitOpenError(upstream)
+
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                metrics.count('retries')
+                # Full jitter keeps retrying workers from hitting the upstream in lockstep
+                time.sleep(random.uniform(0, self.backoff * (2 ** (attempt - 1))))
+            started = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self._observe(upstream, metrics, time.monotonic() - started, error=True)
+                last_error = e
+                if not _is_retryable(e):
+                    break
+                continue
+            self._observe(upstream, metrics, time.monotonic() - started)
+            breaker.record_success()
+            return result
+
+        breaker.record_failure()
+        raise UpstreamError(upstream, str(last_error)) from last_error
+
+    def stats(self):
+        with self._lock:
+            upstreams = list(self._breakers)
+        return {
+            upstream: dict(self._metrics[upstream].snapshot(), circuit=self._breakers[upstream].state)
+            for upstream in upstreams
+        }
+
+    def _observe(self, upstream, metrics, seconds, error=False):
+        metrics.record(seconds, error=error)
+        if self.on_attempt is not None:
+            self.on_attempt(upstream, seconds, error)
+
+    def _send(self, method, url, **kwargs):
+        response = self.session.request(method, url, **kwargs)
+        if response.status_code in RETRY_STATUSES:
+            response.close()
+            raise _RetryableStatus(response.status_code)
+        return response
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def _is_retryable(error):
+    if isinstance(error, (_RetryableStatus, requests.ConnectionError, requests.Timeout)):
+        return True
+    # openai<1.0 names its transient errors this way
+    return type(error).__name__ in ('APIConnectionError', 'Timeout', 'RateLimitError', 'ServiceUnavailableError')
@@ -0,0 +1,43 @@
+"""Once-per-process initialization for heavy integrations.
+
+``Lazy(factory)`` runs ``factory()`` the first time ``get()`` is called and
+hands back the same object afterwards, so SDK imports, telemetry exporters
+and clients are set up on first use instead of when ``app`` is imported.
+Like the background threads, the value is per process: a gunicorn worker
+forked after it was built gets its own on first use.
+"""
+import os
+import threading
+import time
+
+
+class Lazy:
+    """A value built on first ``get()`` and reused by every later call in the process"""
+
+    def __init__(self, factory, name=None):
+        self.factory = factory
+        self.name = name or getattr(factory, '__name__', 'lazy')
+        self.init_seconds = None
+        self._value = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._pid == os.getpid()
+
+    def get(self):
+        if self._pid == os.getpid():
+            return self._value
+        with self._lock:
+            if self._pid != os.getpid():
+                started = time.perf_counter()
+                self._value = self.factory()
+                self.init_seconds = time.perf_counter() - started
+                self._pid = os.getpid()
+        return self._value
+
+    def reset(self):
+        with self._lock:
+            self._value = None
+            self._pid = None
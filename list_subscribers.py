@@ -1,12 +1,82 @@
-from pymongo import MongoClient
-import os
+"""Stream subscribers out as NDJSON or CSV.
 
-# Make sure MONGO_URI is set in your environment before running this
-client = MongoClient(os.environ["MONGO_URI"])
-db = client["gorillacamping"]
-subscribers = db["subscribers"]
+    python list_subscribers.py                                    # NDJSON to stdout
+    python list_subscribers.py --status synced --source blog --since 2025-07-01
+    python list_subscribers.py --format csv --output subscribers.csv
+    python list_subscribers.py --output subscribers.ndjson.gz      # gzipped by extension
 
-print("Email Subscribers:")
-for sub in subscribers.find():
-    print(sub)
+Subscribers are read in batches and written as they arrive, so memory use
+does not grow with the list. --since/--until filter on the signup time
+(--until is exclusive).
+"""
+import argparse
+import csv
+import gzip
+import sys
+from datetime import datetime
 
+from exports import json_line
+from storage import open_repository
+
+CSV_FIELDS = ('email', 'source', 'timestamp', 'visitor_id', 'active', 'mailerlite_status', 'mailerlite_synced_at')
+
+
+def parse_day(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def open_output(path):
+    if not path or path == '-':
+        return sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+def write_subscribers(subscribers, out, fmt='ndjson', fields=CSV_FIELDS):
+    """Write subscribers to ``out`` one at a time; returns how many were written"""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        for subscriber in subscribers:
+            writer.writerow({field: value.isoformat() if isinstance(value, datetime) else value
+                             for field, value in subscriber.items()})
+            count += 1
+    else:
+        for subscriber in subscribers:
+            out.write(json_line(subscriber))
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--status', help='MailerLite sync status: pending, synced or dead')
+    parser.add_argument('--source', help='signup source, e.g. blog or footer')
+    parser.add_argument('--since', type=parse_day, help='signed up on or after YYYY-MM-DD')
+    parser.add_argument('--until', type=parse_day, help='signed up before YYYY-MM-DD')
+    parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+    parser.add_argument('--fields', help=f"CSV columns (default: {','.join(CSV_FIELDS)})")
+    parser.add_argument('--output', help='file to write (default: stdout; .gz to compress)')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    # Make sure MONGODB_URI (or STORAGE_BACKEND=sqlite and SQLITE_PATH) is set in your environment before running this
+    repository = open_repository()
+    out = open_output(args.output)
+    try:
+        subscribers = repository.iter_subscribers(status=args.status, source=args.source, since=args.since,
+                                                  until=args.until, batch_size=args.batch_size)
+        fields = tuple(args.fields.split(',')) if args.fields else CSV_FIELDS
+        count = write_subscribers(subscribers, out, args.format, fields)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        repository.close()
+    print(f"{count} subscribers exported", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
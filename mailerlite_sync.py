@@ -0,0 +1,161 @@
+"""Outbox worker that syncs new subscribers to MailerLite.
+
+``subscribe()`` only writes the subscriber locally with
+``mailerlite_status: 'pending'``. This worker picks up pending subscribers
+in batches and sends them to MailerLite's group import endpoint. Failed
+subscribers are retried with exponential backoff and moved to
+``'dead'`` after ``max_attempts``; ``sync_subscribers.py`` reports on and
+re-queues them.
+
+Statuses: ``pending`` -> ``synced`` | ``dead``.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+MAILERLITE_API_URL = os.environ.get('MAILERLITE_API_URL', 'https://api.mailerlite.com/api/v2')
+STATUSES = ('pending', 'synced', 'dead')
+
+
+class MailerLiteSync:
+    """Drains pending subscribers to MailerLite"""
+
+    def __init__(self, repository, http, api_key, group_id=None, group_name='Welcome',
+                 batch_size=100, max_attempts=5, retry_backoff=60, interval=30.0, claim_timeout=300):
+        self.repository = repository
+        self.http = http
+        self.api_key = api_key
+        self.group_id = group_id
+        self.group_name = group_name
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.interval = interval
+        self.claim_timeout = claim_timeout
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    # --- BACKGROUND WORKER ---
+    def ensure_started(self):
+        """Start the worker thread in this process if it isn't running"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='mailerlite-sync', daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        """Wake the worker early, e.g. right after a signup"""
+        self.ensure_started()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                while self.sync_pending() >= self.batch_size:
+                    pass
+            except Exception as e:
+                logger.warning("MailerLite sync failed: %s", e)
+
+    # --- SYNC ---
+    def sync_pending(self):
+        """Send one batch of due pending subscribers. Returns the batch size."""
+        batch = self._claim_batch()
+        if not batch:
+            return 0
+
+        emails = [sub['email'] for sub in batch]
+        try:
+            failed = self._import(batch)
+        except Exception as e:
+            self._mark_failed(emails, str(e))
+            return len(batch)
+
+        self._mark_synced([email for email in emails if email not in failed])
+        for email, error in failed.items():
+            if email in emails:
+                self._mark_failed([email], error)
+        return len(batch)
+
+    def _import(self, batch):
+        """Bulk-import a batch; returns {email: error} for rejected subscribers"""
+        group_id = self._resolve_group_id()
+        response = self.http.post(
+            'mailerlite',
+            f'{MAILERLITE_API_URL}/groups/{group_id}/subscribers/import',
+            json={
+                'subscribers': [{'email': sub['email']} for sub in batch],
+                'resubscribe': False
+            },
+            headers={'X-MailerLite-ApiKey': self.api_key}
+        )
+        response.raise_for_status()
+        result = response.json()
+        return {
+            error.get('email'): error.get('message', 'rejected')
+            for error in result.get('errors', [])
+            if error.get('email')
+        }
+
+    def _resolve_group_id(self):
+        if self.group_id:
+            return self.group_id
+        response = self.http.get(
+            'mailerlite',
+            f'{MAILERLITE_API_URL}/groups',
+            headers={'X-MailerLite-ApiKey': self.api_key}
+        )
+        response.raise_for_status()
+        for group in response.json():
+            if group.get('name') == self.group_name:
+                self.group_id = group['id']
+                return self.group_id
+        raise LookupError(f"MailerLite group '{self.group_name}' not found")
+
+    # --- OUTBOX STATE ---
+    def _claim_batch(self):
+        return self.repository.claim_outbox(self.batch_size, self.claim_timeout)
+
+    def _mark_synced(self, emails):
+        if emails:
+            self.repository.outbox_synced(emails)
+
+    def _mark_failed(self, emails, error):
+        now = datetime.utcnow()
+
+        def retry_at(attempts):
+            if attempts >= self.max_attempts:
+                return None
+            return now + timedelta(seconds=self.retry_backoff * (2 ** (attempts - 1)))
+
+        self.repository.outbox_failed(emails, error, retry_at)
+        if len(emails) > 1:
+            logger.warning("MailerLite batch of %d failed: %s", len(emails), error)
+
+    # --- REPORTING ---
+    def status_counts(self):
+        """Number of subscribers in each sync status"""
+        return self.repository.outbox_counts()
+
+    def requeue(self, status='dead', email=None):
+        """Put subscribers back in the outbox. Returns how many were re-queued."""
+        return self.repository.outbox_requeue(status, email)
+
+
+def pending_sync_fields():
+    """Outbox fields for a freshly inserted subscriber"""
+    return {
+        'mailerlite_status': 'pending',
+        'mailerlite_attempts': 0,
+        'mailerlite_next_attempt_at': datetime.utcnow()
+    }
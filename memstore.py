@@ -0,0 +1,640 @@
+"""In-memory stand-in for the MongoDB database, used when MONGODB_URI is unset.
+
+Collections implement the part of the pymongo ``Collection`` API the app
+uses: inserts, ``find`` with the usual query operators, projections, sort
+and limit, ``$set``/``$unset``/``$inc``/``$setOnInsert``/``$push`` updates
+with upsert, unique indexes, ``bulk_write`` and simple ``$match``/``$group``
+aggregations. Handlers therefore run the same code with or without MongoDB.
+
+Event streams (``ai_usage``, ``affiliate_clicks``) are ring buffers of
+compact ``__slots__`` records capped at ``max_events``: the oldest events
+are dropped first. Low-cardinality strings (product ids, providers, user
+agents, referrers) are interned, so each distinct value is stored once.
+
+With ``snapshot_path`` set, the data is written to that file every
+``snapshot_interval`` seconds (when something changed) and on ``close()``,
+and loaded again on start. Each worker process has its own store, so a
+snapshot file must belong to a single worker: with several, each would
+overwrite the others' data (app.py refuses that configuration).
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict, deque
+
+from bson import ObjectId, json_util
+from pymongo.errors import DuplicateKeyError
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+logger = logging.getLogger(__name__)
+
+# Event streams and the fields their records have slots for
+EVENT_STREAMS = {
+    'ai_usage': (
+        'timestamp', 'visitor_id', 'user_id', 'provider', 'prompt_tokens', 'completion_tokens',
+        'estimated_cost', 'cache_hit', 'saved_cost', 'coalesced', 'hedged', 'weight', 'aggregated',
+    ),
+    'affiliate_clicks': (
+        'timestamp', 'product_id', 'visitor_id', 'referrer', 'user_agent', 'referrer_host', 'device', 'browser',
+        'weight', 'aggregated',
+    ),
+}
+# String fields with few distinct values, stored once per value
+INTERNED_FIELDS = frozenset(['provider', 'product_id', 'referrer', 'user_agent', 'source', 'referrer_host',
+                             'device', 'browser'])
+
+_MISSING = object()
+
+
+def is_memory(db):
+    return isinstance(db, MemoryDatabase)
+
+
+# --- QUERY EVALUATION ---
+def _equals(value, expected):
+    if value is _MISSING:
+        return expected is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def _compare(value, operator, argument):
+    if operator == '$eq':
+        return _equals(value, argument)
+    if operator == '$ne':
+        return not _equals(value, argument)
+    if operator == '$in':
+        return any(_equals(value, item) for item in argument)
+    if operator == '$nin':
+        return not any(_equals(value, item) for item in argument)
+    if operator == '$exists':
+        return (value is not _MISSING) == bool(argument)
+    if value is _MISSING or value is None:
+        return False
+    try:
+        if operator == '$gt':
+            return value > argument
+        if operator == '$gte':
+            return value >= argument
+        if operator == '$lt':
+            return value < argument
+        if operator == '$lte':
+            return value <= argument
+    except TypeError:
+        return False  # Mongo never matches across types either
+    raise NotImplementedError(f"{operator} is not supported by the in-memory store")
+
+
+def _is_operator_dict(value):
+    return isinstance(value, dict) and bool(value) and all(key.startswith('$') for key in value)
+
+
+def matches(document, query):
+    """Whether ``document`` satisfies a MongoDB query filter"""
+    for key, condition in (query or {}).items():
+        if key == '$and':
+            if not all(matches(document, part) for part in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(document, part) for part in condition):
+                return False
+        elif _is_operator_dict(condition):
+            value = document.get(key, _MISSING)
+            if not all(_compare(value, operator, argument) for operator, argument in condition.items()):
+                return False
+        elif not _equals(document.get(key, _MISSING), condition):
+            return False
+    return True
+
+
+def project(document, projection):
+    """Copy of ``document`` with a MongoDB projection applied"""
+    if not projection:
+        return dict(document)
+    if any(projection.values()):
+        result = {field: document[field] for field, wanted in projection.items()
+                  if wanted and field != '_id' and field in document}
+        if projection.get('_id', 1) and '_id' in document:
+            result['_id'] = document['_id']
+        return result
+    return {field: value for field, value in document.items() if field not in projection}
+
+
+def apply_update(document, update, inserting=False):
+    """Apply update operators to ``document`` in place"""
+    for operator, fields in update.items():
+        if operator == '$set':
+            document.update(fields)
+        elif operator == '$setOnInsert':
+            if inserting:
+                document.update(fields)
+        elif operator == '$unset':
+            for field in fields:
+                document.pop(field, None)
+        elif operator == '$inc':
+            for field, amount in fields.items():
+                document[field] = document.get(field, 0) + amount
+        elif operator == '$push':
+            for field, value in fields.items():
+                items = list(document.get(field, []))
+                if isinstance(value, dict) and '$each' in value:
+                    items.extend(value['$each'])
+                    if '$slice' in value:
+                        limit = value['$slice']
+                        items = items[limit:] if limit < 0 else items[:limit]
+                else:
+                    items.append(value)
+                document[field] = items
+        else:
+            raise NotImplementedError(f"{operator} is not supported by the in-memory store")
+
+
+def _upsert_seed(query):
+    """Fields an upsert copies from the filter (plain equality conditions)"""
+    return {key: value for key, value in (query or {}).items()
+            if not key.startswith('$') and not _is_operator_dict(value)}
+
+
+def _sort_key(value):
+    # Missing and null sort before everything else, as in MongoDB
+    return (0,) if value is None or value is _MISSING else (1, value)
+
+
+def evaluate(expression, document):
+    """Aggregation expression: ``'$field'``, ``{'$ifNull': [...]}`` or a literal"""
+    if isinstance(expression, str) and expression.startswith('$'):
+        return document.get(expression[1:])
+    if isinstance(expression, dict) and len(expression) == 1:
+        operator, arguments = next(iter(expression.items()))
+        if operator == '$ifNull':
+            for argument in arguments:
+                value = evaluate(argument, document)
+                if value is not None:
+                    return value
+            return None
+        if operator.startswith('$'):
+            raise NotImplementedError(f"{operator} is not supported by the in-memory store")
+    if isinstance(expression, dict):
+        return {key: evaluate(value, document) for key, value in expression.items()}
+    return expression
+
+
+def _group(documents, spec):
+    groups = OrderedDict()
+    for document in documents:
+        key = evaluate(spec['_id'], document)
+        group_key = json_util.dumps(key)
+        row = groups.get(group_key)
+        if row is None:
+            row = groups[group_key] = {'_id': key}
+        for field, accumulator in spec.items():
+            if field == '_id':
+                continue
+            (operator, expression), = accumulator.items()
+            value = evaluate(expression, document)
+            current = row.get(field)
+            if operator == '$sum':
+                row[field] = (current or 0) + (value if isinstance(value, (int, float)) else 0)
+            elif operator in ('$max', '$min'):
+                if value is not None and (current is None or (value > current if operator == '$max' else value < current)):
+                    row[field] = value
+                else:
+                    row.setdefault(field, current)
+            elif operator == '$first':
+                row.setdefault(field, value)
+            else:
+                raise NotImplementedError(f"{operator} is not supported by the in-memory store")
+    return list(groups.values())
+
+
+class Cursor:
+    """Result of ``find()``: supports ``sort``, ``skip``, ``limit`` and iteration"""
+
+    def __init__(self, documents, projection=None):
+        self._documents = documents
+        self._projection = projection
+        self._skip = 0
+        self._limit = 0
+        self._iterator = None
+
+    def sort(self, key_or_list, direction=None):
+        keys = [(key_or_list, direction or 1)] if isinstance(key_or_list, str) else key_or_list
+        for field, order in reversed(keys):
+            self._documents.sort(key=lambda doc: _sort_key(doc.get(field)), reverse=order < 0)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._iterator is None:
+            documents = self._documents[self._skip:]
+            if self._limit:
+                documents = documents[:self._limit]
+            self._iterator = (project(doc, self._projection) for doc in documents)
+        return next(self._iterator)
+
+
+class Collection:
+    """Documents keyed by ``_id`` in insertion order"""
+
+    def __init__(self, name, on_change=None):
+        self.name = name
+        self._on_change = on_change
+        self._docs = OrderedDict()
+        self._unique = {}  # field -> {value: _id}
+        self._lock = threading.RLock()
+
+    # --- STORAGE (overridden by EventCollection) ---
+    def _documents(self):
+        return list(self._docs.values())
+
+    def _store(self, document):
+        self._docs[document['_id']] = document
+
+    def _remove(self, documents):
+        for document in documents:
+            self._docs.pop(document['_id'], None)
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change()
+
+    def _candidates(self, query):
+        """Documents that may match ``query``: a direct lookup for an exact ``_id`` or unique-field value"""
+        if query:
+            for field in ('_id',) + tuple(self._unique):
+                value = query.get(field, _MISSING)
+                if value is _MISSING or isinstance(value, (dict, list)):
+                    continue
+                document_id = value if field == '_id' else self._unique[field].get(value)
+                document = self._docs.get(document_id)
+                return [document] if document is not None else []
+        return self._documents()
+
+    # --- UNIQUE INDEXES ---
+    def _check_unique(self, document, replacing=None):
+        for field, index in self._unique.items():
+            value = document.get(field, _MISSING)
+            if value is _MISSING:
+                continue
+            owner = index.get(value)
+            if owner is not None and (replacing is None or owner != replacing['_id']):
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.name} index: {field}_1 dup key: {{{field}: {value!r}}}")
+
+    def _index(self, document, previous=None):
+        for field, index in self._unique.items():
+            if previous is not None and field in previous:
+                index.pop(previous[field], None)
+            if field in document:
+                index[document[field]] = document['_id']
+
+    def create_index(self, keys, unique=False, **options):
+        fields = [keys] if isinstance(keys, str) else [field for field, _ in keys]
+        name = options.get('name') or '_'.join(f'{field}_1' for field in fields)
+        if unique and len(fields) == 1:
+            field = fields[0]
+            with self._lock:
+                index = {}
+                for document in self._documents():
+                    if field in document:
+                        if document[field] in index:
+                            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: {name}")
+                        index[document[field]] = document['_id']
+                self._unique[field] = index
+        return name
+
+    # --- WRITES ---
+    def insert_one(self, document):
+        document.setdefault('_id', ObjectId())
+        with self._lock:
+            self._check_unique(document)
+            stored = dict(document)
+            self._store(stored)
+            self._index(stored)
+        self._changed()
+        return InsertOneResult(document['_id'], True)
+
+    def insert_many(self, documents, ordered=True):
+        ids = [self.insert_one(document).inserted_id for document in documents]
+        return InsertManyResult(ids, True)
+
+    def _update(self, query, update, upsert, many, replace=False):
+        matched = modified = 0
+        upserted_id = None
+        with self._lock:
+            for document in self._candidates(query):
+                if not matches(document, query):
+                    continue
+                matched += 1
+                if replace:
+                    updated = dict(update, _id=document['_id'])
+                else:
+                    updated = dict(document)
+                    apply_update(updated, update)
+                if updated != document:
+                    self._check_unique(updated, replacing=document)
+                    self._remove([document])
+                    self._store(updated)
+                    self._index(updated, previous=document)
+                    modified += 1
+                if not many:
+                    break
+            if not matched and upsert:
+                document = _upsert_seed(query)
+                if replace:
+                    document.update(update)
+                else:
+                    apply_update(document, update, inserting=True)
+                upserted_id = self.insert_one(document).inserted_id
+        if modified:
+            self._changed()
+        raw = {'n': matched or (1 if upserted_id is not None else 0), 'nModified': modified}
+        if upserted_id is not None:
+            raw['upserted'] = upserted_id
+        return UpdateResult(raw, True)
+
+    def update_one(self, filter, update, upsert=False):
+        return self._update(filter, update, upsert, many=False)
+
+    def update_many(self, filter, update, upsert=False):
+        return self._update(filter, update, upsert, many=True)
+
+    def replace_one(self, filter, replacement, upsert=False):
+        return self._update(filter, replacement, upsert, many=False, replace=True)
+
+    def _delete(self, query, many):
+        with self._lock:
+            doomed = [document for document in self._candidates(query) if matches(document, query)]
+            if not many:
+                doomed = doomed[:1]
+            self._remove(doomed)
+            for field, index in self._unique.items():
+                for document in doomed:
+                    index.pop(document.get(field), None)
+        if doomed:
+            self._changed()
+        return DeleteResult({'n': len(doomed)}, True)
+
+    def delete_one(self, filter):
+        return self._delete(filter, many=False)
+
+    def delete_many(self, filter):
+        return self._delete(filter, many=True)
+
+    def bulk_write(self, requests, ordered=True):
+        """Supports the UpdateOne/UpdateMany/InsertOne/DeleteOne/DeleteMany operations"""
+        counts = {'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []}
+        for index, request in enumerate(requests):
+            kind = type(request).__name__
+            if kind in ('UpdateOne', 'UpdateMany'):
+                result = self._update(request._filter, request._doc, request._upsert, many=kind == 'UpdateMany')
+                counts['nMatched'] += result.matched_count
+                counts['nModified'] += result.modified_count
+                if result.upserted_id is not None:
+                    counts['nUpserted'] += 1
+                    counts['upserted'].append({'index': index, '_id': result.upserted_id})
+            elif kind == 'InsertOne':
+                self.insert_one(request._doc)
+                counts['nInserted'] += 1
+            elif kind in ('DeleteOne', 'DeleteMany'):
+                counts['nRemoved'] += self._delete(request._filter, many=kind == 'DeleteMany').deleted_count
+            else:
+                raise NotImplementedError(f"{kind} is not supported by the in-memory store")
+        return BulkWriteResult(counts, True)
+
+    # --- READS ---
+    def find(self, filter=None, projection=None, **kwargs):
+        with self._lock:
+            documents = [document for document in self._candidates(filter) if matches(document, filter)]
+        return Cursor(documents, projection)
+
+    def find_one(self, filter=None, projection=None):
+        return next(self.find(filter, projection).limit(1), None)
+
+    def count_documents(self, filter, limit=0, **kwargs):
+        with self._lock:
+            count = sum(1 for document in self._candidates(filter) if matches(document, filter))
+        return min(count, limit) if limit else count
+
+    def estimated_document_count(self):
+        with self._lock:
+            return len(self._documents())
+
+    def aggregate(self, pipeline, **kwargs):
+        """Supports ``$match``, ``$group``, ``$sort`` and ``$limit`` stages"""
+        with self._lock:
+            documents = self._documents()
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            if name == '$match':
+                documents = [document for document in documents if matches(document, spec)]
+            elif name == '$group':
+                documents = _group(documents, spec)
+            elif name == '$sort':
+                documents = list(Cursor(documents).sort(list(spec.items())))
+            elif name == '$limit':
+                documents = documents[:spec]
+            else:
+                raise NotImplementedError(f"{name} is not supported by the in-memory store")
+        return iter([dict(document) for document in documents])
+
+
+class EventRecord:
+    """Base for the compact records an EventCollection keeps; fields not in the schema go in ``extra``"""
+
+    __slots__ = ()
+    fields = ()
+
+    def __init__(self, document, strings):
+        extra = None
+        for field, value in document.items():
+            if field in self.fields:
+                setattr(self, field, strings.intern(value) if field in INTERNED_FIELDS else value)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[field] = value
+        self.extra = extra
+
+    def to_dict(self):
+        document = {}
+        for field in self.fields:
+            value = getattr(self, field, _MISSING)
+            if value is not _MISSING:
+                document[field] = value
+        if self.extra:
+            document.update(self.extra)
+        return document
+
+
+def record_type(name, fields):
+    """A ``__slots__`` record class for one event stream"""
+    fields = ('_id',) + tuple(fields)
+    return type(f'{name}_record', (EventRecord,), {'__slots__': fields + ('extra',), 'fields': frozenset(fields)})
+
+
+class EventCollection(Collection):
+    """Event stream kept as a ring buffer of compact records; the oldest events are dropped first"""
+
+    def __init__(self, name, fields, strings, max_events=10000, on_change=None):
+        super().__init__(name, on_change=on_change)
+        self._record = record_type(name, fields)
+        self._strings = strings
+        self._events = deque(maxlen=max_events)
+        self.dropped = 0
+
+    def _documents(self):
+        return [record.to_dict() for record in self._events]
+
+    def _store(self, document):
+        if len(self._events) == self._events.maxlen:
+            self.dropped += 1
+        self._events.append(self._record(document, self._strings))
+
+    def _candidates(self, query):
+        return self._documents()
+
+    def _remove(self, documents):
+        doomed = {document['_id'] for document in documents}
+        self._events = deque((record for record in self._events if record._id not in doomed),
+                             maxlen=self._events.maxlen)
+
+
+class StringTable:
+    """Bounded intern table: equal strings share one object"""
+
+    def __init__(self, max_strings=10000):
+        self.max_strings = max_strings
+        self._strings = {}
+
+    def intern(self, value):
+        if not isinstance(value, str):
+            return value
+        existing = self._strings.get(value)
+        if existing is not None:
+            return existing
+        if len(self._strings) < self.max_strings:
+            self._strings[value] = value
+        return value
+
+
+class MemoryDatabase:
+    """Dict of collections with database-style access (``db.subscribers`` or ``db['subscribers']``)"""
+
+    def __init__(self, max_events=10000, snapshot_path=None, snapshot_interval=300):
+        self.max_events = max_events
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.strings = StringTable()
+        self._collections = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        for name, fields in EVENT_STREAMS.items():
+            self._collections[name] = EventCollection(name, fields, self.strings, max_events=max_events,
+                                                      on_change=self._changed)
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load(snapshot_path)
+
+    def __getitem__(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.setdefault(name, Collection(name, on_change=self._changed))
+        return collection
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def list_collection_names(self):
+        return list(self._collections)
+
+    def stats(self):
+        return {
+            name: {'documents': collection.estimated_document_count(),
+                   'dropped': getattr(collection, 'dropped', 0)}
+            for name, collection in self._collections.items()
+        }
+
+    # --- SNAPSHOTS ---
+    def snapshot(self, path=None):
+        """Write every collection to ``path`` (atomically, via a temporary file)"""
+        path = path or self.snapshot_path
+        self._dirty = False
+        parts = []
+        for name, collection in list(self._collections.items()):
+            # Serialized under the collection's lock: writers mutate the documents in place
+            with collection._lock:
+                documents = json_util.dumps(collection._documents(), json_options=json_util.RELAXED_JSON_OPTIONS)
+            parts.append(f'{json_util.dumps(name)}: {documents}')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('{' + ', '.join(parts) + '}')
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                data = json_util.loads(f.read())
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load memory store snapshot %s: %s", path, e)
+            return
+        for name, documents in data.items():
+            collection = self[name]
+            with collection._lock:
+                for document in documents:
+                    collection._store(document)
+        self._dirty = False
+
+    def close(self):
+        """Stop the snapshot thread and write a final snapshot"""
+        self._stopping.set()
+        if self.snapshot_path and self._dirty:
+            try:
+                self.snapshot()
+            except Exception as e:
+                logger.warning("Memory store snapshot failed: %s", e, exc_info=True)
+
+    def _changed(self):
+        self._dirty = True
+        if self.snapshot_path and self.snapshot_interval > 0:
+            self._ensure_started()
+
+    def _ensure_started(self):
+        # Started lazily, like the event pipeline, so each gunicorn worker gets its own thread
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='memstore-snapshot', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.snapshot_interval):
+            if self._dirty:
+                try:
+                    self.snapshot()
+                except Exception as e:
+                    # Keep the thread alive; the next interval tries again
+                    self._dirty = True
+                    logger.warning("Memory store snapshot failed: %s", e, exc_info=True)
@@ -0,0 +1,59 @@
+"""Keyset pagination helpers for list endpoints.
+
+Pages are ordered newest first by ``(created_at, _id)``. The cursor handed
+to clients is an opaque URL-safe token holding the sort key of the last
+item on the page, so fetching page N costs the same as fetching page 1.
+"""
+import base64
+import json
+from datetime import datetime
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, item_id):
+    if isinstance(created_at, datetime):
+        created_at = {'$date': created_at.isoformat()}
+    raw = json.dumps([created_at, str(item_id)], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(created_at, item_id)`` from a cursor token"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, item_id = json.loads(raw)
+        if isinstance(created_at, dict):
+            created_at = datetime.fromisoformat(created_at['$date'])
+        return created_at, item_id
+    except Exception:
+        raise InvalidCursor('Invalid cursor')
+
+
+def parse_limit(value):
+    try:
+        limit = int(value) if value else DEFAULT_LIMIT
+    except ValueError:
+        limit = DEFAULT_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def keyset_filter(cursor):
+    """MongoDB filter for items after ``cursor`` in (created_at, _id) descending order"""
+    created_at, item_id = decode_cursor(cursor)
+    try:
+        from bson import ObjectId
+        if ObjectId.is_valid(item_id):
+            item_id = ObjectId(item_id)
+    except ImportError:
+        pass
+    return {'$or': [
+        {'created_at': {'$lt': created_at}},
+        {'created_at': created_at, '_id': {'$lt': item_id}},
+    ]}
+
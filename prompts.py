@@ -0,0 +1,194 @@
+"""Prompt construction for the Guerilla AI providers.
+
+The personality prefix is prepared once per provider format (plain text for
+Gemini, a system message for OpenAI, the ``system`` field for Ollama) and
+counted once. Each request only adds the history that fits in the token
+budget, newest first, plus the current message; the prompt token count is
+the sum of precomputed counts rather than a re-estimate of the whole text.
+
+Tokens are counted with ``tiktoken`` when it is installed. Otherwise a
+word/punctuation estimate is used, scaled towards the counts the providers
+report back (``TokenEstimator.observe``).
+
+For Ollama, the ``context`` returned by /api/generate is kept per visitor
+(``ContextCache``) and sent back on the next turn, so the server does not
+re-evaluate the prefix and history it already has.
+"""
+import hashlib
+import json
+import logging
+import re
+import textwrap
+import threading
+from collections import OrderedDict
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def rough_tokens(text):
+    """BPE-like estimate: one token per word or symbol, long words split every 7 chars"""
+    return sum(1 + len(piece) // 7 for piece in _PIECES.findall(text or ''))
+
+
+class TokenEstimator:
+    """Token counter: tiktoken when available, otherwise a calibrated estimate"""
+
+    def __init__(self, encoding_name='cl100k_base'):
+        self.scale = 1.0
+        self._lock = threading.Lock()
+        self._encoding = None
+        if tiktoken is not None and encoding_name:
+            try:
+                self._encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                logger.warning("Loading the %s tokenizer failed, estimating instead: %s", encoding_name, e,
+                               exc_info=True)
+
+    @property
+    def exact(self):
+        return self._encoding is not None
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        return max(1, round(rough_tokens(text) * self.scale))
+
+    def observe(self, estimated, actual):
+        """Move the scale towards a provider-reported count for a prompt we estimated"""
+        if self._encoding is not None or not estimated or not actual:
+            return
+        with self._lock:
+            ratio = actual / (estimated / self.scale)
+            self.scale = min(2.0, max(0.5, 0.9 * self.scale + 0.1 * ratio))
+
+
+default_estimator = TokenEstimator()
+
+
+def estimate_tokens(text):
+    return default_estimator.count(text)
+
+
+class Prompt:
+    """A built prompt: the provider payload plus the history it used and its token count"""
+
+    __slots__ = ('text', 'messages', 'system', 'history', 'prompt_tokens')
+
+    def __init__(self, history, prompt_tokens, text=None, messages=None, system=None):
+        self.history = history
+        self.prompt_tokens = prompt_tokens
+        self.text = text
+        self.messages = messages
+        self.system = system
+
+
+class PromptBuilder:
+    """Builds provider prompts from a fixed personality prefix and a token budget for history"""
+
+    def __init__(self, personality, token_budget=600, estimator=None):
+        self.estimator = estimator or default_estimator
+        self.token_budget = token_budget
+        self.personality = textwrap.dedent(personality).strip()
+        # Prepared once: the same prefix is sent on every call
+        self.text_prefix = self.personality + "\n\n"
+        self.system_message = {"role": "system", "content": self.personality}
+        self.prefix_tokens = self.estimator.count(self.personality)
+
+    def tokens(self, msg):
+        return msg.get('tokens') or self.estimator.count(msg.get('content'))
+
+    def window(self, history):
+        """Newest history messages whose tokens fit in the budget, and their total"""
+        selected = []
+        used = 0
+        for msg in reversed(history or []):
+            tokens = self.tokens(msg)
+            if used + tokens > self.token_budget:
+                break
+            selected.append(msg)
+            used += tokens
+        selected.reverse()
+        return selected, used
+
+    def text(self, message, history):
+        """Single-string prompt (Gemini)"""
+        history, history_tokens = self.window(history)
+        lines = [self.text_prefix]
+        for msg in history:
+            speaker = 'User' if msg['role'] == 'user' else 'Guerilla'
+            lines.append(f"{speaker}: {msg['content']}\n")
+        lines.append(f"User: {message}\nGuerilla:")
+        prompt_tokens = self.prefix_tokens + history_tokens + self.estimator.count(message) + 2 * (len(history) + 1)
+        return Prompt(history, prompt_tokens, text=''.join(lines))
+
+    def chat(self, message, history):
+        """Chat-completions message list (OpenAI)"""
+        history, history_tokens = self.window(history)
+        messages = [self.system_message]
+        messages += [{"role": "user" if msg['role'] == 'user' else "assistant", "content": msg['content']}
+                     for msg in history]
+        messages.append({"role": "user", "content": message})
+        # Chat formats add a few tokens of framing per message
+        prompt_tokens = self.prefix_tokens + history_tokens + self.estimator.count(message) + 4 * len(messages)
+        return Prompt(history, prompt_tokens, messages=messages)
+
+    def ollama(self, message, history, context=None):
+        """Ollama /api/generate prompt; with a ``context`` only the new message is sent"""
+        if context:
+            return Prompt(list(history or []), self.estimator.count(message), text=message)
+        history, history_tokens = self.window(history)
+        lines = [f"{'User' if msg['role'] == 'user' else 'Guerilla'}: {msg['content']}\n" for msg in history]
+        lines.append(f"User: {message}\nGuerilla:")
+        prompt_tokens = self.prefix_tokens + history_tokens + self.estimator.count(message) + 2 * (len(history) + 1)
+        return Prompt(history, prompt_tokens, text=''.join(lines), system=self.personality)
+
+
+def exchange_key(message, response):
+    """Fingerprint of a user message and the answer to it, as they are stored in the history"""
+    payload = json.dumps([(message or '').strip(), (response or '').strip()], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ContextCache:
+    """Ollama ``context`` arrays per visitor, valid while the history still ends with the exchange that made them
+
+    Keyed on that last exchange rather than the history length, which stops
+    changing once the conversation store trims to its cap.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, visitor_id, history):
+        if not visitor_id or len(history or []) < 2:
+            return None
+        question, answer = history[-2:]
+        if question.get('role') != 'user' or answer.get('role') != 'assistant':
+            return None
+        key = exchange_key(question.get('content'), answer.get('content'))
+        with self._lock:
+            entry = self._entries.get(visitor_id)
+            if entry is None or entry[0] != key:
+                return None
+            self._entries.move_to_end(visitor_id)
+            return entry[1]
+
+    def set(self, visitor_id, message, response, context):
+        if not visitor_id or not context:
+            return
+        with self._lock:
+            self._entries[visitor_id] = (exchange_key(message, response), context)
+            self._entries.move_to_end(visitor_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
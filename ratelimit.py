@@ -0,0 +1,224 @@
+"""Rate limits and spend caps in front of the paid AI providers.
+
+Token buckets limit how often one visitor, one IP and the whole site can
+start a provider call. A rolling 24-hour spend total, fed from the
+``estimated_cost`` that ``track_ai_usage`` computes, caps what one visitor
+and the whole site can spend per day. When a check fails the caller answers
+from the canned fallback responses without calling the provider.
+
+Both have an in-process backend (per worker) and a MongoDB backend (shared
+by all gunicorn workers): buckets are updated atomically with a pipeline
+``find_one_and_update``, and spend is kept in hourly ``$inc`` buckets.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+from memstore import is_memory
+
+logger = logging.getLogger(__name__)
+
+SPEND_WINDOW_HOURS = 24
+
+
+def parse_rate(value):
+    """``'10/600'`` -> ``(10, 600)``: bursts of 10 calls, refilled over 600 seconds"""
+    capacity, _, period = str(value).partition('/')
+    return float(capacity), float(period or 60)
+
+
+class MemoryBucketStore:
+    """Token buckets in this worker, least recently used dropped past ``max_keys``"""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, period):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * capacity / period)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed
+
+
+class MongoBucketStore:
+    """Token buckets in MongoDB, one document per key, refilled and taken in one atomic update"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    def take(self, key, capacity, period):
+        now = datetime.utcnow()
+        elapsed_seconds = {'$divide': [{'$subtract': [now, {'$ifNull': ['$updated_at', now]}]}, 1000]}
+        refilled = {'$add': [{'$ifNull': ['$tokens', capacity]}, {'$multiply': [elapsed_seconds, capacity / period]}]}
+        doc = self.collection.find_one_and_update(
+            {'_id': key},
+            [
+                {'$set': {'tokens': {'$min': [capacity, refilled]}}},
+                {'$set': {'allowed': {'$gte': ['$tokens', 1]}}},
+                {'$set': {
+                    'tokens': {'$cond': ['$allowed', {'$subtract': ['$tokens', 1]}, '$tokens']},
+                    'updated_at': now,
+                    # A full bucket is the same as no document
+                    'expires_at': now + timedelta(seconds=period),
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return doc['allowed']
+
+
+class MemorySpendStore:
+    """Hourly spend totals in this worker"""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._spend = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key, hour, cost):
+        with self._lock:
+            hours = self._spend.setdefault(key, {})
+            hours[hour] = hours.get(hour, 0.0) + cost
+            for old in [h for h in hours if h <= hour - SPEND_WINDOW_HOURS]:
+                del hours[old]
+            self._spend.move_to_end(key)
+            while len(self._spend) > self.max_keys:
+                self._spend.popitem(last=False)
+
+    def total(self, key, since_hour):
+        with self._lock:
+            hours = self._spend.get(key, {})
+            return sum(cost for hour, cost in hours.items() if hour >= since_hour)
+
+
+class MongoSpendStore:
+    """Hourly spend totals in MongoDB, one ``$inc`` document per key and hour"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def ensure_indexes(self):
+        self.collection.create_index([('key', 1), ('hour', 1)])
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    def add(self, key, hour, cost):
+        self.collection.update_one(
+            {'_id': f'{key}:{hour}'},
+            {
+                '$inc': {'cost': cost},
+                '$setOnInsert': {
+                    'key': key,
+                    'hour': hour,
+                    'expires_at': datetime.utcnow() + timedelta(hours=SPEND_WINDOW_HOURS + 1),
+                },
+            },
+            upsert=True
+        )
+
+    def total(self, key, since_hour):
+        result = list(self.collection.aggregate([
+            {'$match': {'key': key, 'hour': {'$gte': since_hour}}},
+            {'$group': {'_id': None, 'cost': {'$sum': '$cost'}}},
+        ]))
+        return result[0]['cost'] if result else 0.0
+
+
+class AIGate:
+    """Decides whether a request may call a paid provider
+
+    ``rates`` maps a scope ('visitor', 'ip', 'global') to ``(capacity, period)``;
+    budgets are daily dollar caps, 0 or None to disable.
+    """
+
+    def __init__(self, buckets, spend, rates, visitor_budget=None, global_budget=None):
+        self.buckets = buckets
+        self.spend = spend
+        self.rates = rates
+        self.visitor_budget = visitor_budget
+        self.global_budget = global_budget
+        self.allowed = 0
+        self.denied = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def current_hour():
+        return int(time.time() // 3600)
+
+    def check(self, visitor_id=None, ip=None):
+        """None if the call may go ahead, otherwise the reason it may not"""
+        try:
+            reason = self._check(visitor_id, ip)
+        except Exception as e:
+            # Don't take chat down with the limiter; the providers have their own limits
+            logger.warning("Rate limit check failed, allowing the call: %s", e, exc_info=True)
+            reason = None
+        with self._lock:
+            if reason is None:
+                self.allowed += 1
+            else:
+                self.denied[reason] = self.denied.get(reason, 0) + 1
+        return reason
+
+    def _check(self, visitor_id, ip):
+        since = self.current_hour() - SPEND_WINDOW_HOURS + 1
+        if self.global_budget and self.spend.total('global', since) >= self.global_budget:
+            return 'global_budget'
+        if visitor_id and self.visitor_budget and self.spend.total(f'visitor:{visitor_id}', since) >= self.visitor_budget:
+            return 'visitor_budget'
+
+        for scope, key in (('visitor', visitor_id), ('ip', ip), ('global', 'all')):
+            rate = self.rates.get(scope)
+            if rate and key and not self.buckets.take(f'{scope}:{key}', *rate):
+                return f'{scope}_rate'
+        return None
+
+    def record_spend(self, visitor_id, cost):
+        if not cost:
+            return
+        hour = self.current_hour()
+        try:
+            self.spend.add('global', hour, cost)
+            if visitor_id:
+                self.spend.add(f'visitor:{visitor_id}', hour, cost)
+        except Exception as e:
+            logger.warning("Recording AI spend failed: %s", e, exc_info=True)
+
+    def stats(self):
+        since = self.current_hour() - SPEND_WINDOW_HOURS + 1
+        try:
+            spent = round(self.spend.total('global', since), 6)
+        except Exception:
+            spent = None
+        with self._lock:
+            return {
+                'backend': type(self.buckets).__name__,
+                'allowed': self.allowed,
+                'denied': dict(self.denied),
+                'spend_24h': spent,
+                'daily_budget': self.global_budget,
+            }
+
+
+def create_ai_gate(backend_name, db, rates, visitor_budget=None, global_budget=None):
+    """Build the gate selected by ``RATE_LIMIT_BACKEND``"""
+    if backend_name == 'mongo' and not is_memory(db):
+        return AIGate(MongoBucketStore(db.rate_limits), MongoSpendStore(db.ai_spend), rates,
+                      visitor_budget=visitor_budget, global_budget=global_budget)
+    return AIGate(MemoryBucketStore(), MemorySpendStore(), rates,
+                  visitor_budget=visitor_budget, global_budget=global_budget)
@@ -0,0 +1,232 @@
+"""Fast path for /affiliate/<product> and /social/<platform> redirects.
+
+``LinkTables`` holds the redirect targets as plain dicts, loaded once and
+swapped in whole when the source changes: every ``check_interval`` seconds
+one request compares a cheap version token (file mtimes) and, if it moved,
+reloads the tables while the others keep redirecting with the old ones.
+
+``ClickRecorder`` keeps click logging cheap on the request path. It queues
+the raw fields only (product, visitor cookie, referrer and user agent); the
+event pipeline's batch writer runs ``enrich_click()`` on them, which parses
+the user agent and normalizes the referrer. ``sample_rate`` < 1 keeps a
+weighted sample of clicks, and above ``spike_threshold`` clicks per second
+the extra clicks are only counted per product and written as one weighted
+event every ``aggregate_interval`` seconds.
+"""
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCIAL_LINKS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'social_links.json')
+
+
+def load_social_links(path=DEFAULT_SOCIAL_LINKS_PATH):
+    """platform -> URL"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def file_version(*paths):
+    """Version token for files: their modification times (None for a missing file)"""
+    version = []
+    for path in paths:
+        try:
+            version.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            version.append(None)
+    return tuple(version)
+
+
+class LinkTables:
+    """Named redirect tables (e.g. 'affiliate', 'social'), hot-reloaded when their version changes
+
+    ``load()`` returns ``{name: {key: url}}``. ``version()`` returns a cheap
+    token that changes with the source; without one the tables are reloaded
+    every ``check_interval`` seconds. A ``check_interval`` of 0 turns
+    automatic reloads off (``reload()`` still works).
+    """
+
+    def __init__(self, load, version=None, check_interval=30.0):
+        self.load = load
+        self.version = version
+        self.check_interval = check_interval
+        self._reload_lock = threading.Lock()
+        self.reloads = 0
+        self.errors = 0
+        self._version = self.version() if self.version else None
+        self._tables = self.load()
+        self._checked_at = time.monotonic()
+
+    def get(self, name, key):
+        """Target URL for ``key`` in table ``name``, or None"""
+        if self.check_interval and time.monotonic() - self._checked_at >= self.check_interval:
+            self._maybe_reload()
+        return self._tables[name].get(key)
+
+    def table(self, name):
+        return dict(self._tables[name])
+
+    def reload(self):
+        """Load the tables now; on failure the current ones stay in use"""
+        version = self.version() if self.version else None
+        try:
+            tables = self.load()
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Reloading link tables failed: %s", e)
+            return False
+        self._tables = tables
+        self._version = version
+        self.reloads += 1
+        return True
+
+    def _maybe_reload(self):
+        # One request checks; the rest keep serving the current tables meanwhile
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            if self.version is None or self.version() != self._version:
+                self.reload()
+        finally:
+            self._reload_lock.release()
+
+    def stats(self):
+        return dict({name: len(table) for name, table in self._tables.items()},
+                    reloads=self.reloads, errors=self.errors)
+
+
+# --- CLICK ENRICHMENT (batch writer side) ---
+_BOT = re.compile(r'bot|crawl|spider|slurp|facebookexternalhit|preview|curl|wget|python-requests|headless', re.I)
+_TABLET = re.compile(r'ipad|tablet|kindle|silk/', re.I)
+_MOBILE = re.compile(r'mobi|iphone|ipod|android', re.I)
+# First match wins: Edge and Opera also say Chrome, Chrome also says Safari
+_BROWSERS = (('edge', 'Edg'), ('opera', 'OPR/'), ('samsung', 'SamsungBrowser/'), ('chrome', 'Chrome/'),
+             ('chrome', 'CriOS/'), ('firefox', 'Firefox/'), ('firefox', 'FxiOS/'), ('safari', 'Safari/'))
+
+
+def classify_user_agent(user_agent):
+    """(device, browser) for a User-Agent string; device is bot, tablet, mobile, desktop or unknown"""
+    if not user_agent:
+        return 'unknown', 'unknown'
+    if _BOT.search(user_agent):
+        device = 'bot'
+    elif _TABLET.search(user_agent):
+        device = 'tablet'
+    elif _MOBILE.search(user_agent):
+        device = 'mobile'
+    else:
+        device = 'desktop'
+    browser = next((name for name, marker in _BROWSERS if marker in user_agent), 'other')
+    return device, browser
+
+
+def normalize_referrer(referrer):
+    """(referrer without query or fragment, host without www.), or (None, None)"""
+    if not referrer:
+        return None, None
+    try:
+        parts = urlsplit(referrer.strip())
+        host = (parts.hostname or '').lower()
+    except ValueError:
+        return None, None
+    if not host:
+        return None, None
+    if host.startswith('www.'):
+        host = host[4:]
+    return f"{parts.scheme.lower() or 'https'}://{host}{parts.path or '/'}", host
+
+
+def enrich_click(document):
+    """Derived fields for a queued click (runs in the event pipeline's flusher thread)"""
+    if 'user_agent' in document:
+        document['device'], document['browser'] = classify_user_agent(document.get('user_agent'))
+    if document.get('referrer'):
+        document['referrer'], document['referrer_host'] = normalize_referrer(document['referrer'])
+    return document
+
+
+# --- CLICK LOGGING (request side) ---
+class ClickRecorder:
+    """Queues clicks as raw events, sampled or aggregated per product when configured or under a spike"""
+
+    def __init__(self, emit, stream='affiliate_clicks', sample_rate=1.0, spike_threshold=0, aggregate_interval=5.0):
+        self.emit = emit
+        self.stream = stream
+        self.sample_rate = sample_rate
+        self.spike_threshold = spike_threshold
+        self.aggregate_interval = aggregate_interval
+        self._lock = threading.Lock()
+        self._window_start = 0.0
+        self._window_count = 0
+        self._pending = {}
+        self._pending_since = None
+        self._counters = {'logged': 0, 'sampled_out': 0, 'aggregated': 0}
+
+    def record(self, product_id, visitor_id=None, referrer=None, user_agent=None):
+        now = time.monotonic()
+        if self.spike_threshold:
+            with self._lock:
+                if now - self._window_start >= 1.0:
+                    self._window_start = now
+                    self._window_count = 0
+                self._window_count += 1
+                spiking = self._window_count > self.spike_threshold
+                if spiking:
+                    self._pending[product_id] = self._pending.get(product_id, 0) + 1
+                    self._counters['aggregated'] += 1
+                    if self._pending_since is None:
+                        self._pending_since = (now, datetime.utcnow())
+            if spiking:
+                self._flush_due(now)
+                return
+
+        document = {
+            'product_id': product_id,
+            'timestamp': datetime.utcnow(),
+            'visitor_id': visitor_id,
+            'referrer': referrer,
+            'user_agent': user_agent,
+        }
+        if self.sample_rate < 1:
+            if random.random() >= self.sample_rate:
+                self._count('sampled_out')
+                self._flush_due(now)
+                return
+            document['weight'] = 1 / self.sample_rate
+        self.emit(self.stream, document)
+        self._count('logged')
+        self._flush_due(now)
+
+    def flush(self):
+        """Queue the per-product counts held back during a spike as weighted events"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            since, self._pending_since = self._pending_since, None
+        for product_id, count in pending.items():
+            self.emit(self.stream, {'product_id': product_id, 'timestamp': since[1], 'weight': count,
+                                    'aggregated': True})
+
+    def _flush_due(self, now):
+        since = self._pending_since
+        if since is not None and now - since[0] >= self.aggregate_interval:
+            self.flush()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            counters['pending'] = sum(self._pending.values())
+        counters['sample_rate'] = self.sample_rate
+        return counters
@@ -0,0 +1,163 @@
+"""Single-flight coalescing for identical concurrent AI prompts.
+
+The first request for a key becomes the leader and calls the provider;
+requests for the same key that arrive while it is in flight wait for its
+answer instead of starting their own call. Within a worker this is an
+in-process table of pending calls. Across workers, an optional short-lived
+lock document in MongoDB elects one leader, and the other workers poll the
+shared response cache (``peek``) until the leader's answer lands there.
+
+Leaders publish ``None`` when they have nothing worth sharing (provider
+error, fallback, partial stream); followers then make their own call.
+"""
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from ai_cache import MongoCacheBackend
+from memstore import is_memory
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'owner')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.owner = uuid.uuid4().hex
+
+    def wait(self, timeout=None):
+        """The leader's published value, or None if it failed or took too long"""
+        self.event.wait(timeout)
+        return self.result
+
+
+class MongoFlightLock:
+    """Leader election across workers: one lock document per key, expiring after ``ttl``"""
+
+    def __init__(self, collection, ttl=30):
+        self.collection = collection
+        self.ttl = ttl
+
+    def ensure_indexes(self):
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    def acquire(self, key, owner):
+        now = datetime.utcnow()
+        # Clear a lock whose holder died (the TTL monitor only runs once a minute)
+        self.collection.delete_one({'_id': key, 'expires_at': {'$lt': now}})
+        try:
+            self.collection.insert_one({'_id': key, 'owner': owner, 'expires_at': now + timedelta(seconds=self.ttl)})
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def held(self, key):
+        return self.collection.count_documents({'_id': key, 'expires_at': {'$gt': datetime.utcnow()}}, limit=1) > 0
+
+    def release(self, key, owner):
+        self.collection.delete_one({'_id': key, 'owner': owner})
+
+
+class SingleFlight:
+    """Table of in-flight calls, optionally backed by a cross-worker lock"""
+
+    def __init__(self, lock=None, peek=None, wait_timeout=30, poll_interval=0.2):
+        self.lock = lock
+        self.peek = peek
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._mutex = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.remote_followers = 0
+
+    def begin(self, key):
+        """Join or start the call for ``key``; returns ``(call, is_leader)``
+
+        The leader must call ``finish(key, value)`` when it is done, even on
+        failure. Followers call ``call.wait(timeout)``.
+        """
+        with self._mutex:
+            call = self._calls.get(key)
+            if call is not None:
+                self.followers += 1
+                return call, False
+            call = self._calls[key] = _Call()
+
+        if self.lock is not None:
+            try:
+                acquired = self.lock.acquire(key, call.owner)
+            except Exception as e:
+                logger.warning("Could not take the in-flight lock, calling anyway: %s", e, exc_info=True)
+                acquired = True  # Can't coordinate: just make the call
+            if not acquired:
+                value = self._wait_remote(key)
+                if value is not None:
+                    with self._mutex:
+                        self.remote_followers += 1
+                    self.finish(key, value)
+                    return call, False
+
+        with self._mutex:
+            self.leaders += 1
+        return call, True
+
+    def finish(self, key, value):
+        """Publish the leader's value (or None) to everyone waiting on ``key``"""
+        with self._mutex:
+            call = self._calls.pop(key, None)
+        if call is None:
+            return
+        if self.lock is not None:
+            try:
+                self.lock.release(key, call.owner)
+            except Exception as e:
+                logger.warning("Could not release the in-flight lock: %s", e, exc_info=True)
+        call.result = value
+        call.event.set()
+
+    def _wait_remote(self, key):
+        """Poll for another worker's answer until it lands, its lock goes away, or we time out"""
+        deadline = time.monotonic() + self.wait_timeout
+        try:
+            while time.monotonic() < deadline:
+                value = self.peek(key)
+                if value is not None:
+                    return value
+                if not self.lock.held(key):
+                    return self.peek(key)
+                time.sleep(self.poll_interval)
+        except Exception as e:
+            logger.warning("Waiting for another worker's answer failed: %s", e, exc_info=True)
+        return None
+
+    def stats(self):
+        with self._mutex:
+            return {
+                'backend': type(self.lock).__name__ if self.lock else 'local',
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'followers': self.followers,
+                'remote_followers': self.remote_followers,
+            }
+
+
+def create_single_flight(backend_name, db, response_cache, wait_timeout=30, lock_ttl=30):
+    """Build the coalescing layer selected by ``AI_COALESCE``
+
+    Cross-worker coalescing needs the answers in a shared place, so the Mongo
+    lock is only used together with the Mongo response cache.
+    """
+    shared_cache = isinstance(response_cache.backend, MongoCacheBackend)
+    if backend_name == 'mongo' and not is_memory(db) and shared_cache:
+        return SingleFlight(MongoFlightLock(db.ai_inflight, ttl=lock_ttl), peek=response_cache.peek,
+                            wait_timeout=wait_timeout)
+    return SingleFlight(wait_timeout=wait_timeout)
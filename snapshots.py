@@ -0,0 +1,154 @@
+"""Pre-serialized responses for JSON that rarely changes.
+
+A ``Snapshot`` holds a response body that has already been serialized, its
+gzip and (when the ``brotli`` package is installed) brotli variants and a
+strong ETag. All of them are computed once, when the snapshot is built, so
+serving it is a couple of dictionary lookups: ``encoding_for()`` picks the
+variant from ``Accept-Encoding``, ``response_headers()`` returns the header
+list built for it and the route hands the stored bytes to the response
+unchanged.
+
+``SnapshotCache`` keeps one snapshot per key together with the version it
+was built from (e.g. the ``ProductCatalog`` object), and rebuilds it when
+the caller passes a different version.
+"""
+import gzip
+import hashlib
+import json
+import threading
+from functools import lru_cache
+
+from werkzeug.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this go out uncompressed: the framing costs more than it saves
+MIN_COMPRESS_SIZE = 256
+# Preference when the client accepts several encodings equally
+ENCODINGS = ('br', 'gzip')
+
+
+def dump_json(data):
+    """Compact JSON bytes, as stored in snapshots"""
+    return json.dumps(data, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def compress(body):
+    """encoding -> compressed bytes, for the encodings that make ``body`` smaller"""
+    if len(body) < MIN_COMPRESS_SIZE:
+        return {}
+    variants = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(body, quality=11)
+    return {encoding: data for encoding, data in variants.items() if len(data) < len(body)}
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding, available):
+    """Best of ``available`` encodings for an Accept-Encoding header (clients send few distinct ones)"""
+    accepted = parse_accept_encoding(accept_encoding)
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if encoding in available and q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def parse_accept_encoding(header):
+    """encoding -> q value from an Accept-Encoding header"""
+    accepted = {}
+    for item in (header or '').split(','):
+        name, _, params = item.strip().partition(';')
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+
+class Snapshot:
+    """Serialized response body with its compressed variants and validators"""
+
+    __slots__ = ('body', 'etag', 'variants', 'last_modified', 'status', 'headers', '_response_headers')
+
+    def __init__(self, body, last_modified=None, status=200, headers=None):
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.variants = compress(body) if status == 200 else {}
+        self.last_modified = last_modified
+        self.status = status
+        self.headers = headers or {}
+        self._response_headers = {}
+
+    @classmethod
+    def from_data(cls, data, **kwargs):
+        return cls(dump_json(data), **kwargs)
+
+    def encoding_for(self, accept_encoding):
+        """Best variant the client accepts: 'br', 'gzip' or None for the identity body"""
+        if not self.variants or not accept_encoding:
+            return None
+        return negotiate(accept_encoding, tuple(self.variants))
+
+    def representation(self, encoding):
+        """(body, etag) for ``encoding``; each variant gets its own strong ETag"""
+        if encoding is None:
+            return self.body, self.etag
+        return self.variants[encoding], f'{self.etag}-{encoding}'
+
+    def response_headers(self, encoding, cache_control):
+        """Header list for a 200 or 304 of ``encoding``, built once per (encoding, Cache-Control)"""
+        key = (encoding, cache_control)
+        headers = self._response_headers.get(key)
+        if headers is None:
+            headers = [('Content-Type', 'application/json'), ('ETag', f'"{self.representation(encoding)[1]}"')]
+            headers.extend(self.headers.items())
+            if encoding:
+                headers.append(('Content-Encoding', encoding))
+            if self.variants:
+                headers.append(('Vary', 'Accept-Encoding'))
+            if self.last_modified:
+                headers.append(('Last-Modified', http_date(self.last_modified)))
+            headers.append(('Cache-Control', cache_control))
+            self._response_headers[key] = headers
+        return headers
+
+
+class SnapshotCache:
+    """One snapshot per key, rebuilt whenever the version it was built from changes"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, key, version, build):
+        """The snapshot for ``key`` at ``version``; ``build()`` returns the data to serialize"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        snapshot = Snapshot.from_data(build())
+        with self._lock:
+            self._entries[key] = (version, snapshot)
+            self.builds += 1
+        return snapshot
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        return {'entries': len(self._entries), 'builds': self.builds}
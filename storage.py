@@ -0,0 +1,749 @@
+"""Repository layer over the app's persistent data.
+
+Handlers, the event pipeline, the rollups and the MailerLite outbox go
+through a repository instead of touching collections, so the storage can be
+picked per environment with ``STORAGE_BACKEND``:
+
+- ``mongo``: MongoDB, shared by every worker and instance
+- ``sqlite``: one local SQLite file in WAL mode, for single-node deployments
+- ``memory``: the ``memstore`` in-process database (development, previews)
+
+All three implement the same methods and are checked by the same
+conformance tests (``tests/test_storage.py``); ``benchmarks/bench_storage.py``
+compares their throughput.
+"""
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from bson import json_util
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+import blog_cache
+import pagination
+from db_indexes import ensure_indexes
+from analytics import COUNTERS as ROLLUP_COUNTERS, ROLLUP_COLLECTION
+from mailerlite_sync import STATUSES as OUTBOX_STATUSES
+from memstore import EVENT_STREAMS, MemoryDatabase, is_memory
+
+
+def rollup_id(dimension, key, day):
+    return f"{dimension}:{key}:{day}" if key else f"{dimension}:{day}"
+
+
+def _time_range(start=None, end=None, field='timestamp'):
+    """Mongo filter for ``start <= field < end``; either bound may be None"""
+    bounds = {}
+    if start is not None:
+        bounds['$gte'] = start
+    if end is not None:
+        bounds['$lt'] = end
+    return {field: bounds} if bounds else {}
+
+
+def _subscriber_query(status=None, source=None, since=None, until=None):
+    query = _time_range(since, until)
+    if status:
+        query['mailerlite_status'] = status
+    if source:
+        query['source'] = source
+    return query
+
+
+def _finish_page(posts, limit, fields):
+    """Trim the extra look-ahead post, build the next cursor and drop unrequested keys"""
+    next_cursor = None
+    if len(posts) > limit:
+        posts = posts[:limit]
+        next_cursor = pagination.encode_cursor(posts[-1]['created_at'], posts[-1]['_id'])
+    for post in posts:
+        if fields and '_id' not in fields:
+            del post['_id']
+        else:
+            post['_id'] = str(post['_id'])
+        if fields and 'created_at' not in fields:
+            del post['created_at']
+    return posts, next_cursor
+
+
+class MongoRepository:
+    """Repository over a pymongo database (or anything with its API, see MemoryRepository)"""
+
+    backend = 'mongo'
+
+    def __init__(self, db):
+        self.db = db
+
+    # --- EVENTS ---
+    def record_events(self, stream, documents):
+        self.db[stream].insert_many(documents, ordered=False)
+
+    def record_click(self, click):
+        self.record_events('affiliate_clicks', [click])
+
+    def iter_events(self, stream, fields=None, batch_size=1000, start=None, end=None):
+        """Events in insertion order; with ``start``/``end``, those in that timestamp range, oldest first"""
+        projection = dict.fromkeys(fields, 1) if fields else None
+        query = _time_range(start, end)
+        cursor = self.db[stream].find(query, projection, batch_size=batch_size)
+        return cursor.sort('timestamp', 1) if query else cursor
+
+    def count(self, stream, start=None, end=None):
+        return self.db[stream].count_documents(_time_range(start, end))
+
+    def delete_events(self, stream, start=None, end=None):
+        """Delete the events with ``start <= timestamp < end``; returns how many were deleted"""
+        return self.db[stream].delete_many(_time_range(start, end)).deleted_count
+
+    def oldest_event_time(self, stream):
+        oldest = next(self.db[stream].find({'timestamp': {'$ne': None}}, {'timestamp': 1})
+                      .sort('timestamp', 1).limit(1), None)
+        return oldest['timestamp'] if oldest else None
+
+    # --- SUBSCRIBERS ---
+    def add_subscriber(self, subscriber):
+        """Insert unless the email is already subscribed; returns whether it was inserted"""
+        try:
+            # One upsert against the unique email index instead of find_one + insert_one
+            result = self.db.subscribers.update_one(
+                {'email': subscriber['email']}, {'$setOnInsert': subscriber}, upsert=True)
+        except DuplicateKeyError:
+            # A concurrent signup for the same email won the race
+            return False
+        return result.upserted_id is not None
+
+    def find_subscriber(self, email):
+        return self.db.subscribers.find_one({'email': email}, {'_id': 0})
+
+    def subscribers_with_status(self, status):
+        return self.db.subscribers.find({'mailerlite_status': status}, {'_id': 0})
+
+    def iter_subscribers(self, status=None, source=None, since=None, until=None, batch_size=1000):
+        """Subscribers matching the filters (``since <= timestamp < until``), streamed in batches"""
+        query = _subscriber_query(status, source, since, until)
+        return self.db.subscribers.find(query, {'_id': 0}, batch_size=batch_size)
+
+    # --- POSTS ---
+    def add_posts(self, posts):
+        self.db.posts.insert_many([dict(post) for post in posts])
+
+    def list_posts(self, limit, cursor=None, fields=None, tag=None, category=None):
+        """One page of published posts, newest first: ``(posts, next_cursor, total)``
+
+        Posts come without their content, or with only ``fields`` when given.
+        """
+        query = {'status': 'published'}
+        if tag:
+            query['tags'] = tag
+        if category:
+            query['category'] = category
+        total = self.db.posts.count_documents(query)
+        if cursor:
+            query = {'$and': [query, pagination.keyset_filter(cursor)]}
+        if fields:
+            projection = dict.fromkeys(fields + ('created_at',), 1)
+        else:
+            projection = {'content': 0}
+        posts = list(self.db.posts.find(query, projection)
+                     .sort([('created_at', -1), ('_id', -1)])
+                     .limit(limit + 1))
+        return _finish_page(posts, limit, fields) + (total,)
+
+    def get_post(self, slug):
+        post = self.db.posts.find_one({'slug': slug, 'status': 'published'})
+        if post:
+            post['_id'] = str(post['_id'])
+        return post
+
+    def posts_watermark(self):
+        return blog_cache.mongo_watermark(self.db)
+
+    # --- ROLLUPS ---
+    def increment_rollups(self, increments):
+        """Add ``{(dimension, key, day): {counter: amount}}`` with one upsert per rollup document"""
+        self.db[ROLLUP_COLLECTION].bulk_write([
+            UpdateOne(
+                {'_id': rollup_id(dimension, key, day)},
+                {'$inc': dict(counters),
+                 '$setOnInsert': {'dimension': dimension, 'key': key or day, 'date': day}},
+                upsert=True
+            )
+            for (dimension, key, day), counters in increments.items()
+        ], ordered=False)
+
+    def find_rollups(self, dimension, start=None, end=None):
+        query = {'dimension': dimension}
+        if start or end:
+            query['date'] = {}
+            if start:
+                query['date']['$gte'] = start
+            if end:
+                query['date']['$lte'] = end
+        return self.db[ROLLUP_COLLECTION].find(query)
+
+    def clear_rollups(self):
+        self.db[ROLLUP_COLLECTION].delete_many({})
+
+    # --- MAILERLITE OUTBOX ---
+    def claim_outbox(self, batch_size, claim_timeout):
+        """Claim up to ``batch_size`` due pending subscribers for one sync run"""
+        now = datetime.utcnow()
+        # Claim with a token so two workers never send the same subscriber
+        due = {
+            'mailerlite_status': 'pending',
+            'mailerlite_next_attempt_at': {'$lte': now},
+            '$or': [
+                {'mailerlite_claimed_until': {'$exists': False}},
+                {'mailerlite_claimed_until': {'$lte': now}}
+            ]
+        }
+        ids = [doc['_id'] for doc in self.db.subscribers.find(due, {'_id': 1}).limit(batch_size)]
+        if not ids:
+            return []
+        token = str(uuid.uuid4())
+        self.db.subscribers.update_many(
+            dict(due, _id={'$in': ids}),
+            {'$set': {
+                'mailerlite_claim': token,
+                'mailerlite_claimed_until': now + timedelta(seconds=claim_timeout)
+            }}
+        )
+        return list(self.db.subscribers.find({'mailerlite_claim': token},
+                                             {'_id': 0, 'email': 1, 'mailerlite_attempts': 1}))
+
+    def outbox_synced(self, emails):
+        self.db.subscribers.update_many(
+            {'email': {'$in': emails}},
+            {'$set': {'mailerlite_status': 'synced', 'mailerlite_synced_at': datetime.utcnow(),
+                      'mailerlite_error': None},
+             '$unset': {'mailerlite_claim': '', 'mailerlite_claimed_until': ''}}
+        )
+
+    def outbox_failed(self, emails, error, retry_at):
+        """Count a failed attempt; ``retry_at(attempts)`` is the next try, or None to dead-letter"""
+        for sub in self.db.subscribers.find({'email': {'$in': emails}}, {'email': 1, 'mailerlite_attempts': 1}):
+            attempts = sub.get('mailerlite_attempts', 0) + 1
+            update = {'mailerlite_attempts': attempts, 'mailerlite_error': error}
+            next_attempt_at = retry_at(attempts)
+            if next_attempt_at is None:
+                update['mailerlite_status'] = 'dead'
+            else:
+                update['mailerlite_next_attempt_at'] = next_attempt_at
+            self.db.subscribers.update_one(
+                {'_id': sub['_id']},
+                {'$set': update, '$unset': {'mailerlite_claim': '', 'mailerlite_claimed_until': ''}}
+            )
+
+    def outbox_counts(self):
+        counts = dict.fromkeys(OUTBOX_STATUSES, 0)
+        for row in self.db.subscribers.aggregate([
+            {'$group': {'_id': '$mailerlite_status', 'count': {'$sum': 1}}}
+        ]):
+            if row['_id'] in counts:
+                counts[row['_id']] = row['count']
+        return counts
+
+    def outbox_requeue(self, status='dead', email=None):
+        query = {'mailerlite_status': status}
+        if email:
+            query['email'] = email
+        reset = {
+            'mailerlite_status': 'pending',
+            'mailerlite_attempts': 0,
+            'mailerlite_next_attempt_at': datetime.utcnow()
+        }
+        return self.db.subscribers.update_many(query, {'$set': reset}).modified_count
+
+    def close(self):
+        pass
+
+
+class MemoryRepository(MongoRepository):
+    """MongoRepository over the ``memstore`` in-process database"""
+
+    backend = 'memory'
+
+    def __init__(self, db=None, **options):
+        if db is None:
+            db = MemoryDatabase(**options)
+            ensure_indexes(db)
+        super().__init__(db)
+
+    def close(self):
+        # Writes the snapshot when one is configured
+        self.db.close()
+
+
+# --- SQLITE ---
+
+POST_COLUMNS = ('slug', 'status', 'title', 'excerpt', 'content', 'author', 'category', 'image', 'tags',
+                'created_at', 'updated_at')
+SUBSCRIBER_COLUMNS = ('email', 'source', 'timestamp', 'visitor_id', 'active', 'mailerlite_status',
+                      'mailerlite_attempts', 'mailerlite_next_attempt_at', 'mailerlite_claim',
+                      'mailerlite_claimed_until', 'mailerlite_synced_at', 'mailerlite_error')
+DATETIME_COLUMNS = frozenset(['timestamp', 'created_at', 'updated_at', 'mailerlite_next_attempt_at',
+                              'mailerlite_claimed_until', 'mailerlite_synced_at'])
+
+SQLITE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS subscribers (
+    id INTEGER PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    source TEXT,
+    timestamp TEXT,
+    visitor_id TEXT,
+    active INTEGER,
+    mailerlite_status TEXT,
+    mailerlite_attempts INTEGER NOT NULL DEFAULT 0,
+    mailerlite_next_attempt_at TEXT,
+    mailerlite_claim TEXT,
+    mailerlite_claimed_until TEXT,
+    mailerlite_synced_at TEXT,
+    mailerlite_error TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS subscribers_outbox ON subscribers (mailerlite_status, mailerlite_next_attempt_at);
+CREATE INDEX IF NOT EXISTS subscribers_claim ON subscribers (mailerlite_claim);
+
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY,
+    slug TEXT NOT NULL,
+    status TEXT NOT NULL,
+    title TEXT,
+    excerpt TEXT,
+    content TEXT,
+    author TEXT,
+    category TEXT,
+    image TEXT,
+    tags TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS posts_slug_status ON posts (slug, status);
+CREATE INDEX IF NOT EXISTS posts_status_created ON posts (status, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS posts_status_category_created ON posts (status, category, created_at DESC, id DESC);
+CREATE TABLE IF NOT EXISTS post_tags (
+    tag TEXT NOT NULL,
+    post_id INTEGER NOT NULL REFERENCES posts (id) ON DELETE CASCADE,
+    PRIMARY KEY (tag, post_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS affiliate_clicks (
+    id INTEGER PRIMARY KEY,
+    {', '.join(EVENT_STREAMS['affiliate_clicks'])},
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS affiliate_clicks_timestamp ON affiliate_clicks (timestamp);
+CREATE INDEX IF NOT EXISTS affiliate_clicks_product ON affiliate_clicks (product_id, timestamp);
+
+CREATE TABLE IF NOT EXISTS ai_usage (
+    id INTEGER PRIMARY KEY,
+    {', '.join(EVENT_STREAMS['ai_usage'])},
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS ai_usage_timestamp ON ai_usage (timestamp);
+
+CREATE TABLE IF NOT EXISTS {ROLLUP_COLLECTION} (
+    id TEXT PRIMARY KEY,
+    dimension TEXT NOT NULL,
+    key TEXT NOT NULL,
+    date TEXT NOT NULL,
+    {', '.join(f'{counter} NUMERIC NOT NULL DEFAULT 0' for counter in ROLLUP_COUNTERS)}
+);
+CREATE INDEX IF NOT EXISTS rollups_dimension_date ON {ROLLUP_COLLECTION} (dimension, date);
+"""
+
+# Tables whose rows are plain documents: schema columns plus an ``extra`` JSON column
+DOCUMENT_TABLES = dict(EVENT_STREAMS, subscribers=SUBSCRIBER_COLUMNS)
+
+
+def _to_sql(value):
+    """Datetimes as fixed-width ISO strings (so they sort as text), bools as 0/1"""
+    if isinstance(value, datetime):
+        return value.isoformat(timespec='microseconds')
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _from_sql(column, value):
+    if column in DATETIME_COLUMNS and isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value
+
+
+class SQLiteRepository:
+    """Repository in a local SQLite file: WAL journal, one connection per process"""
+
+    backend = 'sqlite'
+
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+        self._connection()
+
+    # --- CONNECTION ---
+    def _connection(self):
+        # Reopened after a fork: a connection must not be shared between processes
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False,
+                               isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        # WAL lets readers in other workers carry on while one writes; NORMAL only syncs at checkpoints
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        conn.executescript(SQLITE_SCHEMA)
+        self._add_missing_columns(conn)
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _add_missing_columns(conn):
+        # Files created before a field got its own column: new columns start out NULL, older rows keep ``extra``
+        for stream, columns in EVENT_STREAMS.items():
+            existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({stream})')}
+            for column in columns:
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE {stream} ADD COLUMN {column}')
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._connection().execute(sql, params)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def _transaction(self):
+        return _Transaction(self)
+
+    def _document(self, table, row):
+        document = {}
+        for column in DOCUMENT_TABLES[table]:
+            value = row[column]
+            if value is not None:
+                document[column] = _from_sql(column, value)
+        if row['extra']:
+            document.update(json_util.loads(row['extra']))
+        return document
+
+    def _document_row(self, table, document):
+        columns = DOCUMENT_TABLES[table]
+        extra = {field: value for field, value in document.items() if field not in columns and field != '_id'}
+        return [_to_sql(document.get(column)) for column in columns] + [json_util.dumps(extra) if extra else None]
+
+    # --- EVENTS ---
+    def record_events(self, stream, documents):
+        if stream not in EVENT_STREAMS:
+            raise ValueError(f"Unknown event stream '{stream}'")
+        columns = EVENT_STREAMS[stream] + ('extra',)
+        sql = f"INSERT INTO {stream} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        rows = [self._document_row(stream, document) for document in documents]
+        with self._transaction() as conn:
+            conn.executemany(sql, rows)
+
+    def record_click(self, click):
+        self.record_events('affiliate_clicks', [click])
+
+    def iter_events(self, stream, fields=None, batch_size=1000, start=None, end=None):
+        if stream not in DOCUMENT_TABLES:
+            raise ValueError(f"Unknown event stream '{stream}'")
+        conditions, params = self._time_filter(start, end)
+        # Keyset pages: by id, or by (timestamp, id) when reading a time range in timestamp order
+        order = 'timestamp, id' if conditions else 'id'
+        last = None
+        while True:
+            page = list(conditions)
+            page_params = list(params)
+            if last is not None:
+                page.append(f"({order}) > ({', '.join('?' * len(last))})")
+                page_params.extend(last)
+            where = f"WHERE {' AND '.join(page)}" if page else ''
+            rows = self._query(f"SELECT * FROM {stream} {where} ORDER BY {order} LIMIT ?", page_params + [batch_size])
+            for row in rows:
+                document = self._document(stream, row)
+                if fields:
+                    document = {field: document[field] for field in fields if field in document}
+                yield document
+            if len(rows) < batch_size:
+                return
+            last = (rows[-1]['timestamp'], rows[-1]['id']) if conditions else (rows[-1]['id'],)
+
+    @staticmethod
+    def _time_filter(start, end, column='timestamp'):
+        conditions, params = [], []
+        if start is not None:
+            conditions.append(f"{column} >= ?")
+            params.append(_to_sql(start))
+        if end is not None:
+            conditions.append(f"{column} < ?")
+            params.append(_to_sql(end))
+        return conditions, params
+
+    def count(self, stream, start=None, end=None):
+        if stream not in DOCUMENT_TABLES and stream != 'posts':
+            raise ValueError(f"Unknown collection '{stream}'")
+        conditions, params = self._time_filter(start, end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return self._query(f"SELECT COUNT(*) FROM {stream} {where}", params)[0][0]
+
+    def delete_events(self, stream, start=None, end=None):
+        if stream not in EVENT_STREAMS:
+            raise ValueError(f"Unknown event stream '{stream}'")
+        conditions, params = self._time_filter(start, end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._transaction() as conn:
+            return conn.execute(f"DELETE FROM {stream} {where}", params).rowcount
+
+    def oldest_event_time(self, stream):
+        if stream not in EVENT_STREAMS:
+            raise ValueError(f"Unknown event stream '{stream}'")
+        rows = self._query(f"SELECT MIN(timestamp) FROM {stream}")
+        return _from_sql('timestamp', rows[0][0])
+
+    # --- SUBSCRIBERS ---
+    def add_subscriber(self, subscriber):
+        columns = SUBSCRIBER_COLUMNS + ('extra',)
+        cursor = self._execute(
+            f"INSERT INTO subscribers ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            "ON CONFLICT (email) DO NOTHING",
+            self._document_row('subscribers', dict({'mailerlite_attempts': 0}, **subscriber))
+        )
+        return cursor.rowcount == 1
+
+    def find_subscriber(self, email):
+        rows = self._query("SELECT * FROM subscribers WHERE email = ?", (email,))
+        return self._document('subscribers', rows[0]) if rows else None
+
+    def subscribers_with_status(self, status):
+        return [self._document('subscribers', row)
+                for row in self._query("SELECT * FROM subscribers WHERE mailerlite_status = ? ORDER BY id", (status,))]
+
+    def iter_subscribers(self, status=None, source=None, since=None, until=None, batch_size=1000):
+        conditions, params = self._time_filter(since, until)
+        if status:
+            conditions.append("mailerlite_status = ?")
+            params.append(status)
+        if source:
+            conditions.append("source = ?")
+            params.append(source)
+        last_id = 0
+        while True:
+            where = ' AND '.join(conditions + ['id > ?'])
+            rows = self._query(f"SELECT * FROM subscribers WHERE {where} ORDER BY id LIMIT ?",
+                               params + [last_id, batch_size])
+            for row in rows:
+                yield self._document('subscribers', row)
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]['id']
+
+    # --- POSTS ---
+    def add_posts(self, posts):
+        sql = f"INSERT INTO posts ({', '.join(POST_COLUMNS)}) VALUES ({', '.join('?' * len(POST_COLUMNS))})"
+        with self._transaction() as conn:
+            for post in posts:
+                values = [_to_sql(post.get(column)) for column in POST_COLUMNS]
+                values[POST_COLUMNS.index('tags')] = json_util.dumps(post['tags']) if post.get('tags') else None
+                post_id = conn.execute(sql, values).lastrowid
+                conn.executemany("INSERT OR IGNORE INTO post_tags (tag, post_id) VALUES (?, ?)",
+                                 [(tag, post_id) for tag in post.get('tags') or ()])
+
+    def _post(self, row):
+        post = {'_id': row['id']}
+        for column in row.keys():
+            if column == 'id' or row[column] is None:
+                continue
+            post[column] = json_util.loads(row[column]) if column == 'tags' else _from_sql(column, row[column])
+        return post
+
+    def list_posts(self, limit, cursor=None, fields=None, tag=None, category=None):
+        where = ["status = 'published'"]
+        params = []
+        if tag:
+            where.append("id IN (SELECT post_id FROM post_tags WHERE tag = ?)")
+            params.append(tag)
+        if category:
+            where.append("category = ?")
+            params.append(category)
+        total = self._query(f"SELECT COUNT(*) FROM posts WHERE {' AND '.join(where)}", params)[0][0]
+
+        if cursor:
+            created_at, item_id = pagination.decode_cursor(cursor)
+            try:
+                item_id = int(item_id)
+            except ValueError:
+                raise pagination.InvalidCursor('Invalid cursor')
+            where.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params += [_to_sql(created_at), _to_sql(created_at), item_id]
+        if fields:
+            columns = ['id', 'created_at'] + [field for field in fields if field in POST_COLUMNS and field != 'created_at']
+        else:
+            columns = ['id'] + [column for column in POST_COLUMNS if column != 'content']
+        rows = self._query(
+            f"SELECT {', '.join(columns)} FROM posts WHERE {' AND '.join(where)} "
+            "ORDER BY created_at DESC, id DESC LIMIT ?",
+            params + [limit + 1]
+        )
+        return _finish_page([self._post(row) for row in rows], limit, fields) + (total,)
+
+    def get_post(self, slug):
+        rows = self._query("SELECT * FROM posts WHERE slug = ? AND status = 'published' LIMIT 1", (slug,))
+        if not rows:
+            return None
+        post = self._post(rows[0])
+        post['_id'] = str(post['_id'])
+        return post
+
+    def posts_watermark(self):
+        count, latest = self._query(
+            "SELECT COUNT(*), MAX(COALESCE(updated_at, created_at)) FROM posts WHERE status = 'published'")[0]
+        if not count:
+            return (0, None), None
+        latest = _from_sql('updated_at', latest)
+        return (count, latest), latest
+
+    # --- ROLLUPS ---
+    def increment_rollups(self, increments):
+        columns = ('id', 'dimension', 'key', 'date') + ROLLUP_COUNTERS
+        sql = (f"INSERT INTO {ROLLUP_COLLECTION} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+               f"ON CONFLICT (id) DO UPDATE SET "
+               + ', '.join(f'{counter} = {counter} + excluded.{counter}' for counter in ROLLUP_COUNTERS))
+        rows = [
+            [rollup_id(dimension, key, day), dimension, key or day, day]
+            + [counters.get(counter, 0) for counter in ROLLUP_COUNTERS]
+            for (dimension, key, day), counters in increments.items()
+        ]
+        with self._transaction() as conn:
+            conn.executemany(sql, rows)
+
+    def find_rollups(self, dimension, start=None, end=None):
+        where = ["dimension = ?"]
+        params = [dimension]
+        if start:
+            where.append("date >= ?")
+            params.append(start)
+        if end:
+            where.append("date <= ?")
+            params.append(end)
+        return [dict(row, _id=row['id']) for row in
+                self._query(f"SELECT * FROM {ROLLUP_COLLECTION} WHERE {' AND '.join(where)}", params)]
+
+    def clear_rollups(self):
+        self._execute(f"DELETE FROM {ROLLUP_COLLECTION}")
+
+    # --- MAILERLITE OUTBOX ---
+    def claim_outbox(self, batch_size, claim_timeout):
+        now = datetime.utcnow()
+        token = str(uuid.uuid4())
+        # A single UPDATE is atomic, so two workers never claim the same subscriber
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE subscribers SET mailerlite_claim = ?, mailerlite_claimed_until = ? WHERE id IN ("
+                "  SELECT id FROM subscribers WHERE mailerlite_status = 'pending'"
+                "  AND mailerlite_next_attempt_at <= ?"
+                "  AND (mailerlite_claimed_until IS NULL OR mailerlite_claimed_until <= ?)"
+                "  ORDER BY id LIMIT ?)",
+                (token, _to_sql(now + timedelta(seconds=claim_timeout)), _to_sql(now), _to_sql(now), batch_size)
+            )
+            rows = conn.execute("SELECT email, mailerlite_attempts FROM subscribers WHERE mailerlite_claim = ? "
+                                "ORDER BY id", (token,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def outbox_synced(self, emails):
+        self._execute(
+            "UPDATE subscribers SET mailerlite_status = 'synced', mailerlite_synced_at = ?, mailerlite_error = NULL,"
+            " mailerlite_claim = NULL, mailerlite_claimed_until = NULL"
+            f" WHERE email IN ({', '.join('?' * len(emails))})",
+            [_to_sql(datetime.utcnow())] + list(emails)
+        )
+
+    def outbox_failed(self, emails, error, retry_at):
+        with self._transaction() as conn:
+            rows = conn.execute(f"SELECT id, mailerlite_attempts FROM subscribers "
+                                f"WHERE email IN ({', '.join('?' * len(emails))})", list(emails)).fetchall()
+            for row in rows:
+                attempts = (row['mailerlite_attempts'] or 0) + 1
+                next_attempt_at = retry_at(attempts)
+                conn.execute(
+                    "UPDATE subscribers SET mailerlite_attempts = ?, mailerlite_error = ?,"
+                    " mailerlite_status = CASE WHEN ? IS NULL THEN 'dead' ELSE mailerlite_status END,"
+                    " mailerlite_next_attempt_at = COALESCE(?, mailerlite_next_attempt_at),"
+                    " mailerlite_claim = NULL, mailerlite_claimed_until = NULL WHERE id = ?",
+                    (attempts, error, _to_sql(next_attempt_at), _to_sql(next_attempt_at), row['id'])
+                )
+
+    def outbox_counts(self):
+        counts = dict.fromkeys(OUTBOX_STATUSES, 0)
+        for status, count in self._query("SELECT mailerlite_status, COUNT(*) FROM subscribers "
+                                         "GROUP BY mailerlite_status"):
+            if status in counts:
+                counts[status] = count
+        return counts
+
+    def outbox_requeue(self, status='dead', email=None):
+        sql = ("UPDATE subscribers SET mailerlite_status = 'pending', mailerlite_attempts = 0,"
+               " mailerlite_next_attempt_at = ? WHERE mailerlite_status = ?")
+        params = [_to_sql(datetime.utcnow()), status]
+        if email:
+            sql += " AND email = ?"
+            params.append(email)
+        return self._execute(sql, params).rowcount
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+
+class _Transaction:
+    """``with repo._transaction() as conn``: BEGIN IMMEDIATE ... COMMIT under the repository lock"""
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    def __enter__(self):
+        self.repository._lock.acquire()
+        self.conn = self.repository._connection()
+        # Take the write lock up front so a read-then-write can't hit SQLITE_BUSY halfway through
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.repository._lock.release()
+
+
+def create_repository(backend_name, db, sqlite_path='gorillacamping.db'):
+    """Build the repository selected by ``STORAGE_BACKEND``
+
+    'mongo' falls back to the in-memory store when running without MongoDB.
+    """
+    if backend_name == 'sqlite':
+        return SQLiteRepository(sqlite_path)
+    if backend_name == 'memory' or is_memory(db):
+        return MemoryRepository(db if is_memory(db) else None)
+    return MongoRepository(db)
+
+
+def open_repository():
+    """Repository for the command-line scripts, configured by the same variables as the app"""
+    backend_name = os.environ.get('STORAGE_BACKEND', 'mongo')
+    if backend_name == 'sqlite':
+        return SQLiteRepository(os.environ.get('SQLITE_PATH', 'gorillacamping.db'))
+    from pymongo import MongoClient
+    return MongoRepository(MongoClient(os.environ['MONGODB_URI']).get_default_database())
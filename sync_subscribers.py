@@ -0,0 +1,59 @@
+"""Report on or re-run the MailerLite subscriber sync.
+
+    python sync_subscribers.py status              # counts per sync status, plus dead-lettered emails
+    python sync_subscribers.py sync                # drain every due pending subscriber now
+    python sync_subscribers.py requeue [--email X] # move dead-lettered subscribers back to pending
+    python sync_subscribers.py resync-all          # re-send everyone, e.g. after a MailerLite account move
+"""
+import argparse
+import os
+import sys
+
+from http_client import HTTPClient
+from mailerlite_sync import MailerLiteSync
+from storage import open_repository
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['status', 'sync', 'requeue', 'resync-all'])
+    parser.add_argument('--email', help='only requeue this subscriber')
+    args = parser.parse_args(argv)
+
+    # Make sure MAILERLITE_API_KEY and MONGODB_URI (or STORAGE_BACKEND=sqlite) are set before running this
+    repository = open_repository()
+    outbox = MailerLiteSync(
+        repository, HTTPClient(), os.environ.get('MAILERLITE_API_KEY'),
+        group_id=os.environ.get('MAILERLITE_GROUP_ID')
+    )
+
+    if args.command == 'status':
+        for status, count in outbox.status_counts().items():
+            print(f"{status:>8}: {count}")
+        for sub in repository.subscribers_with_status('dead'):
+            print(f"    dead: {sub['email']} ({sub.get('mailerlite_error')})")
+        return 0
+
+    if not outbox.api_key:
+        print("MAILERLITE_API_KEY is not set", file=sys.stderr)
+        return 1
+
+    if args.command == 'requeue':
+        print(f"Re-queued {outbox.requeue('dead', email=args.email)} subscribers")
+    elif args.command == 'resync-all':
+        print(f"Re-queued {outbox.requeue('synced')} subscribers")
+
+    total = 0
+    while True:
+        sent = outbox.sync_pending()
+        total += sent
+        if sent < outbox.batch_size:
+            break
+    print(f"Processed {total} subscribers")
+    for status, count in outbox.status_counts().items():
+        print(f"{status:>8}: {count}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
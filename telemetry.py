@@ -0,0 +1,319 @@
+"""Request, upstream and database timings with batched, sampled export.
+
+Every measurement updates an in-process histogram straight away (a lock and
+a few additions); the p50/p95/p99 in ``snapshot()`` come from those. A
+sampled subset (``sample_rate``; errors are always kept) is also queued for
+the exporter, and a background thread ships it in batches of ``batch_size``
+at least every ``flush_interval`` seconds. Requests never wait on the
+exporter: when the queue is full the record is dropped and counted.
+
+Exporters: ``ConsoleExporter``, ``FileExporter`` (NDJSON, for running
+offline and in tests) and ``AzureExporter`` (Application Insights).
+"""
+import bisect
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Log-spaced bucket bounds from 0.05 to ~1e7 (ms or tokens), each ~19% wider than the last
+BUCKET_BOUNDS = tuple(0.05 * 2 ** (i / 4) for i in range(112))
+
+
+class Histogram:
+    """Bucketed distribution; percentiles are interpolated within a bucket (a few % off at worst)"""
+
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = BUCKET_BOUNDS[index - 1] if index else 0.0
+                high = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max
+                value = low + (high - low) * (rank - seen) / count
+                return min(max(value, self.min), self.max)
+            seen += count
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 2) if self.count else None,
+            'p50': _round(self.percentile(0.50)),
+            'p95': _round(self.percentile(0.95)),
+            'p99': _round(self.percentile(0.99)),
+            'max': _round(self.max),
+        }
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+class _FlushRequest:
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class Telemetry:
+    """Histograms per (kind, name) plus a sampled, batched export queue"""
+
+    def __init__(self, exporter=None, sample_rate=1.0, batch_size=200, flush_interval=5.0, max_queue=10000):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._histograms = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._counters = {'queued': 0, 'sampled_out': 0, 'dropped': 0, 'exported': 0, 'failed': 0}
+
+    # --- RECORDING (request path) ---
+    def record(self, kind, name, value, error=False, **attributes):
+        """Add ``value`` (ms, or tokens) to the (kind, name) histogram and maybe queue it for export"""
+        key = (kind, name)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.add(value)
+            if error:
+                self._errors[key] = self._errors.get(key, 0) + 1
+
+        if self.exporter is None:
+            return
+        if not error and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            self._count('sampled_out')
+            return
+        self._ensure_started()
+        record = dict(attributes, ts=time.time(), kind=kind, name=name, value=round(value, 3), error=error)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._count('dropped')
+            return
+        self._count('queued')
+
+    @contextmanager
+    def timer(self, kind, name, **attributes):
+        """Time the ``with`` block in milliseconds; exceptions are recorded as errors and re-raised"""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.record(kind, name, (time.perf_counter() - started) * 1000, error=True, **attributes)
+            raise
+        self.record(kind, name, (time.perf_counter() - started) * 1000, **attributes)
+
+    # --- READING ---
+    def snapshot(self, kind=None):
+        """``{kind: {name: {count, mean, p50, p95, p99, max, errors}}}``"""
+        with self._lock:
+            items = [(key, histogram.summary(), self._errors.get(key, 0))
+                     for key, histogram in self._histograms.items() if kind is None or key[0] == kind]
+        result = {}
+        for (item_kind, name), summary, errors in sorted(items):
+            summary['errors'] = errors
+            result.setdefault(item_kind, {})[name] = summary
+        return result.get(kind, {}) if kind else result
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters['pending'] = self._queue.qsize()
+        counters['exporter'] = type(self.exporter).__name__ if self.exporter else None
+        counters['sample_rate'] = self.sample_rate
+        return counters
+
+    # --- EXPORT (background thread) ---
+    def flush(self, timeout=5.0):
+        """Block until everything queued so far has been handed to the exporter"""
+        if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+            items, markers = self._drain()
+            self._export(items)
+            for marker in markers:
+                marker.done.set()
+            return True
+        marker = _FlushRequest()
+        try:
+            self._queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.done.wait(timeout)
+
+    def stop(self, timeout=5.0):
+        self.flush(timeout)
+        self._stopping = True
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            try:
+                self._queue.put_nowait(_FlushRequest())
+            except queue.Full:
+                pass
+            thread.join(timeout)
+        self._thread = None
+
+    def _ensure_started(self):
+        # Started lazily, after the gunicorn fork, like the event pipeline's flusher
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stopping = False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='telemetry-export', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while not self._stopping:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                item = None
+            if isinstance(item, _FlushRequest):
+                items, markers = self._drain()
+                self._export(batch + items)
+                batch = []
+                for marker in [item] + markers:
+                    marker.done.set()
+            elif item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._export(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+        self._export(batch)
+
+    def _drain(self):
+        items, markers = [], []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return items, markers
+            (markers if isinstance(item, _FlushRequest) else items).append(item)
+
+    def _export(self, batch):
+        for start in range(0, len(batch), self.batch_size):
+            chunk = batch[start:start + self.batch_size]
+            try:
+                self.exporter.export(chunk)
+            except Exception as e:
+                self._count('failed', len(chunk))
+                logger.warning("Telemetry export failed: %s", e)
+            else:
+                self._count('exported', len(chunk))
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+
+# --- EXPORTERS ---
+class ConsoleExporter:
+    """One JSON line per record on stderr (or ``stream``)"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+
+    def export(self, records):
+        self.stream.write(''.join(json.dumps(record, default=str) + '\n' for record in records))
+        self.stream.flush()
+
+
+class FileExporter:
+    """Appends records to an NDJSON file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, records):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(record, default=str) + '\n' for record in records))
+
+
+class AzureExporter:
+    """Sends records to Application Insights as traces with custom dimensions"""
+
+    def __init__(self, connection_string):
+        self.connection_string = connection_string
+        self._logger = None
+
+    def export(self, records):
+        if self._logger is None:
+            # Heavy import, done in the export thread rather than at startup
+            from opencensus.ext.azure.log_exporter import AzureLogHandler
+            self._logger = logging.getLogger('gorillacamping.telemetry')
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            self._logger.addHandler(AzureLogHandler(connection_string=self.connection_string))
+        for record in records:
+            self._logger.info("%s %s", record['kind'], record['name'], extra={'custom_dimensions': record})
+
+
+def create_exporter(name, file_path='telemetry.ndjson', connection_string=None):
+    """Build the exporter selected by ``TELEMETRY_EXPORTER`` (None for 'none')"""
+    if name == 'console':
+        return ConsoleExporter()
+    if name == 'file':
+        return FileExporter(file_path)
+    if name == 'azure' and connection_string:
+        return AzureExporter(connection_string)
+    return None
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """pymongo command listener recording each command as ``db`` / ``<command> <collection>``"""
+
+    def __init__(self, telemetry):
+        self.telemetry = telemetry
+        self._collections = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self._collections[event.request_id] = collection if isinstance(collection, str) else ''
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event, error=True)
+
+    def _record(self, event, error=False):
+        collection = self._collections.pop(event.request_id, '')
+        name = f"{event.command_name} {collection}".strip()
+        self.telemetry.record('db', name, event.duration_micros / 1000, error=error)
@@ -0,0 +1,31 @@
+import ai_cache
+from ai_cache import MemoryCacheBackend, ResponseCache
+
+def test_normalized_messages_share_a_key():
+    history = [{'role': 'user', 'content': 'Best power station?'}]
+    key = ai_cache.make_key('Best power station?', history)
+    assert key == ai_cache.make_key('best   power station', [{'role': 'user', 'content': 'best power station'}])
+    assert key != ai_cache.make_key('Best water filter?', history)
+    assert key != ai_cache.make_key('Best power station?', [])
+
+def test_memory_backend_lru_and_ttl():
+    backend = MemoryCacheBackend(max_entries=2, ttl=60)
+    backend.set('a', 1)
+    backend.set('b', 2)
+    backend.get('a')
+    backend.set('c', 3)
+    assert backend.get('b') is None  # least recently used
+    assert backend.get('a') == 1
+
+    expired = MemoryCacheBackend(ttl=-1)
+    expired.set('a', 1)
+    assert expired.get('a') is None
+
+def test_response_cache_counts_hits_and_saved_cost():
+    cache = ResponseCache(MemoryCacheBackend())
+    assert cache.get('k') is None
+    cache.set('k', 'Get a Jackery.', 0.002)
+    assert cache.get('k')['response'] == 'Get a Jackery.'
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+    assert stats['estimated_cost_saved'] == 0.002
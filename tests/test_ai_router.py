@@ -0,0 +1,184 @@
+import threading
+import time
+
+import pytest
+
+import app as app_module
+from ai_router import NoProviderAvailable, ProviderRouter, ProviderWindow
+
+
+def make_router(providers=('gemini', 'openai', 'ollama'), **kwargs):
+    kwargs.setdefault('min_samples', 3)
+    return ProviderRouter(providers, **kwargs)
+
+
+def test_window_percentiles_and_error_rate():
+    window = ProviderWindow(size=10)
+    for seconds in (0.1, 0.2, 0.3, 0.4):
+        window.record(seconds)
+    window.record(5.0, ok=False)
+    summary = window.summary()
+    assert summary['samples'] == 5
+    assert summary['error_rate'] == 0.2
+    assert summary['p50'] == 0.3
+    assert summary['p95'] == 0.4  # failed calls don't count towards latency
+
+
+def test_window_forgets_old_calls(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('ai_router.time.monotonic', lambda: now[0])
+    window = ProviderWindow(max_age=60)
+    window.record(0.1, ok=False)
+    now[0] += 61
+    window.record(0.2)
+    assert window.summary()['samples'] == 1
+    assert window.summary()['error_rate'] == 0.0
+
+
+def test_primary_first_until_another_provider_is_measured_faster():
+    router = make_router()
+    assert router.ranked() == ['gemini', 'openai', 'ollama']
+    for _ in range(3):
+        router.record('gemini', 2.0)
+        router.record('openai', 0.5)
+    assert router.ranked() == ['openai', 'gemini', 'ollama']
+
+
+def test_stats_report_the_ranking_without_exploring():
+    router = make_router(explore_rate=1.0)
+    for _ in range(5):
+        assert router.stats()['ranking'] == ['gemini', 'openai', 'ollama']
+    assert router.stats()['explored'] == 0
+    assert router.ranked() == ['openai', 'gemini', 'ollama']  # calls still explore
+    assert router.stats()['explored'] == 1
+
+
+def test_failing_and_unavailable_providers_are_demoted():
+    router = make_router(is_available=lambda provider: provider != 'ollama')
+    for _ in range(3):
+        router.record('gemini', 0.1, ok=False)
+    assert router.ranked() == ['openai', 'gemini']
+
+
+def test_call_fails_over_and_reports_the_serving_provider():
+    router = make_router()
+
+    def fn(provider):
+        if provider == 'gemini':
+            raise RuntimeError('down')
+        return f'answer from {provider}'
+
+    assert router.call(fn) == ('openai', 'answer from openai')
+    stats = router.stats()
+    assert stats['failovers'] == 1
+    assert stats['providers']['openai']['served'] == 1
+    assert stats['providers']['gemini']['error_rate'] == 1.0
+
+
+def test_call_raises_the_last_error_or_no_provider():
+    def fn(provider):
+        raise RuntimeError(f'{provider} down')
+
+    with pytest.raises(RuntimeError, match='openai down'):
+        make_router(providers=('gemini', 'openai')).call(fn)
+    with pytest.raises(NoProviderAvailable):
+        make_router(is_available=lambda provider: False).call(lambda provider: 'never')
+
+
+def test_hedge_takes_the_first_answer_and_hands_over_the_loser():
+    router = make_router(providers=('slow', 'fast'), hedge_min_delay=0.01, hedge_max_delay=0.01)
+    release = threading.Event()
+    discarded = []
+    done = threading.Event()
+
+    def fn(provider):
+        if provider == 'slow':
+            release.wait(2)
+        return provider
+
+    def on_discard(provider, result):
+        discarded.append((provider, result))
+        done.set()
+
+    assert router.call(fn, hedge=True, on_discard=on_discard) == ('fast', 'fast')
+    release.set()
+    assert done.wait(2)
+    assert discarded == [('slow', 'slow')]
+    stats = router.stats()
+    assert stats['hedges'] == 1
+    assert stats['hedge_wins'] == 1
+
+
+def test_hedge_is_not_sent_when_the_primary_answers_in_time():
+    router = make_router(providers=('gemini', 'openai'), hedge_min_delay=1, hedge_max_delay=1)
+    calls = []
+
+    def fn(provider):
+        calls.append(provider)
+        return provider
+
+    assert router.call(fn, hedge=True) == ('gemini', 'gemini')
+    time.sleep(0.01)
+    assert calls == ['gemini']
+    assert router.stats()['hedges'] == 0
+
+
+def test_hedge_delay_follows_the_p95():
+    router = make_router(hedge_min_delay=0.5, hedge_max_delay=5)
+    assert router.hedge_delay('gemini') == 5  # no data yet: wait the longest
+    for seconds in (1.0, 1.5, 2.0):
+        router.record('gemini', seconds)
+    assert router.hedge_delay('gemini') == 2.0
+
+
+def test_chat_fails_over_to_the_next_configured_provider(monkeypatch):
+    router = make_router(is_available=app_module.ai_provider_available)
+    monkeypatch.setattr(app_module, 'provider_router', router)
+    monkeypatch.setattr(app_module, 'GEMINI_API_KEY', 'test-key')
+    monkeypatch.setattr(app_module, 'OLLAMA_ENABLED', True)
+    monkeypatch.setattr(app_module, 'ai_gate', app_module.ratelimit.AIGate(
+        app_module.ratelimit.MemoryBucketStore(), app_module.ratelimit.MemorySpendStore(), {}))
+
+    def gemini_down(message, conversation_history, visitor_id):
+        raise app_module.http_client.UpstreamError('gemini down')
+
+    def ollama_answer(message, conversation_history, visitor_id):
+        prompt = app_module.prompt_builder.text(message, conversation_history)
+        return 'Ollama says camp through it.', prompt, (12, 6)
+
+    monkeypatch.setitem(app_module.AI_COMPLETIONS, 'gemini', gemini_down)
+    monkeypatch.setitem(app_module.AI_COMPLETIONS, 'ollama', ollama_answer)
+    tracked = []
+    monkeypatch.setattr(app_module, 'track_ai_usage', lambda *args, **kwargs: tracked.append(kwargs))
+
+    with app_module.app.test_request_context('/api/guerilla-chat'):
+        reply = app_module.guerilla_ai_response('failover test: which stove?')
+    assert reply == 'Ollama says camp through it.'
+    assert tracked[-1]['provider'] == 'ollama'
+    assert router.stats()['failovers'] == 1
+
+
+def test_stream_records_usage_when_the_client_disconnects(monkeypatch):
+    router = make_router(providers=('gemini',))
+    monkeypatch.setattr(app_module, 'provider_router', router)
+    monkeypatch.setattr(app_module, 'ai_gate', app_module.ratelimit.AIGate(
+        app_module.ratelimit.MemoryBucketStore(), app_module.ratelimit.MemorySpendStore(), {}))
+
+    def gemini_stream(message, conversation_history, visitor_id, usage):
+        usage['prompt'] = app_module.prompt_builder.text(message, conversation_history)
+        yield 'Pitch the tent '
+        yield 'before dark.'
+
+    monkeypatch.setitem(app_module.AI_STREAMS, 'gemini', gemini_stream)
+    tracked = []
+    monkeypatch.setattr(app_module, 'track_ai_usage', lambda *args, **kwargs: tracked.append((args, kwargs)))
+
+    with app_module.app.test_request_context('/api/guerilla-chat'):
+        stream = app_module.provider_ai_stream('disconnect test', [], 'v-disconnect', 'disconnect-key')
+        assert next(stream) == 'Pitch the tent '
+        stream.close()  # what the server does when the client goes away
+    assert len(tracked) == 1
+    args, kwargs = tracked[0]
+    assert kwargs['provider'] == 'gemini'
+    assert args[1] == app_module.prompt_builder.estimator.count('Pitch the tent ')
+    assert app_module.response_cache.get('disconnect-key') is None
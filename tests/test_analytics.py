@@ -0,0 +1,100 @@
+from datetime import datetime
+import pytest
+from app import app, event_pipeline
+import analytics
+from analytics import Rollups
+from storage import MemoryRepository
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    return app.test_client()
+
+def raw_events():
+    return {
+        'affiliate_clicks': [
+            {'product_id': 'lifestraw-filter', 'timestamp': datetime(2025, 7, 1, 9)},
+            {'product_id': 'lifestraw-filter', 'timestamp': datetime(2025, 7, 2, 9)},
+            {'product_id': 'jackery-explorer-240', 'timestamp': datetime(2025, 7, 2, 10)},
+            # Four clicks counted together during a spike
+            {'product_id': 'jackery-explorer-240', 'timestamp': datetime(2025, 7, 2, 11), 'weight': 4,
+             'aggregated': True},
+        ],
+        'subscribers': [{'email': 'a@example.com', 'source': 'blog', 'timestamp': '2025-07-02T08:00:00'}],
+        'ai_usage': [
+            {'provider': 'gemini', 'estimated_cost': 0.01, 'prompt_tokens': 100, 'completion_tokens': 50,
+             'timestamp': datetime(2025, 7, 1)},
+            {'provider': 'gemini', 'estimated_cost': 0, 'cache_hit': True, 'saved_cost': 0.01,
+             'timestamp': datetime(2025, 7, 2)},
+            # The losing answer of a hedged chat: billed, but not another interaction
+            {'provider': 'openai', 'estimated_cost': 0.02, 'prompt_tokens': 100, 'completion_tokens': 60,
+             'hedged': True, 'timestamp': datetime(2025, 7, 1)},
+        ],
+    }
+
+def make_repository():
+    repository = MemoryRepository()
+    for collection, documents in raw_events().items():
+        if collection == 'subscribers':
+            for subscriber in documents:
+                repository.add_subscriber(subscriber)
+        else:
+            repository.record_events(collection, documents)
+    return repository
+
+def test_rebuild_and_summarize():
+    rollups = Rollups(make_repository())
+    rollups.rebuild()
+    totals = rollups.summary()
+    assert totals['affiliate_clicks'] == 7
+    assert totals['subscribers'] == 1
+    assert totals['ai_interactions'] == 2
+    assert totals['estimated_ai_cost'] == pytest.approx(0.03)
+    by_provider = rollups.summary(group_by='provider')
+    assert [(row['key'], row['ai_interactions']) for row in by_provider['groups']] == [('gemini', 2), ('openai', 0)]
+    assert totals['ai_cache_hits'] == 1
+    assert totals['estimated_ai_cost_saved'] == 0.01
+
+    by_product = rollups.summary(start='2025-07-02', group_by='product')
+    assert by_product['affiliate_clicks'] == 6
+    assert [(row['key'], row['affiliate_clicks']) for row in by_product['groups']] == [
+        ('jackery-explorer-240', 5), ('lifestraw-filter', 1)]
+
+    by_day = rollups.summary(group_by='day')
+    assert [row['key'] for row in by_day['groups']] == ['2025-07-01', '2025-07-02']
+
+def test_compacted_events_rebuild_to_the_same_rollups():
+    compacted = MemoryRepository()
+    for collection, documents in raw_events().items():
+        if collection == 'subscribers':  # never compacted
+            for subscriber in documents:
+                compacted.add_subscriber(subscriber)
+            continue
+        for day in ('2025-07-01', '2025-07-02'):
+            events = [doc for doc in documents if analytics.event_day(doc['timestamp']) == day]
+            compacted.record_events(collection, analytics.compact(collection, events, day))
+    assert compacted.count('affiliate_clicks') == 3  # one per product and day
+    expected, actual = Rollups(make_repository()), Rollups(compacted)
+    expected.rebuild()
+    actual.rebuild()
+    for group_by in ('day', 'product', 'provider'):
+        assert actual.summary(group_by=group_by) == expected.summary(group_by=group_by)
+
+def test_incremental_record_matches_rebuild():
+    incremental = Rollups(MemoryRepository())
+    for collection, documents in raw_events().items():
+        for doc in documents:
+            incremental.record(collection, [doc])
+    rebuilt = Rollups(make_repository())
+    rebuilt.rebuild()
+    assert incremental.summary(group_by='provider') == rebuilt.summary(group_by='provider')
+
+def test_summary_endpoint_reads_rollups(client, monkeypatch):
+    monkeypatch.setenv('ADMIN_API_KEY', 'secret')
+    client.get('/affiliate/4patriots-food')
+    event_pipeline.flush()
+    rv = client.get('/api/analytics/summary?api_key=secret&group_by=product')
+    assert rv.status_code == 200
+    groups = {row['key']: row for row in rv.get_json()['groups']}
+    assert groups['4patriots-food']['affiliate_clicks'] >= 1
+    assert client.get('/api/analytics/summary?api_key=secret&group_by=color').status_code == 400
@@ -1,5 +1,7 @@
+from datetime import datetime
+
 import pytest
-from app import app
+from app import app, app_setup, conversation_store, create_app
 
 @pytest.fixture
 def client():
@@ -13,3 +15,101 @@ def test_home_get(client):
 def test_blog_get(client):
     rv = client.get('/blog')
     assert rv.status_code == 200
+
+def test_guerilla_chat_stream(client):
+    rv = client.post('/api/guerilla-chat?stream=1', json={'message': 'need power for my van'})
+    assert rv.status_code == 200
+    assert rv.mimetype == 'text/event-stream'
+    body = rv.get_data(as_text=True)
+    assert 'event: token' in body
+    assert 'event: done' in body
+    assert 'jackery-explorer-240' in body
+
+    # Both turns are stored under the visitor_id cookie once the stream ends
+    visitor_id = client.get_cookie('visitor_id').value
+    assert [msg['role'] for msg in conversation_store.history(visitor_id)] == ['user', 'assistant']
+    rv = client.post('/api/guerilla-chat', json={'message': 'thanks'})
+    assert rv.get_json()['visitor_id'] == visitor_id
+    roles = [msg['role'] for msg in conversation_store.history(visitor_id)]
+    assert roles == ['user', 'assistant', 'user', 'assistant']
+
+def test_disconnected_stream_keeps_the_partial_turns(client, monkeypatch):
+    import app as app_module
+    from ai_router import ProviderRouter
+    from ratelimit import AIGate, MemoryBucketStore, MemorySpendStore
+    monkeypatch.setattr(app_module, 'provider_router', ProviderRouter(('gemini',)))
+    monkeypatch.setattr(app_module, 'ai_gate', AIGate(MemoryBucketStore(), MemorySpendStore(), {}))
+
+    def gemini_stream(message, conversation_history, visitor_id, usage):
+        usage['prompt'] = app_module.prompt_builder.text(message, conversation_history)
+        yield 'Park behind '
+        yield 'the ridge.'
+
+    monkeypatch.setitem(app_module.AI_STREAMS, 'gemini', gemini_stream)
+    client.set_cookie('visitor_id', 'v-early-close')
+    rv = client.post('/api/guerilla-chat?stream=1', json={'message': 'where do I park tonight?'}, buffered=False)
+    assert 'Park behind' in next(iter(rv.response)).decode()
+    rv.close()  # the client went away after the first chunk
+    assert [(msg['role'], msg['content']) for msg in conversation_store.history('v-early-close')] == [
+        ('user', 'where do I park tonight?'), ('assistant', 'Park behind')]
+
+def test_subscribe_dedups_case_insensitively(client):
+    rv = client.post('/api/subscribe', json={'email': 'Camper@Example.com'})
+    assert rv.get_json() == {'success': True}
+    rv = client.post('/api/subscribe', json={'email': ' camper@example.COM '})
+    assert rv.get_json() == {'success': False, 'error': 'Already subscribed'}
+
+def test_blog_posts_conditional_get(client):
+    rv = client.get('/api/blog-posts')
+    assert rv.status_code == 200
+    assert rv.headers['ETag']
+    assert 'max-age' in rv.headers['Cache-Control']
+    assert len(rv.get_json()) == 3
+
+    rv = client.get('/api/blog-posts', headers={'If-None-Match': rv.headers['ETag']})
+    assert rv.status_code == 304
+    assert rv.data == b''
+
+def test_blog_posts_keyset_pagination(client):
+    rv = client.get('/api/blog-posts?limit=2&fields=slug,title')
+    assert rv.headers['X-Total-Count'] == '3'
+    assert rv.get_json() == [
+        {'slug': 'power-solutions-digital-nomads', 'title': 'Power Solutions for Digital Nomads'},
+        {'slug': 'guerilla-camping-101', 'title': 'Guerilla Camping 101: Off-Grid Freedom'},
+    ]
+    rv = client.get('/api/blog-posts?limit=2&fields=slug&cursor=' + rv.headers['X-Next-Cursor'])
+    assert rv.get_json() == [{'slug': 'essential-camping-gear'}]
+    assert 'X-Next-Cursor' not in rv.headers
+
+    assert client.get('/api/blog-posts?cursor=not-a-cursor').status_code == 400
+
+def test_blog_posts_rejects_a_cursor_the_backend_cannot_use(client, monkeypatch, tmp_path):
+    import app as app_module
+    import pagination
+    from storage import SQLiteRepository
+    repository = SQLiteRepository(str(tmp_path / 'posts.db'))
+    monkeypatch.setattr(app_module, 'repository', repository)
+    # Well-formed, but SQLite post ids are integers
+    cursor = pagination.encode_cursor(datetime(2025, 7, 1), '64b0c0ffee')
+    assert client.get('/api/blog-posts?cursor=' + cursor).status_code == 400
+    repository.close()
+
+def test_create_app_sets_up_once():
+    assert create_app() is app
+    assert app_setup.loaded
+    assert create_app() is app
+
+def test_gear_is_served_compressed_from_a_snapshot(client):
+    import gzip
+    plain = client.get('/api/gear')
+    assert plain.status_code == 200
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.headers['Vary'] == 'Accept-Encoding'
+
+    rv = client.get('/api/gear', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert rv.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(rv.data) == plain.data
+    assert rv.headers['ETag'] != plain.headers['ETag']
+
+    rv = client.get('/api/gear', headers={'Accept-Encoding': 'gzip', 'If-None-Match': rv.headers['ETag']})
+    assert rv.status_code == 304
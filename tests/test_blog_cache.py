@@ -0,0 +1,26 @@
+from datetime import datetime
+from blog_cache import BlogCache
+
+def test_entries_rebuild_when_watermark_moves():
+    watermark = [(1, None), None]
+    cache = BlogCache(lambda: tuple(watermark), check_interval=0)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return [{'slug': 'a'}]
+
+    first = cache.get('posts', loader)
+    assert cache.get('posts', loader) is first
+    assert len(loads) == 1
+
+    watermark[:] = [(2, datetime(2025, 7, 2)), datetime(2025, 7, 2)]
+    second = cache.get('posts', loader)
+    assert len(loads) == 2
+    assert second.last_modified == datetime(2025, 7, 2)
+    assert second.etag == first.etag  # same bytes, same strong ETag
+
+def test_missing_post_is_cached_as_404():
+    cache = BlogCache(lambda: ('v', None), check_interval=60)
+    assert cache.get('post:nope', lambda: None).status == 404
+    assert cache.stats() == {'entries': 1, 'hits': 0, 'misses': 1}
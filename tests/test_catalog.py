@@ -0,0 +1,29 @@
+from catalog import ProductCatalog
+
+catalog = ProductCatalog.from_file()
+
+def ids(message):
+    return [rec['id'] for rec in catalog.recommend(message)]
+
+def test_word_boundaries():
+    assert ids('Is this jacket waterproof?') == []
+    assert ids('That stove is powerful') == []
+    assert ids('Need clean water') == ['lifestraw-filter']
+    assert ids('How many batteries should I pack?') == ['jackery-explorer-240']
+
+def test_ranks_several_products():
+    message = 'Need food for a week, water for the trip, and a way to filter creek water'
+    assert ids(message) == ['lifestraw-filter', '4patriots-food']
+
+def test_recommendation_format():
+    assert catalog.recommend('best power station for van life') == [{
+        'id': 'jackery-explorer-240',
+        'name': 'Jackery Explorer 240',
+        'price': '$199.99',
+        'image': 'https://m.media-amazon.com/images/I/41XePYWYlAL._AC_US300_.jpg'
+    }]
+
+def test_links_and_gear_share_the_catalog():
+    assert catalog.links()['alps-lynx'] == 'https://amzn.to/3QZqX8Y'
+    assert [item['affiliate_id'] for item in catalog.gear_items()] == [
+        'jackery-explorer-240', 'lifestraw-filter', '4patriots-food']
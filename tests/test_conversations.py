@@ -0,0 +1,20 @@
+from conversations import MemoryConversationStore, make_message
+
+
+def test_memory_store_trims_history():
+    store = MemoryConversationStore(max_messages=3)
+    for i in range(4):
+        store.append('v1', make_message('user', f'question {i}'))
+    assert [m['content'] for m in store.history('v1')] == ['question 1', 'question 2', 'question 3']
+    assert all(m['tokens'] == make_message('user', m['content'])['tokens'] for m in store.history('v1'))
+    assert store.history('other') == []
+
+
+def test_memory_store_evicts_least_recent_conversation():
+    store = MemoryConversationStore(max_conversations=2)
+    store.append('a', make_message('user', 'hi'))
+    store.append('b', make_message('user', 'hi'))
+    store.history('a')
+    store.append('c', make_message('user', 'hi'))
+    assert store.history('b') == []
+    assert store.history('a')
@@ -0,0 +1,33 @@
+from db_indexes import ensure_indexes
+
+class FakeCollection:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.indexes = []
+
+    def create_index(self, keys, **options):
+        if self.fail:
+            raise RuntimeError('E11000 duplicate key')
+        self.indexes.append((keys, options))
+        return options['name']
+
+def test_ensure_indexes_declares_unique_email():
+    collections = {}
+    db = type('FakeDB', (), {'__getitem__': lambda self, name: collections.setdefault(name, FakeCollection())})()
+    created = ensure_indexes(db)
+    assert 'subscribers.email_unique' in created
+    assert 'posts.slug_status' in created
+    assert collections['subscribers'].indexes[0][1]['unique'] is True
+
+def test_ensure_indexes_survives_failures():
+    db = type('FakeDB', (), {'__getitem__': lambda self, name: FakeCollection(fail=name == 'subscribers')})()
+    created = ensure_indexes(db)
+    assert not any(name.startswith('subscribers.') for name in created)
+    assert 'affiliate_clicks.timestamp' in created
+
+def test_ensure_indexes_runs_owner_indexes():
+    from ai_cache import MongoCacheBackend
+    collection = FakeCollection()
+    db = type('FakeDB', (), {'__getitem__': lambda self, name: FakeCollection()})()
+    ensure_indexes(db, owners=[MongoCacheBackend(collection, ttl=60)])
+    assert collection.indexes == [('created_at', {'expireAfterSeconds': 60})]
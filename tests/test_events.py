@@ -0,0 +1,54 @@
+import pytest
+from app import app, event_pipeline, repository
+from events import EventPipeline
+from storage import MemoryRepository
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    return app.test_client()
+
+def test_affiliate_redirect_queues_click(client):
+    before = repository.count('affiliate_clicks')
+    rv = client.get('/affiliate/jackery-explorer-240')
+    assert rv.status_code == 302
+    event_pipeline.flush()
+    assert repository.count('affiliate_clicks') == before + 1
+    click = list(repository.iter_events('affiliate_clicks'))[-1]
+    assert click['product_id'] == 'jackery-explorer-240'
+    assert click['browser'] == 'other'  # added by the pipeline's enrich step, not the request
+
+def test_pipeline_enriches_before_writing():
+    store = MemoryRepository()
+
+    def enrich(document):
+        if document['n'] == 1:
+            raise ValueError('bad event')
+        return dict(document, doubled=document['n'] * 2)
+
+    pipeline = EventPipeline(store, enrich={'affiliate_clicks': enrich})
+    for i in range(3):
+        pipeline.emit('affiliate_clicks', {'n': i})
+    pipeline.stop()
+    assert [doc.get('doubled') for doc in store.iter_events('affiliate_clicks')] == [0, None, 4]
+
+def test_pipeline_batches_and_counts():
+    store = MemoryRepository()
+    pipeline = EventPipeline(store, batch_size=10, flush_interval=60)
+    for i in range(25):
+        pipeline.emit('ai_usage', {'n': i})
+    pipeline.stop()
+    assert [doc['n'] for doc in store.iter_events('ai_usage')] == list(range(25))
+    stats = pipeline.stats()
+    assert stats['flushed'] == 25
+    assert stats['dropped'] == 0
+
+def test_pipeline_drops_when_full():
+    store = MemoryRepository()
+    pipeline = EventPipeline(store, max_queue=2)
+    pipeline._ensure_started = lambda: None  # no flusher: the queue only fills up
+    results = [pipeline.emit('affiliate_clicks', {'n': i}) for i in range(5)]
+    assert results == [True, True, False, False, False]
+    assert pipeline.stats()['dropped'] == 3
+    pipeline.flush()
+    assert store.count('affiliate_clicks') == 2
@@ -0,0 +1,99 @@
+import io
+import json
+from datetime import date, datetime
+
+import pytest
+
+import exports
+import list_subscribers
+from analytics import Rollups
+from exports import EventExporter, read_ndjson
+from mailerlite_sync import pending_sync_fields
+from storage import MemoryRepository, SQLiteRepository
+
+TODAY = date(2025, 8, 1)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def repository(request, tmp_path):
+    repo = MemoryRepository() if request.param == 'memory' else SQLiteRepository(str(tmp_path / 'events.db'))
+    repo.record_events('affiliate_clicks', [
+        {'product_id': 'lifestraw-filter', 'timestamp': datetime(2025, 7, 1, 9), 'visitor_id': 'v1'},
+        {'product_id': 'lifestraw-filter', 'timestamp': datetime(2025, 7, 1, 10), 'visitor_id': 'v2'},
+        {'product_id': 'jackery-explorer-240', 'timestamp': datetime(2025, 7, 3, 8), 'weight': 4},
+        {'product_id': 'jackery-explorer-240', 'timestamp': datetime(2025, 7, 31, 8)},
+        {'product_id': 'jackery-explorer-240', 'timestamp': datetime(2025, 8, 1, 8)},  # today: not exported
+    ])
+    repo.record_events('ai_usage', [
+        {'provider': 'gemini', 'prompt_tokens': 100, 'completion_tokens': 40, 'estimated_cost': 0.002,
+         'timestamp': datetime(2025, 7, 2, 12)},
+        {'provider': 'gemini', 'cache_hit': True, 'saved_cost': 0.002, 'timestamp': datetime(2025, 7, 2, 13)},
+    ])
+    yield repo
+    repo.close()
+
+
+def test_exports_complete_days_to_partitions(repository, tmp_path):
+    exporter = EventExporter(repository, str(tmp_path / 'out'), batch_size=1)
+    report = exporter.run(today=TODAY)
+    assert report == {'ai_usage': {'exported': 2, 'removed': 0}, 'affiliate_clicks': {'exported': 4, 'removed': 0}}
+
+    clicks = list(read_ndjson(exporter.partition_path('affiliate_clicks', '2025-07-01')))
+    assert [click['visitor_id'] for click in clicks] == ['v1', 'v2']
+    assert clicks[0]['timestamp'] == '2025-07-01T09:00:00'
+    assert '_id' not in clicks[0]
+    assert not (tmp_path / 'out' / 'affiliate_clicks' / '2025-08-01.ndjson.gz').exists()
+    assert repository.count('affiliate_clicks') == 5  # exporting alone removes nothing
+
+
+def test_resumes_from_the_checkpoint(repository, tmp_path):
+    output = str(tmp_path / 'out')
+    EventExporter(repository, output).run(streams=('affiliate_clicks',), end=date(2025, 7, 3), today=TODAY)
+    checkpoint = json.loads((tmp_path / 'out' / 'checkpoint.json').read_text())
+    assert checkpoint == {'affiliate_clicks': {'exported': '2025-07-02'}}
+
+    report = EventExporter(repository, output).run(streams=('affiliate_clicks',), today=TODAY)
+    assert report['affiliate_clicks']['exported'] == 2  # 07-03 and 07-31 only
+
+
+def test_compaction_keeps_rollup_totals(repository, tmp_path):
+    before = Rollups(repository)
+    before.rebuild()
+    expected = before.summary(group_by='product')
+
+    exporter = EventExporter(repository, str(tmp_path / 'out'), mode='compact', retain_days=7)
+    report = exporter.run(today=TODAY)
+    assert report['affiliate_clicks'] == {'exported': 4, 'removed': 3}  # 07-31 is within the retained week
+    assert report['ai_usage'] == {'exported': 2, 'removed': 2}
+    assert repository.count('affiliate_clicks') == 4  # 2 compacted days + 2 raw days
+    assert repository.count('ai_usage') == 1
+
+    # A second run (or a retried step) doesn't compact anything twice
+    assert exporter.run(today=TODAY)['affiliate_clicks'] == {'exported': 0, 'removed': 0}
+    exporter.remove_day('affiliate_clicks', '2025-07-01')
+
+    after = Rollups(repository)
+    after.rebuild()
+    assert after.summary(group_by='product') == expected
+
+
+def test_delete_mode_drops_exported_days(repository, tmp_path):
+    EventExporter(repository, str(tmp_path / 'out'), mode='delete', retain_days=7).run(today=TODAY)
+    assert repository.count('affiliate_clicks') == 2
+    assert repository.count('ai_usage') == 0
+    assert exports.Checkpoint(str(tmp_path / 'out' / 'checkpoint.json')).get('ai_usage', 'delete') == '2025-07-24'
+
+
+def test_list_subscribers_streams_filtered_rows(tmp_path):
+    repository = MemoryRepository()
+    for email, source in (('a@example.com', 'blog'), ('b@example.com', 'footer')):
+        repository.add_subscriber(dict(email=email, source=source, timestamp=datetime(2025, 7, 1),
+                                       **pending_sync_fields()))
+    out = io.StringIO()
+    count = list_subscribers.write_subscribers(repository.iter_subscribers(source='blog'), out)
+    assert count == 1
+    assert json.loads(out.getvalue())['email'] == 'a@example.com'
+
+    out = io.StringIO()
+    list_subscribers.write_subscribers(repository.iter_subscribers(), out, fmt='csv', fields=('email', 'source'))
+    assert out.getvalue().splitlines() == ['email,source', 'a@example.com,blog', 'b@example.com,footer']
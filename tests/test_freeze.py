@@ -0,0 +1,29 @@
+import json
+from freeze import freeze
+
+def test_freeze_writes_pages_snapshots_and_redirects(tmp_path):
+    pages, snapshots = freeze(str(tmp_path))
+    assert '/' in pages
+    assert '/blog/guerilla-camping-101' in pages
+    assert (tmp_path / 'index.html').exists()
+    assert (tmp_path / 'blog' / 'essential-camping-gear.html').exists()
+
+    assert '/api/gear' in snapshots
+    gear = json.loads((tmp_path / 'api' / 'gear.json').read_text())
+    assert gear[0]['affiliate_id'] == 'jackery-explorer-240'
+    assert (tmp_path / 'api' / 'blog-post' / 'guerilla-camping-101.json').exists()
+
+    redirects = (tmp_path / '_redirects').read_text()
+    assert '/affiliate/4patriots-food https://4patriots.com/products/4week-food?drolid=0001 302' in redirects
+    assert '/social/reddit https://www.reddit.com/r/gorillacamping 302' in redirects
+    assert '/api/gear /api/gear.json 200' in redirects
+    assert (tmp_path / 'css' / 'guerilla.css').exists()
+
+def test_frozen_blog_list_holds_every_page(tmp_path, monkeypatch):
+    import freeze as freeze_module
+    monkeypatch.setattr(freeze_module, 'MAX_LIMIT', 2)  # crawl the three sample posts over two pages
+    freeze(str(tmp_path))
+    posts = json.loads((tmp_path / 'api' / 'blog-posts.json').read_text())
+    assert [post['slug'] for post in posts] == [
+        'power-solutions-digital-nomads', 'guerilla-camping-101', 'essential-camping-gear']
+    assert '/api/blog-posts /api/blog-posts.json 200' in (tmp_path / '_redirects').read_text()
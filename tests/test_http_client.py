@@ -0,0 +1,53 @@
+import pytest
+import requests
+import app as app_module
+from http_client import HTTPClient, CircuitOpenError, UpstreamError
+
+def flaky(failures):
+    calls = []
+    def fn():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise requests.ConnectionError('boom')
+        return 'ok'
+    return fn, calls
+
+def test_retries_transient_errors():
+    client = HTTPClient(max_retries=2, backoff=0)
+    fn, calls = flaky(2)
+    assert client.call('gemini', fn) == 'ok'
+    assert len(calls) == 3
+    stats = client.stats()['gemini']
+    assert stats['retries'] == 2
+    assert stats['errors'] == 2
+    assert stats['circuit'] == 'closed'
+
+def test_circuit_opens_and_rejects():
+    client = HTTPClient(max_retries=0, backoff=0, failure_threshold=2, reset_timeout=60)
+    fn, calls = flaky(10)
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            client.call('ollama', fn)
+    with pytest.raises(CircuitOpenError):
+        client.call('ollama', fn)
+    assert len(calls) == 2
+    assert client.stats()['ollama']['circuit'] == 'open'
+    assert client.stats()['ollama']['rejected'] == 1
+
+def test_half_open_trial_closes_circuit():
+    client = HTTPClient(max_retries=0, backoff=0, failure_threshold=1, reset_timeout=0)
+    fn, calls = flaky(1)
+    with pytest.raises(UpstreamError):
+        client.call('openai', fn)
+    assert client.call('openai', fn) == 'ok'
+    assert client.stats()['openai']['circuit'] == 'closed'
+
+def test_unhealthy_provider_uses_fallback_responses(monkeypatch):
+    client = HTTPClient(max_retries=0, backoff=0, failure_threshold=1, reset_timeout=60)
+    client.breaker('gemini').record_failure()
+    monkeypatch.setattr(app_module, 'outbound', client)
+    monkeypatch.setattr(app_module, 'AI_PROVIDER', 'gemini')
+    monkeypatch.setattr(app_module, 'GEMINI_API_KEY', 'test-key')
+    with app_module.app.test_request_context('/api/guerilla-chat'):
+        reply = app_module.guerilla_ai_response('how do I charge my phone off-grid?')
+    assert reply in app_module.FALLBACK_RESPONSES
@@ -0,0 +1,34 @@
+from lazy import Lazy
+
+def test_builds_once_and_reuses():
+    calls = []
+    value = Lazy(lambda: calls.append(1) or len(calls))
+    assert not value.loaded
+    assert value.get() == 1
+    assert value.get() == 1
+    assert value.loaded and calls == [1]
+
+def test_failed_init_is_retried():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError('not yet')
+        return 'ready'
+
+    value = Lazy(flaky)
+    try:
+        value.get()
+    except ConnectionError:
+        pass
+    assert not value.loaded
+    assert value.get() == 'ready'
+
+def test_rebuilt_in_a_forked_process(monkeypatch):
+    calls = []
+    value = Lazy(lambda: calls.append(1) or len(calls))
+    assert value.get() == 1
+    monkeypatch.setattr('lazy.os.getpid', lambda: -1)  # as seen from a forked worker
+    assert not value.loaded
+    assert value.get() == 2
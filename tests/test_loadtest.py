@@ -0,0 +1,53 @@
+import os
+import sys
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from loadtest import compare  # noqa: E402
+from stubs import StubServer  # noqa: E402
+
+
+def route(rps, p95):
+    return {'requests': 100, 'errors': 0, 'rps': rps, 'p50_ms': p95 / 2, 'p95_ms': p95, 'p99_ms': p95}
+
+
+def report(**routes):
+    return {'results': {'sync:2:1': {'routes': routes}}}
+
+
+def test_compare_flags_throughput_and_latency_regressions():
+    baseline = report(affiliate=route(100, 20), chat=route(10, 300))
+    assert compare(report(affiliate=route(90, 22), chat=route(10, 310)), baseline, 0.25) == []
+    regressions = compare(report(affiliate=route(50, 20), chat=route(10, 500)), baseline, 0.25)
+    assert len(regressions) == 2
+    assert 'affiliate' in regressions[0] and 'p95' in regressions[1]
+
+
+def test_compare_ignores_small_absolute_latency_changes():
+    assert compare(report(blog=route(100, 3)), report(blog=route(100, 1)), 0.25) == []
+
+
+def test_stub_server_answers_each_upstream():
+    server = StubServer(latency=0).start()
+    try:
+        env = server.env('gemini')
+        gemini = requests.post(env['GEMINI_BASE_URL'] + ':generateContent', json={}, timeout=5).json()
+        assert gemini['candidates'][0]['content']['parts'][0]['text']
+        ollama = requests.post(env['OLLAMA_URL'] + '/api/generate', json={'stream': False}, timeout=5).json()
+        assert ollama['done']
+        imported = requests.post(f"{env['MAILERLITE_API_URL']}/groups/42/subscribers/import",
+                                 json={'subscribers': [{'email': 'a@b.co'}]}, timeout=5).json()
+        assert imported['errors'] == []
+        assert server.calls['mailerlite_subscribers'] == 1
+    finally:
+        server.stop()
+
+
+def test_stub_server_fails_at_the_error_rate():
+    server = StubServer(latency=0, error_rate=1.0).start()
+    try:
+        assert requests.post(server.url + '/v1/chat/completions', json={}, timeout=5).status_code == 503
+    finally:
+        server.stop()
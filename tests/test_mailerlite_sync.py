@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+from mailerlite_sync import MailerLiteSync, pending_sync_fields
+from storage import MemoryRepository
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+class FakeMailerLite:
+    def __init__(self, errors=(), fail=False):
+        self.errors = list(errors)
+        self.fail = fail
+        self.imports = []
+
+    def post(self, upstream, url, json=None, headers=None):
+        if self.fail:
+            raise ConnectionError('MailerLite down')
+        emails = [sub['email'] for sub in json['subscribers']]
+        self.imports.append(emails)
+        return FakeResponse({'errors': [{'email': email, 'message': 'invalid'}
+                                        for email in self.errors if email in emails]})
+
+def make_repository(*emails):
+    repository = MemoryRepository()
+    for email in emails:
+        repository.add_subscriber(dict(email=email, **pending_sync_fields()))
+    return repository
+
+def test_sync_pending_imports_in_batches():
+    repository = make_repository('a@example.com', 'b@example.com', 'c@example.com')
+    http = FakeMailerLite(errors=['c@example.com'])
+    outbox = MailerLiteSync(repository, http, 'key', group_id='42', batch_size=2)
+    assert outbox.sync_pending() == 2
+    assert outbox.sync_pending() == 1
+    assert http.imports == [['a@example.com', 'b@example.com'], ['c@example.com']]
+    assert outbox.status_counts() == {'pending': 1, 'synced': 2, 'dead': 0}
+    assert repository.find_subscriber('c@example.com')['mailerlite_attempts'] == 1
+
+def test_failures_back_off_then_dead_letter():
+    repository = make_repository('a@example.com')
+    outbox = MailerLiteSync(repository, FakeMailerLite(fail=True), 'key', group_id='42', max_attempts=2)
+    outbox.sync_pending()
+    sub = repository.find_subscriber('a@example.com')
+    assert sub['mailerlite_status'] == 'pending'
+    assert sub['mailerlite_next_attempt_at'] > datetime.utcnow()
+    assert outbox.sync_pending() == 0  # not due yet
+
+    repository.db.subscribers.update_one({}, {'$set': {'mailerlite_next_attempt_at': datetime.utcnow() - timedelta(seconds=1)}})
+    outbox.sync_pending()
+    assert repository.find_subscriber('a@example.com')['mailerlite_status'] == 'dead'
+
+    assert outbox.requeue('dead') == 1
+    outbox.http = FakeMailerLite()
+    outbox.sync_pending()
+    assert repository.find_subscriber('a@example.com')['mailerlite_status'] == 'synced'
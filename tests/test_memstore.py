@@ -0,0 +1,98 @@
+import os
+import threading
+from datetime import datetime
+
+import pytest
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from memstore import MemoryDatabase
+
+
+def test_find_supports_query_operators_projection_and_sort():
+    db = MemoryDatabase()
+    db.posts.insert_many([
+        {'slug': 'a', 'status': 'published', 'tags': ['power'], 'created_at': datetime(2025, 7, 1)},
+        {'slug': 'b', 'status': 'draft', 'tags': ['water'], 'created_at': datetime(2025, 7, 2)},
+        {'slug': 'c', 'status': 'published', 'tags': ['water'], 'created_at': datetime(2025, 7, 3)},
+    ])
+    query = {'status': 'published', 'created_at': {'$lt': datetime(2025, 7, 5)},
+             '$or': [{'tags': 'water'}, {'slug': {'$in': ['a']}}]}
+    posts = list(db.posts.find(query, {'slug': 1, '_id': 0}).sort('created_at', -1).limit(5))
+    assert posts == [{'slug': 'c'}, {'slug': 'a'}]
+    assert db.posts.count_documents({'missing': {'$exists': False}}) == 3
+    assert 'tags' not in db.posts.find_one({'slug': 'b'}, {'tags': 0})
+
+
+def test_upsert_respects_unique_index():
+    db = MemoryDatabase()
+    db.subscribers.create_index([('email', 1)], unique=True)
+    result = db.subscribers.update_one({'email': 'a@example.com'}, {'$setOnInsert': {'source': 'blog'}}, upsert=True)
+    assert result.upserted_id is not None
+    result = db.subscribers.update_one({'email': 'a@example.com'}, {'$setOnInsert': {'source': 'x'}}, upsert=True)
+    assert result.upserted_id is None and result.matched_count == 1
+    with pytest.raises(DuplicateKeyError):
+        db.subscribers.insert_one({'email': 'a@example.com'})
+    assert db.subscribers.find_one()['source'] == 'blog'
+
+
+def test_bulk_write_and_group():
+    db = MemoryDatabase()
+    db.rollups.bulk_write([
+        UpdateOne({'_id': 'x'}, {'$inc': {'n': 2}, '$setOnInsert': {'kind': 'a'}}, upsert=True),
+        UpdateOne({'_id': 'x'}, {'$inc': {'n': 3}}, upsert=True),
+        UpdateOne({'_id': 'y'}, {'$inc': {'n': 1}, '$setOnInsert': {'kind': 'b'}}, upsert=True),
+    ])
+    assert db.rollups.find_one({'_id': 'x'}) == {'_id': 'x', 'kind': 'a', 'n': 5}
+    rows = list(db.rollups.aggregate([{'$group': {'_id': None, 'total': {'$sum': '$n'}, 'top': {'$max': '$n'}}}]))
+    assert rows == [{'_id': None, 'total': 6, 'top': 5}]
+
+
+def test_event_streams_are_capped_ring_buffers_with_interned_strings():
+    db = MemoryDatabase(max_events=3)
+    for i in range(5):
+        db.affiliate_clicks.insert_one({'product_id': 'jackery-' + 'explorer-240', 'n': i})
+    clicks = list(db.affiliate_clicks.find())
+    assert [click['n'] for click in clicks] == [2, 3, 4]
+    assert db.stats()['affiliate_clicks'] == {'documents': 3, 'dropped': 2}
+    records = list(db.affiliate_clicks._events)
+    assert records[0].product_id is records[2].product_id
+    assert not hasattr(records[0], '__dict__')
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / 'store.json')
+    db = MemoryDatabase(snapshot_path=path, snapshot_interval=0)
+    db.subscribers.insert_one({'email': 'a@example.com', 'timestamp': datetime(2025, 7, 1, 8)})
+    db.ai_usage.insert_one({'provider': 'gemini', 'estimated_cost': 0.01})
+    db.close()
+
+    restored = MemoryDatabase(snapshot_path=path)
+    assert restored.subscribers.find_one({}, {'_id': 0}) == {'email': 'a@example.com', 'timestamp': datetime(2025, 7, 1, 8)}
+    assert restored.ai_usage.find_one()['provider'] == 'gemini'
+
+
+def test_snapshot_while_writing(tmp_path):
+    path = str(tmp_path / 'store.json')
+    db = MemoryDatabase(snapshot_path=path, snapshot_interval=0)
+    stop = threading.Event()
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            db.affiliate_clicks.insert_one({'product_id': f'p{i % 7}'})
+            db.counters.update_one({'_id': 'c'}, {'$inc': {f'n{i % 50}': 1}}, upsert=True)
+            i += 1
+
+    writers = [threading.Thread(target=write) for _ in range(2)]
+    for thread in writers:
+        thread.start()
+    try:
+        for _ in range(10):
+            db.snapshot()
+    finally:
+        stop.set()
+        for thread in writers:
+            thread.join()
+    assert MemoryDatabase(snapshot_path=path).stats()['affiliate_clicks']['documents'] > 0
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
@@ -0,0 +1,20 @@
+from datetime import datetime
+import pytest
+import pagination
+
+def test_cursor_round_trip():
+    created = datetime(2025, 7, 5, 12, 30)
+    cursor = pagination.encode_cursor(created, '64b0c0ffee')
+    assert pagination.decode_cursor(cursor) == (created, '64b0c0ffee')
+    with pytest.raises(pagination.InvalidCursor):
+        pagination.decode_cursor('garbage!')
+
+def test_keyset_filter_breaks_ties_on_id():
+    created = datetime(2025, 7, 5)
+    query = pagination.keyset_filter(pagination.encode_cursor(created, 'b'))
+    assert query == {'$or': [{'created_at': {'$lt': created}}, {'created_at': created, '_id': {'$lt': 'b'}}]}
+
+def test_parse_limit_bounds():
+    assert pagination.parse_limit(None) == pagination.DEFAULT_LIMIT
+    assert pagination.parse_limit('0') == 1
+    assert pagination.parse_limit('1000') == pagination.MAX_LIMIT
@@ -0,0 +1,79 @@
+from conversations import MemoryConversationStore, make_message
+from prompts import ContextCache, PromptBuilder, TokenEstimator, rough_tokens
+
+
+def make_builder(budget=20):
+    return PromptBuilder("""
+        You are Guerilla.
+        Be blunt.
+        """, token_budget=budget, estimator=TokenEstimator(encoding_name=None))
+
+
+def history():
+    return [
+        {'role': 'user', 'content': 'old question', 'tokens': 15},
+        {'role': 'assistant', 'content': 'old answer', 'tokens': 10},
+        {'role': 'user', 'content': 'new question', 'tokens': 8},
+    ]
+
+
+def test_rough_tokens_counts_words_and_symbols():
+    assert rough_tokens('off-grid power station') == 6
+    assert rough_tokens('') == 0
+
+
+def test_text_prompt_uses_newest_history_within_budget():
+    prompt = make_builder().text('Best filter?', history())
+    assert prompt.text == "You are Guerilla.\nBe blunt.\n\nGuerilla: old answer\nUser: new question\nUser: Best filter?\nGuerilla:"
+    assert [msg['content'] for msg in prompt.history] == ['old answer', 'new question']
+    assert prompt.prompt_tokens > 18
+
+
+def test_chat_prompt_reuses_system_message():
+    builder = make_builder()
+    first = builder.chat('hi', [])
+    second = builder.chat('yo', history())
+    assert first.messages[0] is second.messages[0]
+    assert second.messages[-1] == {'role': 'user', 'content': 'yo'}
+
+
+def test_ollama_prompt_with_context_sends_only_the_message():
+    builder = make_builder()
+    prompt = builder.ollama('Best filter?', history(), context=[1, 2, 3])
+    assert prompt.text == 'Best filter?'
+    assert prompt.system is None
+    prompt = builder.ollama('Best filter?', history())
+    assert prompt.system == 'You are Guerilla.\nBe blunt.'
+    assert prompt.text.endswith('User: Best filter?\nGuerilla:')
+
+
+def test_estimator_calibrates_towards_reported_counts():
+    estimator = TokenEstimator(encoding_name=None)
+    before = estimator.count('word ' * 100)
+    for _ in range(30):
+        estimator.observe(estimator.count('word ' * 100), 150)
+    assert before < estimator.count('word ' * 100) <= 150
+
+
+def test_context_cache_is_tied_to_the_last_exchange():
+    cache = ContextCache(max_entries=1)
+    history = [make_message('user', 'hi'), make_message('assistant', 'Yo.')]
+    cache.set('v1', 'hi', ' Yo. ', [1, 2])
+    assert cache.get('v1', history) == [1, 2]
+    assert cache.get('v1', history + [make_message('user', 'hi'), make_message('assistant', 'Later.')]) is None
+    assert cache.get('v1', []) is None
+    cache.set('v2', 'hi', 'Yo.', [3])
+    assert cache.get('v1', history) is None
+
+
+def test_context_cache_survives_history_trimmed_to_the_cap():
+    store = MemoryConversationStore(max_messages=4)
+    cache = ContextCache()
+    for turn in range(5):
+        history = store.history('v1')
+        if turn:
+            assert cache.get('v1', history) == [turn], f'no context reuse on turn {turn}'
+        message, answer = f'question {turn}', f'answer {turn}'
+        cache.set('v1', message, answer, [turn + 1])
+        store.append('v1', make_message('user', message), make_message('assistant', answer))
+    assert len(store.history('v1')) == 4
@@ -0,0 +1,94 @@
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import app as app_module
+from ratelimit import AIGate, MemoryBucketStore, MemorySpendStore, parse_rate
+
+
+def make_gate(**kwargs):
+    rates = kwargs.pop('rates', {'visitor': (2, 60)})
+    return AIGate(MemoryBucketStore(), MemorySpendStore(), rates, **kwargs)
+
+
+def test_parse_rate():
+    assert parse_rate('10/600') == (10.0, 600.0)
+
+
+def test_bucket_allows_burst_then_refills(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('ratelimit.time.monotonic', lambda: now[0])
+    buckets = MemoryBucketStore()
+    assert buckets.take('visitor:a', 2, 60)
+    assert buckets.take('visitor:a', 2, 60)
+    assert not buckets.take('visitor:a', 2, 60)
+    now[0] += 30  # half the period refills one token
+    assert buckets.take('visitor:a', 2, 60)
+    assert not buckets.take('visitor:a', 2, 60)
+
+
+def test_gate_reports_the_first_limit_hit():
+    gate = make_gate(rates={'visitor': (1, 60), 'ip': (5, 60)})
+    assert gate.check('v1', '1.2.3.4') is None
+    assert gate.check('v1', '1.2.3.4') == 'visitor_rate'
+    assert gate.check('v2', '1.2.3.4') is None
+    assert gate.stats()['denied'] == {'visitor_rate': 1}
+
+
+def test_gate_enforces_daily_budgets():
+    gate = make_gate(rates={}, visitor_budget=0.01, global_budget=0.05)
+    gate.record_spend('v1', 0.012)
+    assert gate.check('v1') == 'visitor_budget'
+    assert gate.check('v2') is None
+    gate.record_spend('v2', 0.04)
+    assert gate.check('v3') == 'global_budget'
+
+
+def test_spend_outside_the_window_is_ignored():
+    spend = MemorySpendStore()
+    spend.add('global', 100, 1.0)
+    spend.add('global', 130, 0.5)
+    assert spend.total('global', 107) == 0.5
+
+
+def test_over_budget_chat_gets_fallback_without_upstream_call(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app_module, 'GEMINI_API_KEY', 'test-key')
+    monkeypatch.setattr(app_module.outbound, 'post', lambda *args, **kwargs: calls.append(args))
+    monkeypatch.setattr(app_module, 'ai_gate', make_gate(rates={}, visitor_budget=0.01))
+    app_module.ai_gate.record_spend('over-budget', 1.0)
+
+    client = app_module.app.test_client()
+    client.set_cookie('visitor_id', 'over-budget')
+    rv = client.post('/api/guerilla-chat', json={'message': 'rate limit me please'})
+    assert rv.get_json()['response'] in app_module.FALLBACK_RESPONSES
+    assert calls == []
+
+
+def test_ip_limit_uses_the_forwarded_client_address(monkeypatch):
+    monkeypatch.setattr(app_module, 'ai_gate', make_gate(rates={'ip': (1, 600)}))
+    # What PROXY_FIX_HOPS=1 sets up behind a proxy
+    monkeypatch.setattr(app_module.app, 'wsgi_app', ProxyFix(app_module.app.wsgi_app, x_for=1, x_proto=1))
+    client = app_module.app.test_client()
+    for address in ('203.0.113.1', '203.0.113.2'):
+        rv = client.post('/api/guerilla-chat', json={'message': f'ip test from {address}'},
+                         headers={'X-Forwarded-For': address})
+        assert rv.status_code == 200
+    assert app_module.ai_gate.stats()['denied'] == {}
+
+
+def test_forwarded_address_is_ignored_without_a_proxy(monkeypatch):
+    monkeypatch.setattr(app_module, 'ai_gate', make_gate(rates={'ip': (1, 600)}))
+    client = app_module.app.test_client()
+    for address in ('203.0.113.1', '203.0.113.2'):
+        client.post('/api/guerilla-chat', json={'message': f'spoofed ip test from {address}'},
+                    headers={'X-Forwarded-For': address})
+    assert app_module.ai_gate.stats()['denied']
+
+
+def test_cookieless_chats_use_the_generated_visitor_id(monkeypatch):
+    checked = []
+    gate = make_gate(rates={})
+    original = gate.check
+    monkeypatch.setattr(gate, 'check', lambda visitor_id, ip=None: checked.append(visitor_id) or original(visitor_id, ip))
+    monkeypatch.setattr(app_module, 'ai_gate', gate)
+    rv = app_module.app.test_client().post('/api/guerilla-chat', json={'message': 'first visit, no cookie'})
+    assert checked == [rv.get_json()['visitor_id']]
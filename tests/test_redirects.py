@@ -0,0 +1,95 @@
+import redirects
+from redirects import ClickRecorder, LinkTables, classify_user_agent, enrich_click, normalize_referrer
+
+IPHONE = ('Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 '
+          '(KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1')
+EDGE = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+        'Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0')
+
+
+def test_tables_reload_when_the_version_moves():
+    source = {'version': 1, 'links': {'jackery': 'https://a.example'}}
+    tables = LinkTables(lambda: {'affiliate': dict(source['links'])}, version=lambda: source['version'],
+                        check_interval=30)
+    assert tables.get('affiliate', 'jackery') == 'https://a.example'
+
+    source['links'] = {'jackery': 'https://b.example'}
+    source['version'] = 2
+    assert tables.get('affiliate', 'jackery') == 'https://a.example'  # not checked again yet
+    tables._checked_at -= 30
+    assert tables.get('affiliate', 'jackery') == 'https://b.example'
+    assert tables.stats() == {'affiliate': 1, 'reloads': 1, 'errors': 0}
+
+
+def test_failed_reload_keeps_the_current_tables():
+    loads = [{'social': {'reddit': 'https://reddit.example'}}]
+
+    def load():
+        if len(loads) > 1:
+            raise ValueError('bad file')
+        return loads[0]
+
+    tables = LinkTables(load, check_interval=0)
+    loads.append(None)
+    assert tables.reload() is False
+    assert tables.get('social', 'reddit') == 'https://reddit.example'
+    assert tables.errors == 1
+
+
+def test_file_version_tracks_mtime(tmp_path):
+    path = tmp_path / 'links.json'
+    assert redirects.file_version(str(path)) == (None,)
+    path.write_text('{}')
+    assert redirects.file_version(str(path))[0] is not None
+
+
+def test_user_agent_and_referrer_enrichment():
+    assert classify_user_agent(IPHONE) == ('mobile', 'safari')
+    assert classify_user_agent(EDGE) == ('desktop', 'edge')
+    assert classify_user_agent('Googlebot/2.1 (+http://www.google.com/bot.html)')[0] == 'bot'
+    assert classify_user_agent(None) == ('unknown', 'unknown')
+    assert normalize_referrer('https://WWW.Reddit.com/r/vandwellers?utm_source=x#top') == (
+        'https://reddit.com/r/vandwellers', 'reddit.com')
+    assert normalize_referrer('not a url') == (None, None)
+
+    click = enrich_click({'product_id': 'jackery', 'referrer': 'https://www.tiktok.com/', 'user_agent': IPHONE})
+    assert (click['device'], click['browser'], click['referrer_host']) == ('mobile', 'safari', 'tiktok.com')
+
+
+def test_sampled_clicks_carry_their_weight(monkeypatch):
+    emitted = []
+    recorder = ClickRecorder(lambda stream, doc: emitted.append(doc), sample_rate=0.25)
+    rolls = iter([0.1, 0.9, 0.2, 0.5])
+    monkeypatch.setattr(redirects.random, 'random', lambda: next(rolls))
+    for _ in range(4):
+        recorder.record('jackery')
+    assert [doc['weight'] for doc in emitted] == [4.0, 4.0]
+    assert recorder.stats()['sampled_out'] == 2
+
+
+def test_spikes_are_aggregated_per_product():
+    emitted = []
+    recorder = ClickRecorder(lambda stream, doc: emitted.append(doc), spike_threshold=2, aggregate_interval=60)
+    for product in ['jackery', 'jackery', 'jackery', 'lifestraw', 'jackery']:
+        recorder.record(product, user_agent='Mozilla/5.0')
+    assert len(emitted) == 2  # under the threshold: one event per click
+    assert recorder.stats()['pending'] == 3
+
+    recorder.flush()
+    aggregated = {doc['product_id']: doc['weight'] for doc in emitted[2:]}
+    assert aggregated == {'jackery': 2, 'lifestraw': 1}
+    assert all(doc['aggregated'] for doc in emitted[2:])
+
+
+def test_redirect_routes(monkeypatch):
+    from app import app
+    client = app.test_client()
+    rv = client.get('/social/reddit')
+    assert rv.status_code == 302
+    assert rv.headers['Location'] == 'https://www.reddit.com/r/gorillacamping'
+    assert client.get('/affiliate/not-a-product').headers['Location'] == '/gear'
+
+    monkeypatch.setenv('ADMIN_API_KEY', 'secret')
+    assert client.post('/api/admin/reload-links').status_code == 401
+    rv = client.post('/api/admin/reload-links?api_key=secret')
+    assert rv.get_json()['success'] is True
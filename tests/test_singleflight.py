@@ -0,0 +1,83 @@
+import threading
+import time
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+    results = []
+
+    def request():
+        call, leader = flight.begin('key')
+        if leader:
+            calls.append(1)
+            time.sleep(0.05)
+            flight.finish('key', {'response': 'answer', 'estimated_cost': 0.01})
+            results.append('answer')
+        else:
+            results.append(call.wait(1)['response'])
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ['answer'] * 8
+    assert flight.stats()['followers'] == 7
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_failed_leader_releases_followers_with_none():
+    flight = SingleFlight()
+    _, leader = flight.begin('key')
+    call, follower_leads = flight.begin('key')
+    assert leader and not follower_leads
+    flight.finish('key', None)
+    assert call.wait(1) is None
+    assert flight.begin('key')[1]
+
+
+class FakeLock:
+    def __init__(self, holder=None):
+        self.holder = holder
+
+    def acquire(self, key, owner):
+        if self.holder:
+            return False
+        self.holder = owner
+        return True
+
+    def held(self, key):
+        return self.holder is not None
+
+    def release(self, key, owner):
+        if self.holder == owner:
+            self.holder = None
+
+
+def test_other_worker_holding_the_lock_is_waited_for():
+    shared_cache = {}
+    lock = FakeLock(holder='other-worker')
+    flight = SingleFlight(lock, peek=shared_cache.get, poll_interval=0.01)
+
+    def other_worker_finishes():
+        time.sleep(0.05)
+        shared_cache['key'] = {'response': 'from worker 2', 'estimated_cost': 0.01}
+
+    threading.Thread(target=other_worker_finishes).start()
+    call, leader = flight.begin('key')
+    assert not leader
+    assert call.wait(0)['response'] == 'from worker 2'
+    assert flight.stats()['remote_followers'] == 1
+
+
+def test_lock_released_without_answer_makes_us_leader():
+    lock = FakeLock(holder='other-worker')
+    flight = SingleFlight(lock, peek=lambda key: None, poll_interval=0.01)
+    threading.Timer(0.03, lambda: setattr(lock, 'holder', None)).start()
+    _, leader = flight.begin('key')
+    assert leader
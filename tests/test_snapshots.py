@@ -0,0 +1,51 @@
+import gzip
+
+import snapshots
+from snapshots import Snapshot, SnapshotCache, parse_accept_encoding
+
+BIG = [{'name': f'item {i}', 'description': 'solar panel ' * 5} for i in range(20)]
+
+
+def test_variants_are_precomputed_and_smaller():
+    snapshot = Snapshot.from_data(BIG)
+    assert gzip.decompress(snapshot.variants['gzip']) == snapshot.body
+    assert all(len(data) < len(snapshot.body) for data in snapshot.variants.values())
+    assert ('br' in snapshot.variants) == (snapshots.brotli is not None)
+
+
+def test_small_and_error_bodies_are_not_compressed():
+    assert Snapshot.from_data({'ok': True}).variants == {}
+    assert Snapshot(snapshots.dump_json(BIG), status=404).variants == {}
+
+
+def test_encoding_negotiation():
+    snapshot = Snapshot.from_data(BIG)
+    snapshot.variants.setdefault('br', b'x')  # as if brotli were installed
+    assert snapshot.encoding_for('gzip, deflate, br') == 'br'
+    assert snapshot.encoding_for('gzip;q=1.0, br;q=0.5') == 'gzip'
+    assert snapshot.encoding_for('br;q=0, gzip') == 'gzip'
+    assert snapshot.encoding_for('*') == 'br'
+    assert snapshot.encoding_for('identity') is None
+    assert snapshot.encoding_for(None) is None
+    assert snapshot.representation('gzip')[1] == snapshot.etag + '-gzip'
+    assert parse_accept_encoding('GZIP ; q=0.3,,br;q=bad') == {'gzip': 0.3, 'br': 0.0}
+
+
+def test_cache_rebuilds_when_the_version_changes():
+    cache = SnapshotCache()
+    first_catalog, second_catalog = object(), object()
+    first = cache.get('gear', first_catalog, lambda: BIG)
+    assert cache.get('gear', first_catalog, lambda: 1 / 0) is first
+    second = cache.get('gear', second_catalog, lambda: BIG[:1])
+    assert second is not first
+    assert cache.stats() == {'entries': 1, 'builds': 2}
+
+
+def test_response_headers_are_built_once_per_variant():
+    snapshot = Snapshot.from_data(BIG, headers={'X-Total-Count': '20'})
+    headers = snapshot.response_headers('gzip', 'public, max-age=60')
+    assert snapshot.response_headers('gzip', 'public, max-age=60') is headers
+    assert ('Content-Encoding', 'gzip') in headers
+    assert ('ETag', f'"{snapshot.etag}-gzip"') in headers
+    assert ('X-Total-Count', '20') in headers
+    assert ('Content-Encoding', 'gzip') not in snapshot.response_headers(None, 'public, max-age=60')
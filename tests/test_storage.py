@@ -0,0 +1,209 @@
+"""Conformance tests every storage backend has to pass.
+
+Set TEST_MONGODB_URI to run them against a real MongoDB as well.
+"""
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from analytics import Rollups
+from mailerlite_sync import pending_sync_fields
+from storage import MemoryRepository, MongoRepository, SQLiteRepository, create_repository
+
+BACKENDS = ['memory', 'sqlite', 'mongo']
+
+
+@pytest.fixture(params=BACKENDS)
+def repository(request, tmp_path):
+    if request.param == 'memory':
+        repo = MemoryRepository()
+    elif request.param == 'sqlite':
+        repo = SQLiteRepository(str(tmp_path / 'test.db'))
+    else:
+        uri = os.environ.get('TEST_MONGODB_URI')
+        if not uri:
+            pytest.skip('TEST_MONGODB_URI is not set')
+        from pymongo import MongoClient
+        db = MongoClient(uri).get_default_database()
+        for name in ('subscribers', 'posts', 'affiliate_clicks', 'ai_usage', 'analytics_rollups'):
+            db[name].drop()
+        db.subscribers.create_index('email', unique=True)
+        repo = MongoRepository(db)
+    yield repo
+    repo.close()
+
+
+def posts(count):
+    return [{
+        'slug': f'post-{i}',
+        'title': f'Post {i}',
+        'status': 'draft' if i == 0 else 'published',
+        'created_at': datetime(2025, 7, 1) + timedelta(days=i),
+        'content': f'<p>{i}</p>',
+        'category': 'power' if i % 2 else 'water',
+        'tags': ['solar'] if i % 3 == 0 else [],
+    } for i in range(count)]
+
+
+def test_events_round_trip(repository):
+    repository.record_click({'product_id': 'lifestraw-filter', 'timestamp': datetime(2025, 7, 1, 9), 'visitor_id': 'v1'})
+    repository.record_events('ai_usage', [
+        {'provider': 'gemini', 'prompt_tokens': 10, 'cache_hit': False, 'timestamp': datetime(2025, 7, 1)},
+        {'provider': 'openai', 'prompt_tokens': 20, 'note': 'extra field', 'timestamp': datetime(2025, 7, 2)},
+    ])
+    assert repository.count('affiliate_clicks') == 1
+    assert repository.count('ai_usage') == 2
+
+    click = next(iter(repository.iter_events('affiliate_clicks')))
+    assert click['product_id'] == 'lifestraw-filter'
+    assert click['timestamp'] == datetime(2025, 7, 1, 9)
+
+    usage = list(repository.iter_events('ai_usage', ('provider', 'prompt_tokens', 'note'), batch_size=1))
+    assert [doc['provider'] for doc in usage] == ['gemini', 'openai']
+    assert usage[1]['note'] == 'extra field'
+    assert 'timestamp' not in usage[0]
+
+
+def test_event_time_ranges(repository):
+    repository.record_events('ai_usage', [
+        {'provider': 'gemini', 'timestamp': datetime(2025, 7, 2, 12)},
+        {'provider': 'openai', 'timestamp': datetime(2025, 7, 1, 23)},
+        {'provider': 'ollama', 'timestamp': datetime(2025, 7, 2, 1)},
+        {'provider': 'gemini', 'timestamp': datetime(2025, 7, 3)},
+    ])
+    day = dict(start=datetime(2025, 7, 2), end=datetime(2025, 7, 3))
+    usage = list(repository.iter_events('ai_usage', ('provider', 'timestamp'), batch_size=1, **day))
+    assert [doc['provider'] for doc in usage] == ['ollama', 'gemini']  # oldest first
+    assert repository.count('ai_usage', **day) == 2
+    assert repository.oldest_event_time('ai_usage') == datetime(2025, 7, 1, 23)
+    assert repository.oldest_event_time('affiliate_clicks') is None
+
+    assert repository.delete_events('ai_usage', **day) == 2
+    assert repository.count('ai_usage') == 2
+    assert repository.count('ai_usage', start=datetime(2025, 7, 2)) == 1
+
+
+def test_iter_subscribers_filters(repository):
+    for i, source in enumerate(('blog', 'footer', 'blog')):
+        repository.add_subscriber(dict(email=f'{i}@example.com', source=source, timestamp=datetime(2025, 7, 1 + i),
+                                       **pending_sync_fields()))
+    repository.outbox_synced(['2@example.com'])
+    emails = lambda **filters: [sub['email'] for sub in repository.iter_subscribers(batch_size=1, **filters)]
+    assert emails() == ['0@example.com', '1@example.com', '2@example.com']
+    assert emails(source='blog') == ['0@example.com', '2@example.com']
+    assert emails(status='pending', source='blog') == ['0@example.com']
+    assert emails(since=datetime(2025, 7, 2), until=datetime(2025, 7, 3)) == ['1@example.com']
+
+
+def test_add_subscriber_is_idempotent(repository):
+    subscriber = dict(email='a@example.com', source='blog', timestamp=datetime.utcnow(), active=True,
+                      **pending_sync_fields())
+    assert repository.add_subscriber(dict(subscriber))
+    assert not repository.add_subscriber(dict(subscriber, source='footer'))
+    stored = repository.find_subscriber('a@example.com')
+    assert stored['source'] == 'blog'
+    assert stored['mailerlite_status'] == 'pending'
+    assert repository.find_subscriber('b@example.com') is None
+
+
+def test_list_posts_pages_and_filters(repository):
+    repository.add_posts(posts(7))
+    page, cursor, total = repository.list_posts(4)
+    assert total == 6
+    assert [post['slug'] for post in page] == ['post-6', 'post-5', 'post-4', 'post-3']
+    assert 'content' not in page[0]
+    assert isinstance(page[0]['_id'], str)
+
+    page, cursor, _ = repository.list_posts(4, cursor)
+    assert [post['slug'] for post in page] == ['post-2', 'post-1']
+    assert cursor is None
+
+    page, _, total = repository.list_posts(10, fields=('slug',), tag='solar')
+    assert total == 2
+    assert page == [{'slug': 'post-6'}, {'slug': 'post-3'}]
+
+    page, _, total = repository.list_posts(10, fields=('slug', 'created_at'), category='water')
+    assert [post['slug'] for post in page] == ['post-6', 'post-4', 'post-2']
+    assert page[0]['created_at'] == datetime(2025, 7, 7)
+
+
+def test_get_post_and_watermark(repository):
+    assert repository.posts_watermark() == ((0, None), None)
+    repository.add_posts(posts(3))
+    post = repository.get_post('post-2')
+    assert post['content'] == '<p>2</p>'
+    assert post['created_at'] == datetime(2025, 7, 3)
+    assert repository.get_post('post-0') is None  # draft
+    assert repository.posts_watermark() == ((2, datetime(2025, 7, 3)), datetime(2025, 7, 3))
+
+
+def test_rollups(repository):
+    rollups = Rollups(repository)
+    rollups.record('affiliate_clicks', [{'product_id': 'a', 'timestamp': datetime(2025, 7, 1)}] * 2)
+    rollups.record('ai_usage', [{'provider': 'gemini', 'estimated_cost': 0.5, 'timestamp': datetime(2025, 7, 2)}])
+    summary = rollups.summary(group_by='product')
+    assert summary['affiliate_clicks'] == 2
+    assert summary['estimated_ai_cost'] == 0.5
+    assert summary['groups'][0]['key'] == 'a'
+    assert rollups.summary(start='2025-07-02')['affiliate_clicks'] == 0
+
+    repository.record_click({'product_id': 'b', 'timestamp': datetime(2025, 7, 3)})
+    rollups.rebuild()
+    assert [row['key'] for row in rollups.summary(group_by='product')['groups']] == ['b']
+
+
+def test_outbox(repository):
+    for email in ('a@example.com', 'b@example.com', 'c@example.com'):
+        repository.add_subscriber(dict(email=email, **pending_sync_fields()))
+
+    claimed = repository.claim_outbox(2, claim_timeout=300)
+    assert [sub['email'] for sub in claimed] == ['a@example.com', 'b@example.com']
+    assert [sub['email'] for sub in repository.claim_outbox(2, claim_timeout=300)] == ['c@example.com']
+    assert repository.claim_outbox(2, claim_timeout=300) == []
+
+    repository.outbox_synced(['a@example.com'])
+    later = datetime.utcnow() + timedelta(hours=1)
+    repository.outbox_failed(['b@example.com'], 'rejected', lambda attempts: later)
+    repository.outbox_failed(['c@example.com'], 'rejected', lambda attempts: None)
+    assert repository.outbox_counts() == {'pending': 1, 'synced': 1, 'dead': 1}
+
+    retried = repository.find_subscriber('b@example.com')
+    assert retried['mailerlite_attempts'] == 1
+    assert retried['mailerlite_error'] == 'rejected'
+    assert abs(retried['mailerlite_next_attempt_at'] - later) < timedelta(milliseconds=1)
+    assert repository.claim_outbox(2, claim_timeout=300) == []  # b isn't due yet
+
+    assert [sub['email'] for sub in repository.subscribers_with_status('dead')] == ['c@example.com']
+    assert repository.outbox_requeue('dead') == 1
+    assert [sub['email'] for sub in repository.claim_outbox(2, claim_timeout=300)] == ['c@example.com']
+
+
+def test_sqlite_uses_wal(tmp_path):
+    repository = SQLiteRepository(str(tmp_path / 'wal.db'))
+    assert repository._query('PRAGMA journal_mode')[0][0] == 'wal'
+    repository.close()
+
+
+def test_sqlite_adds_new_event_columns(tmp_path):
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE affiliate_clicks (id INTEGER PRIMARY KEY, timestamp, product_id, visitor_id, '
+                 'referrer, user_agent, extra TEXT)')
+    conn.execute("INSERT INTO affiliate_clicks (timestamp, product_id, extra) VALUES "
+                 "('2025-07-01T09:00:00.000000', 'lifestraw-filter', '{\"device\": \"mobile\"}')")
+    conn.commit()
+    conn.close()
+
+    repository = SQLiteRepository(path)
+    repository.record_click({'product_id': 'jackery-explorer-240', 'timestamp': datetime(2025, 7, 2),
+                             'device': 'desktop', 'weight': 3})
+    assert [click['device'] for click in repository.iter_events('affiliate_clicks')] == ['mobile', 'desktop']
+    assert repository._query('SELECT weight FROM affiliate_clicks WHERE weight IS NOT NULL')[0][0] == 3
+    repository.close()
+
+
+def test_create_repository(tmp_path):
+    assert create_repository('mongo', MemoryRepository().db).backend == 'memory'
+    assert create_repository('sqlite', None, sqlite_path=str(tmp_path / 'app.db')).backend == 'sqlite'
@@ -0,0 +1,89 @@
+import json
+import threading
+
+import pytest
+
+import telemetry
+from telemetry import FileExporter, Histogram, Telemetry
+
+
+class ListExporter:
+    def __init__(self, block=None):
+        self.batches = []
+        self.block = block
+
+    def export(self, records):
+        if self.block is not None:
+            self.block.wait()
+        self.batches.append(records)
+
+
+def test_histogram_percentiles_are_close():
+    histogram = Histogram()
+    for value in range(1, 1001):
+        histogram.add(float(value))
+    summary = histogram.summary()
+    assert summary['count'] == 1000
+    assert summary['p50'] == pytest.approx(500, rel=0.1)
+    assert summary['p95'] == pytest.approx(950, rel=0.1)
+    assert summary['p99'] == pytest.approx(990, rel=0.1)
+    assert summary['max'] == 1000
+
+
+def test_snapshot_groups_by_kind_and_counts_errors():
+    metrics = Telemetry()
+    metrics.record('http', 'GET /api/gear', 2.0)
+    metrics.record('http', 'GET /api/gear', 4.0, error=True)
+    metrics.record('upstream', 'gemini', 300.0)
+    gear = metrics.snapshot()['http']['GET /api/gear']
+    assert gear['count'] == 2
+    assert gear['errors'] == 1
+    assert list(metrics.snapshot('upstream')) == ['gemini']
+
+
+def test_sampling_keeps_errors():
+    exporter = ListExporter()
+    metrics = Telemetry(exporter, sample_rate=0.0)
+    metrics.record('http', 'GET /', 1.0)
+    metrics.record('http', 'GET /', 1.0, error=True)
+    metrics.stop()
+    assert [record['error'] for batch in exporter.batches for record in batch] == [True]
+    assert metrics.stats()['sampled_out'] == 1
+    assert metrics.snapshot('http')['GET /']['count'] == 2  # histograms see everything
+
+
+def test_exports_in_batches_without_blocking_the_caller():
+    release = threading.Event()
+    exporter = ListExporter(block=release)
+    metrics = Telemetry(exporter, batch_size=2, flush_interval=60, max_queue=3)
+    for i in range(10):
+        metrics.record('db', 'find posts', float(i))  # exporter is stuck: the queue fills, then records drop
+    assert metrics.stats()['dropped'] > 0
+    release.set()
+    metrics.stop()
+    assert all(len(batch) <= 2 for batch in exporter.batches)
+    stats = metrics.stats()
+    assert stats['exported'] + stats['dropped'] == 10
+
+
+def test_file_exporter_writes_ndjson(tmp_path):
+    path = tmp_path / 'telemetry.ndjson'
+    metrics = Telemetry(FileExporter(str(path)))
+    with metrics.timer('ai', 'gemini', visitor='v1'):
+        pass
+    metrics.flush()
+    record = json.loads(path.read_text().splitlines()[0])
+    assert (record['kind'], record['name'], record['visitor']) == ('ai', 'gemini', 'v1')
+
+
+def test_create_exporter():
+    assert telemetry.create_exporter('none') is None
+    assert telemetry.create_exporter('azure') is None  # no connection string
+    assert isinstance(telemetry.create_exporter('file', 'x.ndjson'), FileExporter)
+
+
+def test_routes_are_timed():
+    from app import app, metrics
+    app.config['TESTING'] = True
+    app.test_client().get('/api/gear')
+    assert metrics.snapshot('http')['GET /api/gear']['count'] >= 1